@@ -0,0 +1,141 @@
+"""This file checks the matchings of pairs_mining on small matrices whose expected pairs are known.
+
+The check fails (exit code 1) if a matching differs from the expected one.
+
+    python DCREmbeddings/benchmarks/check_matching.py
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','similarity_search'))
+from instrumentation import Collector
+from numpy_model import NumpyEmbeddingModel
+from pairs_mining import get_matching_from_matrix,get_matrix_similarity_pairs,get_pairs_from_matrix_and_proportion,get_pairs_from_matrix_and_threshold
+
+
+def get_rectangular_matrix(shape):
+    """Returns a distance matrix (all distances under 1) with labels t1_i on the rows and t0_j on the columns."""
+    distance_matrix = np.arange(1,shape[0]*shape[1]+1,dtype=np.float32).reshape(shape)/(shape[0]*shape[1]+1)
+    return distance_matrix,np.array(['t1_'+str(i) for i in range(shape[0])]),np.array(['t0_'+str(j) for j in range(shape[1])])
+
+
+def check_rectangular_mixed(shape,strategy='greedy'):
+    """
+    A t1×t0 matrix matched with the default mode (mixed) gives the pairs of mode treatment_sort :
+    min(shape) pairs, the rows and the columns being masked separately.
+    """
+    distance_matrix,row_labels,col_labels = get_rectangular_matrix(shape)
+    pairs_mixed = get_pairs_from_matrix_and_threshold(distance_matrix,1,strategy=strategy,row_labels=row_labels,col_labels=col_labels)
+    pairs_treatment = get_pairs_from_matrix_and_threshold(distance_matrix,1,strategy=strategy,mode='treatment_sort',row_labels=row_labels,col_labels=col_labels)
+    return pairs_mixed == pairs_treatment and len(pairs_mixed) == min(shape)
+
+
+def check_rectangular_mixed_by_block(shape):
+    """The greedy matching streamed by blocks of a t1×t0 matrix in mixed mode is the one of mode treatment_sort."""
+    distance_matrix,_,_ = get_rectangular_matrix(shape)
+    rows_mixed,cols_mixed = get_matching_from_matrix(distance_matrix,1,max_candidates=2,block_size=2)
+    rows_treatment,cols_treatment = get_matching_from_matrix(distance_matrix,1,mode='treatment_sort')
+    return np.array_equal(rows_mixed,rows_treatment) and np.array_equal(cols_mixed,cols_treatment) and len(rows_mixed) == min(shape)
+
+
+def check_rectangular_proportion(shape):
+    """The closest pairs of a t1×t0 matrix in mixed mode are the ones of mode treatment_sort."""
+    distance_matrix,row_labels,col_labels = get_rectangular_matrix(shape)
+    pairs_mixed = get_pairs_from_matrix_and_proportion(distance_matrix,sum(shape),proportion=1,row_labels=row_labels,col_labels=col_labels)
+    pairs_treatment = get_pairs_from_matrix_and_proportion(distance_matrix,sum(shape),proportion=1,mode='treatment_sort',row_labels=row_labels,col_labels=col_labels)
+    return pairs_mixed == pairs_treatment and len(pairs_mixed) == min(shape)
+
+
+def check_squared_different_labels():
+    """A squared matrix whose rows and columns are different instances is matched as in mode treatment_sort."""
+    distance_matrix,row_labels,col_labels = get_rectangular_matrix((4,4))
+    pairs_mixed = get_pairs_from_matrix_and_threshold(distance_matrix,1,row_labels=row_labels,col_labels=col_labels)
+    return len(pairs_mixed) == 4
+
+
+def check_squared_mixed():
+    """In mixed mode, an instance of a squared symmetric matrix is in one pair only."""
+    embeddings = np.array([[0.],[1.],[3.],[3.5]],dtype=np.float32)
+    distance_matrix = np.abs(embeddings-embeddings.T)
+    np.fill_diagonal(distance_matrix,np.inf)
+    labels = np.array(['a','b','c','d'])
+    pairs_ = get_pairs_from_matrix_and_threshold(distance_matrix,2,row_labels=labels,col_labels=labels)
+    return sorted(sorted(pair_) for pair_ in pairs_) == [['a','b'],['c','d']]
+
+
+def check_sparse_optimal(seed=0,number_checks=50):
+    """The optimal matching of a sparse candidate graph has the number of pairs and the total distance of the dense one."""
+    from scipy import sparse
+
+    rng = np.random.default_rng(seed)
+    for _ in range(number_checks):
+        shape = tuple(rng.integers(1,20,2))
+        candidates = rng.random(shape) < 0.3
+        distance_matrix = np.where(candidates,rng.random(shape),np.inf).astype(np.float32)
+        candidate_graph = sparse.csr_matrix((distance_matrix[candidates],np.nonzero(candidates)),shape=shape)
+        rows_dense,cols_dense = get_matching_from_matrix(distance_matrix,0.8,strategy='optimal',mode='treatment_sort')
+        rows_sparse,cols_sparse = get_matching_from_matrix(candidate_graph,0.8,strategy='optimal',mode='treatment_sort')
+        if len(rows_dense) != len(rows_sparse):
+            return False
+        if not np.isclose(distance_matrix[rows_dense,cols_dense].sum(),distance_matrix[rows_sparse,cols_sparse].sum()):
+            return False
+    return True
+
+
+def check_memmap_dataframe(mode='mixed',number_instances=60,seed=0):
+    """
+    The dataframe of get_matrix_similarity_pairs with memmap_path is matched by the banded matcher (streamed by blocks of rows),
+    by threshold and by proportion, with the pairs of the matrix computed in memory.
+    """
+    rng = np.random.default_rng(seed)
+    instances = ['e_'+str(i) for i in range(number_instances)]
+    model = NumpyEmbeddingModel(instances,['r'],rng.standard_normal((number_instances,8),dtype=np.float32),np.zeros((1,8),dtype=np.float32))
+    instances_t0,instances_t1 = instances[:number_instances//3],instances[number_instances//3:]
+    with tempfile.TemporaryDirectory() as directory:
+        df_memmap,_ = get_matrix_similarity_pairs(model,instances,mode=mode,instances_t0=instances_t0,instances_t1=instances_t1,memmap_path=os.path.join(directory,'matrix.npy'))
+        df,matrix = get_matrix_similarity_pairs(model,instances,mode=mode,instances_t0=instances_t0,instances_t1=instances_t1)
+        threshold = float(np.quantile(matrix[np.isfinite(matrix)],0.1))
+        with Collector() as collector:
+            pairs_threshold = get_pairs_from_matrix_and_threshold(df_memmap,threshold,mode=mode)
+            pairs_proportion = get_pairs_from_matrix_and_proportion(df_memmap,number_instances,proportion=0.01,mode=mode)
+        del df_memmap
+    by_block = collector.get_report()['timers'].get('matching_by_block',{}).get('calls',0) == 2
+    same_pairs = pairs_threshold == get_pairs_from_matrix_and_threshold(df,threshold,mode=mode)
+    same_pairs &= pairs_proportion == get_pairs_from_matrix_and_proportion(df,number_instances,proportion=0.01,mode=mode)
+    return by_block and same_pairs
+
+
+CHECKS = {
+    'rectangular_mixed_3x5_greedy':lambda: check_rectangular_mixed((3,5)),
+    'rectangular_mixed_5x3_greedy':lambda: check_rectangular_mixed((5,3)),
+    'rectangular_mixed_2x40_greedy':lambda: check_rectangular_mixed((2,40)),
+    'rectangular_mixed_3x5_optimal':lambda: check_rectangular_mixed((3,5),strategy='optimal'),
+    'rectangular_mixed_5x3_optimal':lambda: check_rectangular_mixed((5,3),strategy='optimal'),
+    'rectangular_mixed_by_block':lambda: check_rectangular_mixed_by_block((5,3)),
+    'rectangular_mixed_proportion':lambda: check_rectangular_proportion((3,5)),
+    'squared_different_labels':check_squared_different_labels,
+    'squared_mixed':check_squared_mixed,
+    'sparse_optimal':check_sparse_optimal,
+    'memmap_dataframe_mixed':check_memmap_dataframe,
+    'memmap_dataframe_treatment_sort':lambda: check_memmap_dataframe(mode='treatment_sort'),
+}
+
+
+def main():
+    results = {}
+    for name,check in CHECKS.items():
+        try:
+            results[name] = bool(check())
+        except Exception as error:
+            print(name,':',repr(error))
+            results[name] = False
+        print('{:<36}{}'.format(name,'ok' if results[name] else 'FAIL'))
+    sys.exit(0 if all(results.values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
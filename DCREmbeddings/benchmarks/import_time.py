@@ -0,0 +1,98 @@
+"""This file checks the import time of the modules of DCREmbeddings and that the heavy dependencies are not imported at load time.
+
+Each module is imported in a new interpreter, with the folders of the modules in sys.path as in the tutorials.
+The check fails (exit code 1) if a module takes more than the budget to import or imports a heavy dependency.
+
+    python DCREmbeddings/benchmarks/import_time.py [--budget 0.25] [--output import_time.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..')
+
+# module -> folder of the module
+MODULES = {
+    'instrumentation':'similarity_search',
+    'knowledge_graph':'similarity_search',
+    'kg_loader':'similarity_search',
+    'prediction_cache':'similarity_search',
+    'property_catalog':'similarity_search',
+    'distance_kernels':'similarity_search',
+    'embedding_cache':'similarity_search',
+    'numpy_model':'similarity_search',
+    'pairs_mining':'similarity_search',
+    'ann_index':'similarity_search',
+    'distance_threshold_estimation':'similarity_search',
+    'threshold_estimation':'similarity_search',
+    'metrics':'dcr_discovery',
+    'rule_mining':'dcr_discovery',
+    'synthetic_generation':'tutorials',
+    'plot_rules':'tutorials',
+}
+
+# dependencies only loaded by the functions that need them
+HEAVY_DEPENDENCIES = ['ampligraph','tensorflow','matplotlib','pandas','scipy.optimize','scipy.sparse','scipy.spatial']
+
+CHILD_CODE = """
+import json,sys,time
+sys.path[:0] = {paths}
+start = time.perf_counter()
+import {module}
+import_time = time.perf_counter()-start
+print(json.dumps({{'import_time':import_time,'heavy_dependencies':[m for m in {heavy} if m in sys.modules]}}))
+"""
+
+
+def get_import_time(module,folder):
+    """
+    Returns the import time (seconds) of a module in a new interpreter and the heavy dependencies it loaded.
+    The time of the interpreter start and of numpy (imported before the module) is not counted.
+    """
+    paths = [os.path.abspath(os.path.join(ROOT,folder_)) for folder_ in ['similarity_search','dcr_discovery','tutorials']]
+    code = "import numpy\n"+CHILD_CODE.format(paths=repr(paths),module=module,heavy=repr(HEAVY_DEPENDENCIES))
+    completed = subprocess.run([sys.executable,'-c',code],capture_output=True,text=True,cwd=os.path.join(ROOT,folder))
+    if completed.returncode != 0:
+        return {'import_time':None,'heavy_dependencies':[],'error':completed.stderr.strip().splitlines()[-1]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def check_import_times(budget=0.25,repeat=3):
+    """
+    Returns the dictionnary module -> result of the check (best import time of repeat runs, heavy dependencies, passed).
+    """
+    results = {}
+    for module,folder in MODULES.items():
+        runs = [get_import_time(module,folder) for _ in range(repeat)]
+        result = runs[0]
+        times = [run_['import_time'] for run_ in runs if run_['import_time'] is not None]
+        result['import_time'] = min(times) if len(times) > 0 else None
+        result['passed'] = 'error' not in result and result['import_time'] <= budget and len(result['heavy_dependencies']) == 0
+        results[module] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget',type=float,default=0.25,help='maximum import time of a module (seconds)')
+    parser.add_argument('--repeat',type=int,default=3,help='number of imports of each module, the best time is kept')
+    parser.add_argument('--output',default=None,help='path of the JSON file of the results')
+    args = parser.parse_args()
+
+    results = check_import_times(budget=args.budget,repeat=args.repeat)
+    for module,result in results.items():
+        import_time = 'error' if result['import_time'] is None else '{:.3f} s'.format(result['import_time'])
+        details = result.get('error',', '.join(result['heavy_dependencies']))
+        print('{:<32}{:>10}  {:<4}  {}'.format(module,import_time,'ok' if result['passed'] else 'FAIL',details))
+    if args.output is not None:
+        with open(args.output,'w') as f:
+            json.dump({'budget':args.budget,'results':results},f,indent=2)
+    sys.exit(0 if all(result['passed'] for result in results.values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+"""This file times the hot paths of the mining pipeline on synthetic knowledge graphs and writes the results in JSON.
+
+For each size of KG, a KG with the schema of the dbpedia extract and random embeddings are generated (see synthetic_kg),
+then each benchmark is run once to warm up, once under a Collector for the time of its stages, once under tracemalloc for the peak memory, and repeat times for the wall time (best time kept).
+The results can be compared with the results of another commit with --compare.
+
+    python DCREmbeddings/benchmarks/run_benchmarks.py --sizes 10000 100000 1000000 --output results.json
+    python DCREmbeddings/benchmarks/run_benchmarks.py --sizes 10000 --compare results.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..')
+for folder_ in ['similarity_search','dcr_discovery','tutorials']:
+    sys.path.append(os.path.join(ROOT,folder_))
+from distance_threshold_estimation import draw_set_of_pairs,get_measures_for_pairs
+from instrumentation import Collector
+from kg_loader import load_kg
+from knowledge_graph import get_knowledge_graph
+from metrics import compute_metric_dbpedia_categorial,compute_metric_dbpedia_numerical,compute_metric_vitamin,compute_metric_vitamin_not_functional,get_outcome_dbpedia
+from pairs_mining import get_matrix_similarity_pairs,get_pairs_from_matrix_and_proportion,get_pairs_from_matrix_and_threshold
+from rule_mining import get_rules
+from synthetic_generation import get_synthetic_instances
+from synthetic_kg import GENDER_PROPERTY,ONTOLOGY,TYPE_PROPERTY,get_random_model,get_synthetic_kg,save_kg
+
+
+PATH_OUTCOME = [[ONTOLOGY+'birthDate'],[ONTOLOGY+'author',ONTOLOGY+'releaseDate']]
+PATH_DIET = [ONTOLOGY+'author',ONTOLOGY+'releaseDate']
+PATH_IDEAL_DIET = [ONTOLOGY+'birthDate']
+DIC_FUNCTIONALITY = {
+    ONTOLOGY+'birthDate':1,GENDER_PROPERTY:1,ONTOLOGY+'genre':1,ONTOLOGY+'author':4,
+    ONTOLOGY+'releaseDate':1,ONTOLOGY+'numberOfPages':1
+}
+BLOCKED_P = [TYPE_PROPERTY,ONTOLOGY+'author']
+
+
+class BenchmarkContext:
+    """
+    KG, model and inputs shared by the benchmarks of one size of KG. The inputs are built once, outside of the timed calls.
+
+    Parameters :
+    number_triples : int
+    parameters_ : dictionnary of the parameters of the run (see main)
+    """
+
+    def __init__(self,number_triples,parameters_):
+        self.parameters = parameters_
+        self.X = get_synthetic_kg(number_triples,seed=parameters_['seed'])
+        self.kg = get_knowledge_graph(self.X)
+        self.model = get_random_model(self.X,k=parameters_['k'],seed=parameters_['seed'])
+        self.writers = sorted(self.kg.subjects(TYPE_PROPERTY,ONTOLOGY+'Writer'))
+        self.males = [w_ for w_ in self.writers if self.kg.objects(w_,GENDER_PROPERTY) == ['male']]
+        self.females = [w_ for w_ in self.writers if self.kg.objects(w_,GENDER_PROPERTY) == ['female']]
+        self.rng = np.random.default_rng(parameters_['seed'])
+        self.results = {}
+        self.directory = None
+
+    def sample(self,instances,number):
+        """Returns number instances drawn without replacement (all the instances if there are less)."""
+        if number >= len(instances):
+            return list(instances)
+        return [instances[i] for i in np.sort(self.rng.choice(len(instances),number,replace=False))]
+
+    def get_instances_t0_t1(self,max_instances):
+        """Returns the male (t0) and female (t1) writers, with max_instances writers in total."""
+        key_ = ('instances',max_instances)
+        if key_ not in self.results:
+            number_t1 = min(len(self.females),max_instances//2)
+            self.results[key_] = (self.sample(self.males,max_instances-number_t1),self.sample(self.females,number_t1))
+        return self.results[key_]
+
+    def get_matrix(self,max_instances):
+        """Returns the treatment_sort distance matrix (dataframe) of get_instances_t0_t1 and a distance threshold (1% quantile)."""
+        key_ = ('matrix',max_instances)
+        if key_ not in self.results:
+            instances_t0,instances_t1 = self.get_instances_t0_t1(max_instances)
+            df,matrix = get_matrix_similarity_pairs(self.model,instances_t0+instances_t1,mode='treatment_sort',instances_t0=instances_t0,instances_t1=instances_t1)
+            threshold = float(np.quantile(matrix[:256].ravel(),0.01))
+            self.results[key_] = (df,threshold)
+        return self.results[key_]
+
+    def get_csv_path(self):
+        """Returns the path of the KG saved in CSV in a temporary directory (deleted with the context)."""
+        if self.directory is None:
+            self.directory = tempfile.TemporaryDirectory()
+            save_kg(self.X,os.path.join(self.directory.name,'kg.csv'))
+        return os.path.join(self.directory.name,'kg.csv')
+
+    def get_metric_pairs(self):
+        """Returns pairs (male writer, female writer) of distinct writers, as the pairs of a matching."""
+        if 'metric_pairs' not in self.results:
+            number_pairs = min(len(self.males),len(self.females),self.parameters['metric_pairs'])
+            males,females = self.sample(self.males,number_pairs),self.sample(self.females,number_pairs)
+            self.results['metric_pairs'] = [[m_,f_] for m_,f_ in zip(males,females)]
+        return self.results['metric_pairs']
+
+
+####### BENCHMARKS : each function returns the function to time (without argument) and the description of its inputs
+
+def benchmark_knowledge_graph(context):
+    return (lambda: get_knowledge_graph(context.X.copy())),{}
+
+
+def benchmark_load_kg_stream(context):
+    path = context.get_csv_path()
+    return (lambda: load_kg(path)),{'file_size':os.path.getsize(path)}
+
+
+def benchmark_load_kg_cache(context):
+    path = context.get_csv_path()
+    cache_path = os.path.join(context.directory.name,'cache')
+    load_kg(path,cache_path=cache_path)
+    # the vocabulary is decoded as np.asarray(X) of the functions expecting X
+    return (lambda: np.asarray(load_kg(path,cache_path=cache_path))),{'file_size':os.path.getsize(path)}
+
+
+def benchmark_matrix_similarity_pairs(context):
+    instances_t0,instances_t1 = context.get_instances_t0_t1(context.parameters['max_instances'])
+    run = lambda: get_matrix_similarity_pairs(context.model,instances_t0+instances_t1,mode='treatment_sort',instances_t0=instances_t0,instances_t1=instances_t1)
+    return run,{'shape':[len(instances_t1),len(instances_t0)]}
+
+
+def benchmark_pairs_threshold_greedy(context):
+    df,threshold = context.get_matrix(context.parameters['max_instances'])
+    return (lambda: get_pairs_from_matrix_and_threshold(df,threshold,strategy='greedy',mode='treatment_sort')),{'shape':list(df.shape)}
+
+
+def benchmark_pairs_threshold_optimal(context):
+    df,threshold = context.get_matrix(context.parameters['max_instances_optimal'])
+    return (lambda: get_pairs_from_matrix_and_threshold(df,threshold,strategy='optimal',mode='treatment_sort')),{'shape':list(df.shape)}
+
+
+def benchmark_pairs_proportion(context):
+    df,_ = context.get_matrix(context.parameters['max_instances'])
+    return (lambda: get_pairs_from_matrix_and_proportion(df,sum(df.shape),proportion=0.05,mode='treatment_sort')),{'shape':list(df.shape)}
+
+
+def benchmark_measures_for_pairs(context):
+    pairs_ = draw_set_of_pairs(context.writers,min(context.parameters['measure_pairs'],len(context.writers)*(len(context.writers)-1)//2),seed=context.parameters['seed'])
+    run = lambda: get_measures_for_pairs(pairs_,context.model,context.kg,DIC_FUNCTIONALITY,[],TYPE_PROPERTY)
+    return run,{'number_pairs':len(pairs_)}
+
+
+def benchmark_metric_dbpedia_categorial(context):
+    pairs_ = context.get_metric_pairs()
+    return (lambda: compute_metric_dbpedia_categorial(pairs_,context.males,context.kg,PATH_OUTCOME)),{'number_pairs':len(pairs_)}
+
+
+def benchmark_metric_dbpedia_numerical(context):
+    pairs_ = context.get_metric_pairs()
+    return (lambda: compute_metric_dbpedia_numerical(pairs_,context.males,context.kg,[ONTOLOGY+'birthDate'],PATH_OUTCOME)),{'number_pairs':len(pairs_)}
+
+
+def benchmark_metric_vitamin(context):
+    # the paths of the vitamin dataset are mapped on the writers : treatment = gender, outcome = release date - birth date
+    pairs_ = context.get_metric_pairs()
+    return (lambda: compute_metric_vitamin(pairs_,context.kg,[GENDER_PROPERTY],PATH_DIET,PATH_IDEAL_DIET,'male','female')),{'number_pairs':len(pairs_)}
+
+
+def benchmark_metric_vitamin_not_functional(context):
+    pairs_ = context.get_metric_pairs()
+    return (lambda: compute_metric_vitamin_not_functional(pairs_,context.males,context.kg,PATH_DIET,PATH_IDEAL_DIET)),{'number_pairs':len(pairs_)}
+
+
+def benchmark_rules(context):
+    instances_t0,instances_t1 = context.get_instances_t0_t1(context.parameters['max_instances'])
+    _,threshold = context.get_matrix(context.parameters['max_instances'])
+    dic_distance_per_degree = {degree:[threshold*(1+degree/4)] for degree in range(4)}
+    run = lambda: get_rules(
+        context.model,context.kg,instances_t0+instances_t1,[[GENDER_PROPERTY]],dic_distance_per_degree,
+        outcome_function=get_outcome_dbpedia,outcome_args=(PATH_OUTCOME,),seed=context.parameters['seed']
+    )
+    return run,{'number_instances':len(instances_t0)+len(instances_t1),'number_degrees':len(dic_distance_per_degree)}
+
+
+def benchmark_synthetic_instances(context):
+    seed_instances = context.sample(context.writers,context.parameters['synthetic_instances'])
+    number_per_degree = max(1,context.parameters['synthetic_instances']//4)
+    degree_schedule = {degree:number_per_degree for degree in range(1,5)}
+    return (lambda: get_synthetic_instances(context.kg,seed_instances,degree_schedule,blocked_p=BLOCKED_P,seed=context.parameters['seed'])),{'number_instances':4*number_per_degree}
+
+
+BENCHMARKS = {
+    'get_knowledge_graph':benchmark_knowledge_graph,
+    'load_kg_stream':benchmark_load_kg_stream,
+    'load_kg_cache':benchmark_load_kg_cache,
+    'get_matrix_similarity_pairs':benchmark_matrix_similarity_pairs,
+    'get_pairs_from_matrix_and_threshold_greedy':benchmark_pairs_threshold_greedy,
+    'get_pairs_from_matrix_and_threshold_optimal':benchmark_pairs_threshold_optimal,
+    'get_pairs_from_matrix_and_proportion':benchmark_pairs_proportion,
+    'get_measures_for_pairs':benchmark_measures_for_pairs,
+    'compute_metric_dbpedia_categorial':benchmark_metric_dbpedia_categorial,
+    'compute_metric_dbpedia_numerical':benchmark_metric_dbpedia_numerical,
+    'compute_metric_vitamin':benchmark_metric_vitamin,
+    'compute_metric_vitamin_not_functional':benchmark_metric_vitamin_not_functional,
+    'get_rules':benchmark_rules,
+    'get_synthetic_instances':benchmark_synthetic_instances,
+}
+
+
+def run_benchmark(run,repeat=3,memory=True,verbose=False):
+    """
+    Returns the wall times (seconds) of repeat calls of run, the peak memory (bytes) allocated during a call traced by tracemalloc
+    (numpy arrays included) and the report of the stages of a call (see instrumentation.Collector).
+    A first call, not measured, warms up the lazy imports and the caches.
+    The outputs printed by the benchmarked functions are hidden unless verbose.
+    """
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        run()
+        with Collector() as collector:
+            run()
+        peak_memory = None
+        if memory:
+            gc.collect()
+            tracemalloc.start()
+            try:
+                run()
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        times = []
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter()-start)
+    return times,peak_memory,collector.get_report()
+
+
+def run_benchmarks(sizes,names=None,parameters_=None,repeat=3,memory=True,verbose=False):
+    """
+    Returns the list of the results of the benchmarks (names, by default all of BENCHMARKS) for each size of KG (number of triples).
+    """
+    parameters_ = dict(get_default_parameters(),**(parameters_ or {}))
+    names = list(BENCHMARKS) if names is None else names
+    results = []
+    for number_triples in sizes:
+        start = time.perf_counter()
+        context = BenchmarkContext(number_triples,parameters_)
+        print('KG of {} triples ({} writers) built in {:.1f} s'.format(len(context.X),len(context.writers),time.perf_counter()-start))
+        for name in names:
+            with contextlib.redirect_stdout(io.StringIO()) if not verbose else contextlib.nullcontext():
+                run,inputs_ = BENCHMARKS[name](context)
+            times,peak_memory,profile = run_benchmark(run,repeat=repeat,memory=memory,verbose=verbose)
+            result = {
+                'benchmark':name,
+                'number_triples':len(context.X),
+                'requested_triples':number_triples,
+                'wall_time':min(times),
+                'wall_times':times,
+                'peak_memory':peak_memory,
+                'inputs':inputs_,
+                'profile':profile
+            }
+            results.append(result)
+            print('{:<46}{:>10.4f} s{:>12}'.format(name,result['wall_time'],'' if peak_memory is None else '{:.1f} MB'.format(peak_memory/2**20)))
+    return results
+
+
+def get_default_parameters():
+    """Returns the default parameters of the benchmarks."""
+    return {
+        'seed':0,
+        'k':100, # size of the embeddings
+        'max_instances':4000, # writers of the distance matrix
+        'max_instances_optimal':1000, # writers of the distance matrix of the optimal matching
+        'measure_pairs':50, # pairs of get_measures_for_pairs
+        'metric_pairs':100000, # pairs of the compute_metric functions
+        'synthetic_instances':200, # synthetic writers
+    }
+
+
+def get_metadata(parameters_):
+    """Returns the description of the run : commit, date, versions, machine and parameters."""
+    def get_git_output(*args):
+        try:
+            return subprocess.run(['git']+list(args),cwd=ROOT,capture_output=True,text=True,check=True).stdout.strip()
+        except (OSError,subprocess.CalledProcessError):
+            return None
+    status = get_git_output('status','--porcelain','--untracked-files=no')
+    return {
+        'commit':get_git_output('rev-parse','HEAD'),
+        'dirty':None if status is None else len(status) > 0,
+        'date':datetime.datetime.now().isoformat(timespec='seconds'),
+        'python':platform.python_version(),
+        'numpy':np.__version__,
+        'platform':platform.platform(),
+        'cpu_count':os.cpu_count(),
+        'parameters':parameters_
+    }
+
+
+def compare_results(baseline,results,tolerance=0.2):
+    """
+    Returns the comparison of the wall times of results with the baseline (results of the same benchmark and size),
+    as a list of (benchmark, number of triples, baseline time, time, ratio, regression). A regression is a ratio over 1 + tolerance.
+    """
+    baseline_times = {(result['benchmark'],result['requested_triples']):result['wall_time'] for result in baseline['results']}
+    comparison = []
+    for result in results['results']:
+        key_ = (result['benchmark'],result['requested_triples'])
+        if key_ in baseline_times and baseline_times[key_] > 0:
+            ratio = result['wall_time']/baseline_times[key_]
+            comparison.append((key_[0],key_[1],baseline_times[key_],result['wall_time'],ratio,ratio > 1+tolerance))
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the hot paths of the mining pipeline on synthetic knowledge graphs.')
+    parser.add_argument('--sizes',type=int,nargs='+',default=[10000,100000],help='numbers of triples of the KGs (from 10k to 10M)')
+    parser.add_argument('--benchmarks',nargs='+',default=None,choices=list(BENCHMARKS),help='benchmarks to run (by default all)')
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--no-memory',action='store_true',help='do not measure the peak memory')
+    for name,value in get_default_parameters().items():
+        parser.add_argument('--'+name.replace('_','-'),type=int,default=value)
+    parser.add_argument('--output',default=None,help='path of the JSON file of the results')
+    parser.add_argument('--compare',default=None,help='path of the JSON file of baseline results')
+    parser.add_argument('--tolerance',type=float,default=0.2,help='slowdown ratio above 1 reported as a regression')
+    parser.add_argument('--verbose',action='store_true')
+    args = parser.parse_args()
+
+    parameters_ = {name:getattr(args,name) for name in get_default_parameters()}
+    results = {
+        'metadata':get_metadata(parameters_),
+        'results':run_benchmarks(args.sizes,args.benchmarks,parameters_,repeat=args.repeat,memory=not args.no_memory,verbose=args.verbose)
+    }
+    if args.output is not None:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparison = compare_results(baseline,results,tolerance=args.tolerance)
+        print('Comparison with the commit',baseline['metadata'].get('commit'))
+        for name,number_triples,baseline_time,wall_time,ratio,regression in comparison:
+            print('{:<46}{:>10}{:>10.4f} s{:>10.4f} s{:>8.2f}x  {}'.format(name,number_triples,baseline_time,wall_time,ratio,'REGRESSION' if regression else ''))
+        sys.exit(1 if any(comparison_[-1] for comparison_ in comparison) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""This file contains modules to generate knowledge graphs with the schema of datasets/dbpedia_extract.csv, at any size, with random embeddings."""
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','similarity_search'))
+from numpy_model import NumpyEmbeddingModel
+
+
+RESOURCE = 'http://dbpedia.org/resource/'
+ONTOLOGY = 'http://dbpedia.org/ontology/'
+TYPE_PROPERTY = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+LABEL_PROPERTY = 'http://www.w3.org/2000/01/rdf-schema#label'
+GENDER_PROPERTY = 'http://xmlns.com/foaf/0.1/gender'
+NAMED_INDIVIDUAL = 'http://www.w3.org/2002/07/owl#NamedIndividual'
+
+# schema of the dbpedia extract : declaration of the classes and properties
+SCHEMA_TRIPLES = [
+    ['N00fa5823b7f14b6792ef7e5ee382cf98',TYPE_PROPERTY,'http://www.w3.org/2002/07/owl#Ontology'],
+]+[
+    [ONTOLOGY+class_,TYPE_PROPERTY,'http://www.w3.org/2002/07/owl#Class'] for class_ in ['Writer','Book','University','Country']
+]+[
+    [ONTOLOGY+property_,TYPE_PROPERTY,'http://www.w3.org/2002/07/owl#ObjectProperty'] for property_ in ['author','hasForStudent','isCountryOf']
+]+[
+    [ONTOLOGY+property_,TYPE_PROPERTY,'http://www.w3.org/2002/07/owl#DatatypeProperty']
+    for property_ in ['birthDate','genre','releaseDate','numberOfPages','arwuW','endowment','countryName']
+]
+
+# statistics of the dbpedia extract
+NUMBER_BOOKS_PER_WRITER = 3.04 # 1 + poisson
+NUMBER_EXTRA_UNIVERSITIES_PER_WRITER = 0.46 # 1 + poisson
+NUMBER_UNIVERSITIES_PER_WRITER = 0.92
+NUMBER_UNIVERSITIES_PER_COUNTRY = 35
+PROPORTION_ENDOWMENT = 0.9
+GENDERS,GENDERS_P = ['male','female'],[0.75,0.25]
+GENRES,GENRES_P = ['Fiction','NonFiction'],[0.87,0.13]
+ARWUW,ARWUW_P = ['1','51','101','151','201','301','401','501'],[0.05,0.05,0.06,0.06,0.1,0.07,0.2,0.41]
+TRIPLES_PER_WRITER = 6+(1+NUMBER_BOOKS_PER_WRITER)*6+1+NUMBER_EXTRA_UNIVERSITIES_PER_WRITER+NUMBER_UNIVERSITIES_PER_WRITER*(5+PROPORTION_ENDOWMENT)
+
+
+def get_uris(prefix,number):
+    """Returns the object array of the URIs prefix_0 ... prefix_(number-1)."""
+    return np.array([RESOURCE+prefix+'_'+str(i) for i in range(number)],dtype=object)
+
+
+def get_literals(values):
+    """Returns the object array of the literals (str) of values."""
+    return np.array([str(value_) for value_ in np.asarray(values).tolist()],dtype=object)
+
+
+def get_triples_of_property(subjects,property_,objects):
+    """Returns the triples (subject, property_, object) as an object array of shape (n,3)."""
+    triples_ = np.empty((len(subjects),3),dtype=object)
+    triples_[:,0] = subjects
+    triples_[:,1] = property_
+    triples_[:,2] = objects
+    return triples_
+
+
+def get_triples_of_individuals(individuals,class_):
+    """Returns the type triples of the individuals (class_ and owl:NamedIndividual)."""
+    return [get_triples_of_property(individuals,TYPE_PROPERTY,ONTOLOGY+class_),get_triples_of_property(individuals,TYPE_PROPERTY,NAMED_INDIVIDUAL)]
+
+
+def get_synthetic_kg(number_triples,seed=0,shuffle=True):
+    """
+    Returns a knowledge graph of about number_triples triples with the schema of the dbpedia extract.
+
+    Writers have a birth date, a gender, a genre, books (with a release date and a number of pages) and universities
+    (with an ARWU rank, an endowment and a country). The numbers of books and universities of a writer and the distributions
+    of the literals follow the dbpedia extract, and every writer has at least one book and one university,
+    so the KG can be used by all the functions of the mining pipeline (including the synthetic generation).
+
+    Parameters :
+    number_triples : int
+        Approximate number of triples (from 10k to 10M)
+    seed : int (by default = 0)
+    shuffle : bool (by default = True)
+        Shuffles the triples as in a real dump
+
+    Returns :
+    X : numpy array of triples (object array of shape (n,3))
+    """
+    rng = np.random.default_rng(seed)
+    number_writers = max(2,int(round((number_triples-len(SCHEMA_TRIPLES))/TRIPLES_PER_WRITER)))
+    number_universities = max(1,int(round(number_writers*NUMBER_UNIVERSITIES_PER_WRITER)))
+    number_countries = max(5,number_universities//NUMBER_UNIVERSITIES_PER_COUNTRY)
+    books_per_writer = 1+rng.poisson(NUMBER_BOOKS_PER_WRITER,number_writers)
+    universities_per_writer = 1+rng.poisson(NUMBER_EXTRA_UNIVERSITIES_PER_WRITER,number_writers)
+    number_books = int(books_per_writer.sum())
+
+    writers = get_uris('Writer',number_writers)
+    books = get_uris('Book',number_books)
+    universities = get_uris('University',number_universities)
+    countries = get_uris('Country',number_countries)
+
+    triples_ = [np.array(SCHEMA_TRIPLES,dtype=object)]
+    # writers
+    triples_ += get_triples_of_individuals(writers,'Writer')
+    triples_.append(get_triples_of_property(writers,LABEL_PROPERTY,get_literals(['Writer '+str(i) for i in range(number_writers)])))
+    triples_.append(get_triples_of_property(writers,ONTOLOGY+'birthDate',get_literals(rng.integers(1900,1991,number_writers))))
+    triples_.append(get_triples_of_property(writers,GENDER_PROPERTY,np.array(GENDERS,dtype=object)[rng.choice(len(GENDERS),number_writers,p=GENDERS_P)]))
+    triples_.append(get_triples_of_property(writers,ONTOLOGY+'genre',np.array(GENRES,dtype=object)[rng.choice(len(GENRES),number_writers,p=GENRES_P)]))
+    triples_.append(get_triples_of_property(np.repeat(writers,books_per_writer),ONTOLOGY+'author',books))
+    # books
+    triples_ += get_triples_of_individuals(books,'Book')
+    triples_.append(get_triples_of_property(books,LABEL_PROPERTY,get_literals(['Book '+str(i) for i in range(number_books)])))
+    triples_.append(get_triples_of_property(books,ONTOLOGY+'releaseDate',get_literals(rng.integers(1920,2021,number_books))))
+    triples_.append(get_triples_of_property(books,ONTOLOGY+'numberOfPages',get_literals(rng.integers(8,80,number_books)*8)))
+    # universities : a writer studied in distinct universities
+    students = np.repeat(np.arange(number_writers),universities_per_writer)
+    universities_of_students = rng.integers(0,number_universities,len(students))
+    universities_of_students[np.r_[0,np.cumsum(universities_per_writer)[:-1]]] = rng.permutation(np.resize(np.arange(number_universities),number_writers))
+    edges = np.unique(np.column_stack([universities_of_students,students]),axis=0)
+    triples_ += get_triples_of_individuals(universities,'University')
+    triples_.append(get_triples_of_property(universities,LABEL_PROPERTY,get_literals(['University '+str(i) for i in range(number_universities)])))
+    triples_.append(get_triples_of_property(universities,ONTOLOGY+'arwuW',np.array(ARWUW,dtype=object)[rng.choice(len(ARWUW),number_universities,p=ARWUW_P)]))
+    with_endowment = rng.random(number_universities) < PROPORTION_ENDOWMENT
+    endowments = get_literals(['{:.3g}'.format(value_).replace('e+0','E').replace('e+','E') for value_ in 10**rng.uniform(6,10,with_endowment.sum())])
+    triples_.append(get_triples_of_property(universities[with_endowment],ONTOLOGY+'endowment',endowments))
+    triples_.append(get_triples_of_property(universities[edges[:,0]],ONTOLOGY+'hasForStudent',writers[edges[:,1]]))
+    # countries : every university has a country
+    countries_of_universities = rng.permutation(np.resize(np.arange(number_countries),number_universities))
+    triples_ += get_triples_of_individuals(countries,'Country')
+    triples_.append(get_triples_of_property(countries,ONTOLOGY+'countryName',get_literals(['Country '+str(i) for i in range(number_countries)])))
+    triples_.append(get_triples_of_property(countries[countries_of_universities],ONTOLOGY+'isCountryOf',universities))
+
+    X = np.concatenate(triples_)
+    if shuffle:
+        X = X[rng.permutation(len(X))]
+    return X
+
+
+def get_random_model(X,k=100,scoring_type='TransE',seed=0):
+    """
+    Returns a NumpyEmbeddingModel with random embeddings (standard normal, float32) for all the entities and relations of X.
+    """
+    rng = np.random.default_rng(seed)
+    entities = list(dict.fromkeys(X[:,0].tolist()+X[:,2].tolist()))
+    relations = list(dict.fromkeys(X[:,1].tolist()))
+    return NumpyEmbeddingModel(
+        entities,
+        relations,
+        rng.standard_normal((len(entities),k),dtype=np.float32),
+        rng.standard_normal((len(relations),k),dtype=np.float32),
+        scoring_type=scoring_type
+    )
+
+
+def save_kg(X,path):
+    """Saves the triples in a CSV file without header, as datasets/dbpedia_extract.csv."""
+    with open(path,'w',newline='') as f:
+        csv.writer(f).writerows(X.tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates a knowledge graph with the schema of the dbpedia extract.')
+    parser.add_argument('--triples',type=int,default=100000,help='approximate number of triples')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--output',required=True,help='path of the CSV file')
+    args = parser.parse_args()
+    X = get_synthetic_kg(args.triples,seed=args.seed)
+    save_kg(X,args.output)
+    print('Number of triples : ',len(X))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,56 +1,208 @@
-"""This file contains modules to compute the metrics for a rule."""
+"""
+This file contains modules to compute the metrics for a rule.
+The folder similarity_search/ should be in sys.path (set by the caller, as in the tutorials).
+"""
 
 import math
 
+import numpy as np
+
+from instrumentation import increment,timed
+from knowledge_graph import get_knowledge_graph
+
+
+####### ENGINE : VALUES OF THE INSTANCES RESOLVED ONCE, PAIRS COMPARED WITH ARRAYS
+
+def get_metric_from_counts(T_O,T_not_O,same_0,stat_param=1.96):
+    """
+    Returns the causal metric (T_O/T_not_O) and its closed-form confidence interval (log odds ratio), with the counts.
+    """
+    if T_O > 0 and T_not_O > 0:
+        causal_metric = T_O/T_not_O
+        log_s = math.log(causal_metric)
+        interval_amp = stat_param*math.sqrt((1/T_O)+(1/T_not_O))
+        return round(causal_metric,3), [round(math.exp(log_s - interval_amp),3),round(math.exp(log_s + interval_amp),3)],T_O,T_not_O,same_0
+    else:
+        return 0, [0,0],T_O,T_not_O,same_0
+
+
+def get_pairs_indexes(pairs_similar_instances):
+    """
+    Returns the instances involved in the pairs (each instance once) and the array of shape (n,2) of the indexes of the pairs in the instances.
+    """
+    index_instances = {}
+    indexes = [index_instances.setdefault(instance,len(index_instances)) for pair_ in pairs_similar_instances for instance in pair_[:2]]
+    return list(index_instances),np.array(indexes,dtype=np.intp).reshape(-1,2)
+
+
+@timed('instance_values')
+def get_values_for_instances(kg,instances,get_value,*args):
+    """
+    Returns the values get_value(kg,instance,*args) of the instances in an array, each instance being resolved once.
+
+    Returns :
+    values : numpy array (dtype object)
+    found : numpy array of booleans
+        False if the value of the instance is missing (path not complete or value not numerical)
+    """
+    values = np.empty(len(instances),dtype=object)
+    found = np.ones(len(instances),dtype=bool)
+    for i,instance in enumerate(instances):
+        try:
+            values[i] = get_value(kg,instance,*args)
+        except (IndexError,KeyError,ValueError,TypeError):
+            found[i] = False
+    return values,found
+
+
+def get_membership_of_instances(instances,list_instances_t):
+    """
+    Returns for each instance True if it has the treatment (list_instances_t is converted once to a set).
+    """
+    set_instances_t = set(list_instances_t)
+    return np.array([instance in set_instances_t for instance in instances],dtype=bool)
+
+
+def get_counts_from_outcomes(outcomes,directions,valid):
+    """
+    Returns T_O,T_not_O,same_0 for all pairs with array comparisons.
+
+    Parameters :
+    outcomes : numpy array of shape (n,2)
+        Outcomes of the two instances of each pair
+    directions : numpy array of shape (n,)
+        1 if the pair counts in T_O when the first instance has the higher outcome, -1 when it has the lower outcome, 0 if the pair is not counted
+    valid : numpy array of booleans of shape (n,)
+        False for the pairs dropped for missing values
+    """
+    counted = valid & (directions != 0)
+    comparison = np.zeros(len(directions))
+    comparison[counted] = np.sign(outcomes[counted,0]-outcomes[counted,1])*directions[counted]
+    T_O = int(np.count_nonzero(comparison[counted] > 0))
+    T_not_O = int(np.count_nonzero(comparison[counted] < 0))
+    same_0 = int(np.count_nonzero(comparison[counted] == 0))
+    return T_O,T_not_O,same_0
+
+
+def report_dropped_pairs(valid,number_errors=0):
+    """
+    Prints the number of pairs dropped for missing values and with an error in the treatment values, and returns the number of dropped pairs.
+    """
+    number_dropped = int(np.count_nonzero(~valid))
+    increment('dropped_pairs',number_dropped)
+    if number_dropped > 0:
+        print('Number of pairs dropped for missing values : ',number_dropped)
+    if number_errors > 0:
+        print('There is an error in the treatments values of the instances of ',number_errors,' pairs.')
+    return number_dropped
+
+
+def get_directions_from_membership(in_t,indexes):
+    """
+    Returns 1 for the pairs whose first instance only has the treatment, -1 for the pairs whose second instance only has it, 0 otherwise.
+    """
+    in_0,in_1 = in_t[indexes[:,0]],in_t[indexes[:,1]]
+    return np.where(in_0 & ~in_1,1,np.where(in_1 & ~in_0,-1,0))
+
+
+####### RESAMPLING SIGNIFICANCE : BOOTSTRAP AND SIGN-FLIP PERMUTATION, BATCHED ACROSS RULES
+
+def get_resampling_significance(T_O,T_not_O,same_0,n_replicates=2000,confidence=0.95,seed=None):
+    """
+    Returns the bootstrap confidence interval of the causal metric and the permutation p-value of rules, from their counts.
+
+    The metric only depends on the counts of the pairs in T_O, T_not_O and same_O, so the replicates are drawn on the counts :
+    - bootstrap : resampling the n pairs with replacement is a multinomial draw of the three counts,
+      the metric of a replicate is (T_O+0.5)/(T_not_O+0.5) (Haldane correction, defined when a count is small or null),
+      and the interval is given by the percentiles of the replicates.
+    - permutation : under the null hypothesis, the sign of each pair with different outcomes is flipped with probability 1/2,
+      so T_O of a replicate is a binomial draw on T_O+T_not_O pairs. The p-value is two-sided.
+    All the replicates of all the rules are drawn at once, the cost does not depend on the number of pairs.
+
+    Parameters :
+    T_O, T_not_O, same_0 : int or numpy arrays of shape (number of rules,)
+    n_replicates : int (by default = 2000)
+    confidence : float (by default = 0.95)
+    seed : int (by default = None)
+
+    Returns :
+    confidence_intervals : numpy array of shape (number of rules,2)
+        [0,0] for the rules without pairs
+    p_values : numpy array of shape (number of rules,)
+    """
+    counts = np.column_stack(np.broadcast_arrays(*[np.atleast_1d(np.asarray(c,dtype=np.int64)) for c in [T_O,T_not_O,same_0]]))
+    number_pairs = counts.sum(axis=1)
+    rng = np.random.default_rng(seed)
+
+    # bootstrap on the counts
+    probabilities = counts/np.maximum(number_pairs,1)[:,None]
+    probabilities[number_pairs == 0] = [0,0,1]
+    replicates = rng.multinomial(number_pairs,probabilities,size=(n_replicates,len(counts)))
+    metrics_ = (replicates[:,:,0]+0.5)/(replicates[:,:,1]+0.5)
+    alpha = (1-confidence)/2
+    confidence_intervals = np.quantile(metrics_,[alpha,1-alpha],axis=0).T.round(3)
+    confidence_intervals[number_pairs == 0] = 0
+
+    # sign-flip permutation on the pairs with different outcomes
+    number_informative = counts[:,0]+counts[:,1]
+    observed = np.abs(counts[:,0]-number_informative/2)
+    flipped = rng.binomial(number_informative,0.5,size=(n_replicates,len(counts)))
+    extreme = np.abs(flipped-number_informative/2) >= observed-1e-9
+    p_values = (extreme.sum(axis=0)+1)/(n_replicates+1)
+    p_values[number_informative == 0] = 1.
+    return confidence_intervals,p_values
+
+
+@timed('resampling_significance')
+def add_resampling_significance(df_rules,n_replicates=2000,confidence=0.95,seed=None):
+    """
+    Adds the columns causal_metric_IC_bootstrap and p_value to a rule table (columns T_O, T_not_O, same_O), for all rules at once.
+    """
+    confidence_intervals,p_values = get_resampling_significance(
+        df_rules['T_O'].to_numpy(),df_rules['T_not_O'].to_numpy(),df_rules['same_O'].to_numpy(),
+        n_replicates=n_replicates,confidence=confidence,seed=seed
+    )
+    df_rules['causal_metric_IC_bootstrap'] = confidence_intervals.tolist()
+    df_rules['p_value'] = p_values
+    return df_rules
+
 
 ####### FUNCTIONS FOR VITAMIN - FUNCTIONAL PROPERTIES
 
-def get_categorical_values_vitamin(pairs_similar_instances,X,PATH_TREATMENT,PATH_DIET,PATH_IDEAL_DIET,t0,t1):
+def get_categorical_values_vitamin(pairs_similar_instances,X,PATH_TREATMENT,PATH_DIET,PATH_IDEAL_DIET,t0,t1,return_dropped=False):
     """
     For a categorical rule and associated treatment, returns distribution of its associated pairs.
+
+    The treatment and outcome of each instance are resolved once, and the pairs are compared with arrays.
+    The pairs with a missing value are dropped and counted (returned with return_dropped=True).
     """
-    T_O,T_not_O,same_0 = 0,0,0
-
-    for pair_ in pairs_similar_instances:
-        try: # we already know that one instance has t0 and the other has t1
-            ti0,oi0 = get_treatment_and_outcome_vitamin(X,pair_[0],PATH_TREATMENT,PATH_DIET,PATH_IDEAL_DIET)
-            ti1,oi1 = get_treatment_and_outcome_vitamin(X,pair_[1],PATH_TREATMENT,PATH_DIET,PATH_IDEAL_DIET)
-
-            if ti0 == t0 and ti1 == t1:
-                if oi0 > oi1:
-                    T_O += 1
-                elif oi0 < oi1:
-                    T_not_O += 1    
-                else:
-                    same_0 += 1
-            elif ti0 == t1 and ti1 == t0:
-                if oi0 < oi1:
-                    T_O += 1
-                elif oi0 > oi1:
-                    T_not_O += 1
-                else:
-                    same_0 += 1
-                
-            else:    
-                print('There is an error in the treatments values of the instances.')
-        except:
-            pass
-    return T_O,T_not_O,same_0
+    kg = get_knowledge_graph(X)
+    instances,indexes = get_pairs_indexes(pairs_similar_instances)
+    values,found = get_values_for_instances(kg,instances,get_treatment_and_outcome_vitamin,PATH_TREATMENT,PATH_DIET,PATH_IDEAL_DIET)
+    treatments = np.array([value[0] if found_ else None for value,found_ in zip(values,found)],dtype=object)
+    outcomes = np.array([value[1] if found_ else np.nan for value,found_ in zip(values,found)],dtype=float)
 
+    # we already know that one instance has t0 and the other has t1
+    valid = found[indexes].all(axis=1)
+    treatments_pairs = treatments[indexes]
+    is_t0_t1 = (treatments_pairs[:,0] == t0) & (treatments_pairs[:,1] == t1)
+    is_t1_t0 = (treatments_pairs[:,0] == t1) & (treatments_pairs[:,1] == t0)
+    directions = np.where(is_t0_t1,1,np.where(is_t1_t0,-1,0))
+
+    T_O,T_not_O,same_0 = get_counts_from_outcomes(outcomes[indexes],directions,valid)
+    number_dropped = report_dropped_pairs(valid,int(np.count_nonzero(valid & (directions == 0))))
+    if return_dropped:
+        return T_O,T_not_O,same_0,number_dropped
+    return T_O,T_not_O,same_0
 
 
+@timed('compute_metric_vitamin')
 def compute_metric_vitamin(pairs_similar_instances,X,PATH_TREATMENT,PATH_DIET,PATH_IDEAL_DIET,t0,t1,stat_param=1.96):
     """
     Computation of the metric.
     """
     T_O,T_not_O,same_0 = get_categorical_values_vitamin(pairs_similar_instances,X,PATH_TREATMENT,PATH_DIET,PATH_IDEAL_DIET,t0,t1)
-    if T_O > 0 and T_not_O > 0:
-        causal_metric = T_O/T_not_O
-        log_s = math.log(causal_metric)
-        interval_amp = stat_param*math.sqrt((1/T_O)+(1/T_not_O))
-        return round(causal_metric,3), [round(math.exp(log_s - interval_amp),3),round(math.exp(log_s + interval_amp),3)],T_O,T_not_O,same_0
-    else:
-        return 0, [0,0],T_O,T_not_O,same_0
+    return get_metric_from_counts(T_O,T_not_O,same_0,stat_param)
     
 
 def get_treatment_and_outcome_vitamin(X,instance,PATH_TREATMENT,PATH_DIET,PATH_IDEAL_DIET):
@@ -59,68 +211,53 @@ def get_treatment_and_outcome_vitamin(X,instance,PATH_TREATMENT,PATH_DIET,PATH_I
     
     This function iterates for each path through all properties until obtaining the values.
     """
+    kg = get_knowledge_graph(X)
     subject_treatment = instance
     for property_treatment in PATH_TREATMENT:
-        subject_treatment = [x[2] for x in X if x[0]==subject_treatment and x[1]==property_treatment][0]
+        subject_treatment = kg.objects(subject_treatment,property_treatment)[0]
         
     subject_outcome_diet = instance
     for property_treatment in PATH_DIET:
-        subject_outcome_diet = [x[2] for x in X if x[0]==subject_outcome_diet and x[1]==property_treatment][0]
+        subject_outcome_diet = kg.objects(subject_outcome_diet,property_treatment)[0]
         
     subject_outcome_ideal_diet = instance
     for property_treatment in PATH_IDEAL_DIET:
-        subject_outcome_ideal_diet = [x[2] for x in X if x[0]==subject_outcome_ideal_diet and x[1]==property_treatment][0]
+        subject_outcome_ideal_diet = kg.objects(subject_outcome_ideal_diet,property_treatment)[0]
         
     return subject_treatment, int(subject_outcome_diet)-int(subject_outcome_ideal_diet)
     
 
 ####### FUNCTIONS FOR VITAMIN - NOT FUNCTIONAL PROPERTIES
 
+@timed('compute_metric_vitamin_not_functional')
 def compute_metric_vitamin_not_functional(pairs_similar_instances,list_instances_t,X,PATH_DIET,PATH_IDEAL_DIET,stat_param=1.96):
     """
     Computation of the metric for not functional properties.
     """
     T_O,T_not_O,same_0 = get_categorical_values_vitamin_not_functional(pairs_similar_instances,list_instances_t,X,PATH_DIET,PATH_IDEAL_DIET)
-    if T_O > 0 and T_not_O > 0:
-        causal_metric = T_O/T_not_O
-        log_s = math.log(causal_metric)
-        interval_amp = stat_param*math.sqrt((1/T_O)+(1/T_not_O))
-        return round(causal_metric,3), [round(math.exp(log_s - interval_amp),3),round(math.exp(log_s + interval_amp),3)],T_O,T_not_O,same_0
-    else:
-        return 0, [0,0],T_O,T_not_O,same_0
+    return get_metric_from_counts(T_O,T_not_O,same_0,stat_param)
 
 
-def get_categorical_values_vitamin_not_functional(pairs_similar_instances,list_instances_t,X,PATH_DIET,PATH_IDEAL_DIET):
+def get_categorical_values_vitamin_not_functional(pairs_similar_instances,list_instances_t,X,PATH_DIET,PATH_IDEAL_DIET,return_dropped=False):
     """
     For a categorical rule and associated treatment, returns distribution of its associated pairs.
+
+    The outcome of each instance is resolved once, and the pairs are compared with arrays.
+    The pairs with a missing value are dropped and counted (returned with return_dropped=True).
     """
-    T_O,T_not_O,same_0 = 0,0,0
-
-    for pair_ in pairs_similar_instances:
-        try: # we already know that one instance has t0 and the other has t1
-            oi0 = get_outcome_vitamin_not_functional(X,pair_[0],PATH_DIET,PATH_IDEAL_DIET)
-            oi1 = get_outcome_vitamin_not_functional(X,pair_[1],PATH_DIET,PATH_IDEAL_DIET)
-
-            if pair_[0] in list_instances_t and pair_[1] not in list_instances_t:
-                if oi0 > oi1:
-                    T_O += 1
-                elif oi0 < oi1:
-                    T_not_O += 1    
-                else:
-                    same_0 += 1
-                    
-            elif pair_[1] in list_instances_t and pair_[0] not in list_instances_t:
-                if oi0 < oi1:
-                    T_O += 1
-                elif oi0 > oi1:
-                    T_not_O += 1
-                else:
-                    same_0 += 1
-                
-            else:    
-                print('There is an error in the treatments values of the instances.')
-        except:
-            pass
+    kg = get_knowledge_graph(X)
+    instances,indexes = get_pairs_indexes(pairs_similar_instances)
+    values,found = get_values_for_instances(kg,instances,get_outcome_vitamin_not_functional,PATH_DIET,PATH_IDEAL_DIET)
+    outcomes = np.where(found,values,np.nan).astype(float)
+
+    # we already know that one instance has t0 and the other has t1
+    valid = found[indexes].all(axis=1)
+    directions = get_directions_from_membership(get_membership_of_instances(instances,list_instances_t),indexes)
+
+    T_O,T_not_O,same_0 = get_counts_from_outcomes(outcomes[indexes],directions,valid)
+    number_dropped = report_dropped_pairs(valid,int(np.count_nonzero(valid & (directions == 0))))
+    if return_dropped:
+        return T_O,T_not_O,same_0,number_dropped
     return T_O,T_not_O,same_0
     
     
@@ -130,14 +267,15 @@ def get_outcome_vitamin_not_functional(X,instance,PATH_DIET,PATH_IDEAL_DIET):
     
     This function iterates for each path through all properties until obtaining the values.
     """
+    kg = get_knowledge_graph(X)
         
     subject_outcome_diet = instance
     for property_treatment in PATH_DIET:
-        subject_outcome_diet = [x[2] for x in X if x[0]==subject_outcome_diet and x[1]==property_treatment][0]
+        subject_outcome_diet = kg.objects(subject_outcome_diet,property_treatment)[0]
         
     subject_outcome_ideal_diet = instance
     for property_treatment in PATH_IDEAL_DIET:
-        subject_outcome_ideal_diet = [x[2] for x in X if x[0]==subject_outcome_ideal_diet and x[1]==property_treatment][0]
+        subject_outcome_ideal_diet = kg.objects(subject_outcome_ideal_diet,property_treatment)[0]
         
     return int(subject_outcome_diet)-int(subject_outcome_ideal_diet)
 
@@ -145,115 +283,89 @@ def get_outcome_vitamin_not_functional(X,instance,PATH_DIET,PATH_IDEAL_DIET):
 ####### FUNCTIONS FOR DBPEDIA 
 
 def get_outcome_dbpedia(X,instance,PATH_OUTCOME):
-    birthDate = int([x[2] for x in X if x[0]==instance and x[1]==PATH_OUTCOME[0][0]][0])
-    all_books = [x[2] for x in X if x[0]==instance and x[1]==PATH_OUTCOME[1][0]]
+    kg = get_knowledge_graph(X)
+    birthDate = int(kg.objects(instance,PATH_OUTCOME[0][0])[0])
+    all_books = kg.objects(instance,PATH_OUTCOME[1][0])
     year_published = []
     for book in all_books:
-        year_published.append(int([x[2] for x in X if x[0]==book and x[1]==PATH_OUTCOME[1][1]][0]))
+        year_published.append(int(kg.objects(book,PATH_OUTCOME[1][1])[0]))
     
     return min(year_published)-birthDate
 
 
+@timed('compute_metric_dbpedia_categorial')
 def compute_metric_dbpedia_categorial(pairs_similar_instances,list_instances_t,X,PATH_OUTCOME,stat_param=1.96):
     """
     Computation of the metric.
     """
     T_O,T_not_O,same_0 = get_categorical_values_dbpedia(pairs_similar_instances,list_instances_t,X,PATH_OUTCOME)
-    if T_O > 0 and T_not_O > 0:
-        causal_metric = T_O/T_not_O
-        log_s = math.log(causal_metric)
-        interval_amp = stat_param*math.sqrt((1/T_O)+(1/T_not_O))
-        return round(causal_metric,3), [round(math.exp(log_s - interval_amp),3),round(math.exp(log_s + interval_amp),3)],T_O,T_not_O,same_0
-    else:
-        return 0, [0,0],T_O,T_not_O,same_0
+    return get_metric_from_counts(T_O,T_not_O,same_0,stat_param)
     
     
-def get_categorical_values_dbpedia(pairs_similar_instances,list_instances_t,X,PATH_OUTCOME):
+def get_categorical_values_dbpedia(pairs_similar_instances,list_instances_t,X,PATH_OUTCOME,return_dropped=False):
     """
     For a categorical rule and associated treatment, returns distribution of its associated pairs.
+
+    The outcome of each instance is resolved once, and the pairs are compared with arrays.
+    The pairs with a missing value are dropped and counted (returned with return_dropped=True).
     """
-    T_O,T_not_O,same_0 = 0,0,0
-
-    for pair_ in pairs_similar_instances:
-        try: # we already know that one instance has t0 and the other has t1
-            oi0 = get_outcome_dbpedia(X,pair_[0],PATH_OUTCOME)
-            oi1 = get_outcome_dbpedia(X,pair_[1],PATH_OUTCOME)
-
-            if pair_[0] in list_instances_t and pair_[1] not in list_instances_t:
-                if oi0 < oi1:
-                    T_O += 1
-                elif oi0 > oi1:
-                    T_not_O += 1    
-                else:
-                    same_0 += 1
-                    
-            elif pair_[1] in list_instances_t and pair_[0] not in list_instances_t:
-                if oi0 > oi1:
-                    T_O += 1
-                elif oi0 < oi1:
-                    T_not_O += 1
-                else:
-                    same_0 += 1
-                
-            else:    
-                print('There is an error in the treatments values of the instances.')
-        except:
-            pass
+    kg = get_knowledge_graph(X)
+    instances,indexes = get_pairs_indexes(pairs_similar_instances)
+    values,found = get_values_for_instances(kg,instances,get_outcome_dbpedia,PATH_OUTCOME)
+    outcomes = np.where(found,values,np.nan).astype(float)
+
+    # we already know that one instance has t0 and the other has t1 : the treated instance counts in T_O with the lower outcome
+    valid = found[indexes].all(axis=1)
+    directions = -get_directions_from_membership(get_membership_of_instances(instances,list_instances_t),indexes)
+
+    T_O,T_not_O,same_0 = get_counts_from_outcomes(outcomes[indexes],directions,valid)
+    number_dropped = report_dropped_pairs(valid,int(np.count_nonzero(valid & (directions == 0))))
+    if return_dropped:
+        return T_O,T_not_O,same_0,number_dropped
     return T_O,T_not_O,same_0
 
 
 def get_numerical_treatment_dbpedia(X,instance,path_treatment):
+    kg = get_knowledge_graph(X)
     if path_treatment == ['http://dbpedia.org/ontology/birthDate']:
-        return int([x[2] for x in X if x[0]==instance and x[1]==path_treatment[0]][0])
+        return int(kg.objects(instance,path_treatment[0])[0])
     elif path_treatment == ['http://dbpedia.org/ontology/arwuW']:
-        uni = [x for x in X if x[1]=='http://dbpedia.org/ontology/hasForStudent' and x[2]==instance][0]
-        return int([x[2] for x in X if x[0]==uni and x[1]=='http://dbpedia.org/ontology/arwuW'][0])
+        uni = kg.reverse_edges(instance,'http://dbpedia.org/ontology/hasForStudent')[0]
+        return int(kg.objects(uni,'http://dbpedia.org/ontology/arwuW')[0])
 
 
+@timed('compute_metric_dbpedia_numerical')
 def compute_metric_dbpedia_numerical(pairs_similar_instances,list_instances_t,X,path_treatment,PATH_OUTCOME,stat_param=1.96):
     """
     Computation of the metric.
+    The treatment is numerical : list_instances_t is not used (kept for the signature of the other compute_metric functions).
     """
-    T_O,T_not_O,same_0 = get_numerical_values_dbpedia(pairs_similar_instances,list_instances_t,X,path_treatment,PATH_OUTCOME)
-    if T_O > 0 and T_not_O > 0:
-        causal_metric = T_O/T_not_O
-        log_s = math.log(causal_metric)
-        interval_amp = stat_param*math.sqrt((1/T_O)+(1/T_not_O))
-        return round(causal_metric,3), [round(math.exp(log_s - interval_amp),3),round(math.exp(log_s + interval_amp),3)],T_O,T_not_O,same_0
-    else:
-        return 0, [0,0],T_O,T_not_O,same_0
+    T_O,T_not_O,same_0 = get_numerical_values_dbpedia(pairs_similar_instances,X,path_treatment,PATH_OUTCOME)
+    return get_metric_from_counts(T_O,T_not_O,same_0,stat_param)
     
     
-def get_numerical_values_dbpedia(pairs_similar_instances,X,path_treatment,PATH_OUTCOME):
+def get_numerical_values_dbpedia(pairs_similar_instances,X,path_treatment,PATH_OUTCOME,return_dropped=False):
     """
     For a numerical treatment, returns distribution of the mined similar pairs.
+
+    The treatment and outcome of each instance are resolved once, and the pairs are compared with arrays
+    (the instance with the higher treatment counts in T_O with the lower outcome, the pairs with the same treatment are not counted).
+    The pairs with a missing value are dropped and counted (returned with return_dropped=True).
     """
-    T_O,T_not_O,same_0 = 0,0,0
-
-    for pair_ in pairs_similar_instances:
-        try: # we already know that one instance has t0 and the other has t1
-            oi0 = get_outcome_dbpedia(X,pair_[0],PATH_OUTCOME)
-            oi1 = get_outcome_dbpedia(X,pair_[1],PATH_OUTCOME)
-            
-            ti0 = get_numerical_treatment_dbpedia(X,pair_[0],path_treatment)
-            ti1 = get_numerical_treatment_dbpedia(X,pair_[1],path_treatment)
-            
-            if ti0 > ti1:
-                if oi0 < oi1:
-                    T_O += 1
-                elif oi0 > oi1:
-                    T_not_O += 1
-                else:
-                    same_0 += 1
-                    
-            elif ti0 < ti1:
-                if oi0 > oi1:
-                    T_O += 1
-                elif oi0 < oi1:
-                    T_not_O += 1
-                else:
-                    same_0 += 1
-                    
-        except:
-            pass
+    kg = get_knowledge_graph(X)
+    instances,indexes = get_pairs_indexes(pairs_similar_instances)
+    values_outcome,found_outcome = get_values_for_instances(kg,instances,get_outcome_dbpedia,PATH_OUTCOME)
+    values_treatment,found_treatment = get_values_for_instances(kg,instances,get_numerical_treatment_dbpedia,path_treatment)
+    found = found_outcome & found_treatment & np.array([value is not None for value in values_treatment],dtype=bool)
+    outcomes = np.where(found,values_outcome,np.nan).astype(float)
+    treatments = np.where(found,values_treatment,np.nan).astype(float)
+
+    valid = found[indexes].all(axis=1)
+    directions = np.zeros(len(indexes),dtype=int)
+    directions[valid] = -np.sign(treatments[indexes[valid,0]]-treatments[indexes[valid,1]]).astype(int)
+
+    T_O,T_not_O,same_0 = get_counts_from_outcomes(outcomes[indexes],directions,valid)
+    number_dropped = report_dropped_pairs(valid)
+    if return_dropped:
+        return T_O,T_not_O,same_0,number_dropped
     return T_O,T_not_O,same_0
\ No newline at end of file
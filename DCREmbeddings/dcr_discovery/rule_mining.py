@@ -0,0 +1,192 @@
+"""
+This file contains modules to mine the rules of several treatments, value pairs and degrees at once.
+The folders similarity_search/ and dcr_discovery/ should be in sys.path (set by the caller, as in the tutorials).
+"""
+
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from distance_kernels import get_distance_kernel
+from instrumentation import increment,stage,timed,update_max
+from knowledge_graph import get_knowledge_graph
+from pairs_mining import fill_distances,get_candidate_edges,get_distance_for_degree,get_greedy_matching,get_matching_from_matrix
+from metrics import add_resampling_significance,get_counts_from_outcomes,get_metric_from_counts,get_outcome_vitamin_not_functional,get_values_for_instances
+
+
+RULES_COLUMNS = [
+    'Degree','Distance_Threshold','Number_Pairs',
+    'Percentage_Possible_Pairs_Created','Treatment',
+    't0','t1','causal_metric','causal_metric_IC','T_O',
+    'T_not_O','same_O','Dropped_Pairs','Distance_Kernel'
+]
+
+
+@timed('get_rules')
+def get_rules(model,X,list_target_class_instances,paths_treatment,dic_distance_per_degree,outcome_function=get_outcome_vitamin_not_functional,outcome_args=(),outcome_direction=1,degrees=None,strategy='greedy',type_distance='euclidian',stat_param=1.96,significance=True,n_replicates=2000,seed=0,n_jobs=1):
+    """
+    Returns the table of the rules of all treatments, pairs of treatment values and degrees.
+
+    The work is planned so that the intermediate results are computed once :
+    - the embeddings and the outcomes of the target class instances are obtained once for all jobs,
+    - the treatment values of the instances are resolved once per treatment path,
+    - for a job (treatment path, t0, t1), the distance matrix t1 x t0 is computed once and its edges are sorted once
+      under the largest threshold : with the greedy strategy, the pairs of each degree are the prefix of the matching
+      under the threshold of the degree, so the matching is also built once.
+    The jobs are independent and run in parallel across processes with n_jobs > 1.
+    With significance=True, the bootstrap interval and the permutation p-value of all rules are added at once (see add_resampling_significance).
+
+    Parameters :
+    model : ampligraph EmbeddingModel
+    X : numpy array of triples (or KnowledgeGraph)
+    list_target_class_instances : list of instances
+    paths_treatment : list of treatment paths (each path is a list of properties)
+    dic_distance_per_degree : dictionnary degree -> distances of the truncated pairs
+        The distance threshold of a degree is given by get_distance_for_degree
+    outcome_function : function (by default = get_outcome_vitamin_not_functional)
+        Function (X,instance,*outcome_args) returning the numerical outcome of an instance
+    outcome_args : tuple
+    outcome_direction : int (by default = 1)
+        1 if a pair counts in T_O when its t0 instance has the higher outcome, -1 when it has the lower outcome
+    degrees : list of int (by default = None, all degrees of dic_distance_per_degree)
+    strategy : str (by default = 'greedy')
+        Matching strategy of get_matching_from_matrix
+    type_distance : str (by default = 'euclidian')
+        Distance kernel (see distance_kernels.DISTANCE_KERNELS), recorded in the column Distance_Kernel
+        The distances of dic_distance_per_degree must be computed with the same kernel
+    stat_param : float
+    significance : bool (by default = True)
+    n_replicates : int (by default = 2000)
+        Number of bootstrap and permutation replicates
+    seed : int (by default = 0)
+    n_jobs : int (by default = 1)
+        Number of processes, None or -1 for all the CPUs
+
+    Returns :
+    df_rules : pandas dataframe with the columns RULES_COLUMNS (and causal_metric_IC_bootstrap, p_value with significance=True)
+    """
+    if strategy not in ['greedy','optimal']:
+        print("This strategy does not exist, please switch to greedy or optimal.")
+        return None
+    get_distance_kernel(type_distance) # the kernel is checked before any computation
+    kg = get_knowledge_graph(X)
+    instances = list(list_target_class_instances)
+    if degrees is None:
+        degrees = sorted(dic_distance_per_degree)
+    distance_thresholds = [(degree,get_distance_for_degree(dic_distance_per_degree,degree)) for degree in degrees]
+    distance_thresholds = [(degree,threshold) for degree,threshold in distance_thresholds if threshold is not None]
+
+    # shared intermediate results : embeddings and outcomes of the instances
+    with stage('embeddings'):
+        embeddings = np.asarray(model.get_embeddings(entities=np.asarray(instances)),dtype=np.float32)
+    outcomes,found = get_values_for_instances(kg,instances,outcome_function,*outcome_args)
+    outcomes = np.where(found,outcomes,np.nan).astype(float)
+
+    jobs = []
+    for path_treatment in paths_treatment:
+        instances_per_value = get_instances_per_treatment_value(kg,instances,path_treatment)
+        for t0,t1 in itertools.combinations(sorted(instances_per_value),2):
+            jobs.append((list(path_treatment),t0,t1,instances_per_value[t0],instances_per_value[t1]))
+
+    parameters_ = (distance_thresholds,outcome_direction,strategy,type_distance,stat_param)
+    increment('rule_jobs',len(jobs))
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs == 1 or len(jobs) <= 1:
+        state_ = {'embeddings':embeddings,'outcomes':outcomes,'found':found,'parameters':parameters_}
+        rules_per_job = [get_rules_for_job(job_,state_) for job_ in jobs]
+    else:
+        context = multiprocessing.get_context('spawn')
+        initargs = (embeddings,outcomes,found,parameters_)
+        with ProcessPoolExecutor(max_workers=min(n_jobs,len(jobs)),mp_context=context,initializer=init_worker_rules,initargs=initargs) as executor:
+            rules_per_job = list(executor.map(get_rules_for_job,jobs))
+
+    import pandas as pd
+
+    df_rules = pd.DataFrame([rule_ for rules_job in rules_per_job for rule_ in rules_job],columns=RULES_COLUMNS)
+    if significance:
+        df_rules = add_resampling_significance(df_rules,n_replicates=n_replicates,seed=seed)
+    return df_rules
+
+
+def get_instances_per_treatment_value(X,instances,path_treatment):
+    """
+    Returns the dictionnary treatment value -> indexes (in instances) of the instances with this value on the treatment path.
+    The instances without a value are not kept.
+    """
+    kg = get_knowledge_graph(X)
+    instances_per_value = {}
+    for i,instance in enumerate(instances):
+        value_ = instance
+        for property_ in path_treatment:
+            objects_ = kg.objects(value_,property_)
+            if len(objects_) == 0:
+                value_ = None
+                break
+            value_ = objects_[0]
+        if value_ is not None:
+            instances_per_value.setdefault(value_,[]).append(i)
+    return {value_:np.array(indexes_,dtype=np.intp) for value_,indexes_ in instances_per_value.items()}
+
+
+WORKER_STATE = {}
+
+
+def init_worker_rules(embeddings,outcomes,found,parameters_):
+    """
+    Initializes a worker process of get_rules with the shared intermediate results.
+    """
+    WORKER_STATE['embeddings'] = embeddings
+    WORKER_STATE['outcomes'] = outcomes
+    WORKER_STATE['found'] = found
+    WORKER_STATE['parameters'] = parameters_
+
+
+def get_rules_for_job(job_,state_=None):
+    """
+    Returns the rules of all degrees for a job (treatment path, t0, t1, indexes of the t0 instances, indexes of the t1 instances).
+    """
+    if state_ is None:
+        state_ = WORKER_STATE
+    path_treatment,t0,t1,indexes_t0,indexes_t1 = job_
+    distance_thresholds,outcome_direction,strategy,type_distance,stat_param = state_['parameters']
+    embeddings,outcomes,found = state_['embeddings'],state_['outcomes'],state_['found']
+
+    # distance matrix computed once : rows = instances of t1, columns = instances of t0 (as in mode treatment_sort)
+    distance_matrix = np.empty((len(indexes_t1),len(indexes_t0)),dtype=np.float32)
+    update_max('matrix_cells',distance_matrix.size)
+    update_max('matrix_bytes',distance_matrix.nbytes)
+    with stage('distance_matrix'):
+        fill_distances(embeddings[indexes_t1],embeddings[indexes_t0],distance_matrix,type_distance)
+    number_possible_pairs = min(distance_matrix.shape)
+
+    if strategy == 'greedy' and len(distance_thresholds) > 0:
+        # matching built once under the largest threshold, the pairs of a degree are a prefix of the matching
+        with stage('matching'):
+            values,rows,cols = get_candidate_edges(distance_matrix,max(threshold for _,threshold in distance_thresholds),mode='treatment_sort')
+            rows,cols = get_greedy_matching(rows,cols,distance_matrix.shape,mode='treatment_sort')
+        distances_matched = distance_matrix[rows,cols]
+
+    rules_ = []
+    for degree,distance_threshold in distance_thresholds:
+        if strategy == 'greedy':
+            number_pairs = int(np.searchsorted(distances_matched,distance_threshold,side='left'))
+            rows_degree,cols_degree = rows[:number_pairs],cols[:number_pairs]
+        else:
+            rows_degree,cols_degree = get_matching_from_matrix(distance_matrix,distance_threshold,strategy=strategy,mode='treatment_sort')
+        instances_0,instances_1 = indexes_t0[cols_degree],indexes_t1[rows_degree]
+        valid = found[instances_0] & found[instances_1]
+        increment('pairs_matched',len(valid))
+        increment('dropped_pairs',int(np.count_nonzero(~valid)))
+        directions = np.full(len(valid),outcome_direction)
+        T_O,T_not_O,same_O = get_counts_from_outcomes(np.column_stack([outcomes[instances_0],outcomes[instances_1]]),directions,valid)
+        causal_metric,causal_metric_IC,T_O,T_not_O,same_O = get_metric_from_counts(T_O,T_not_O,same_O,stat_param)
+        rules_.append([
+            degree,distance_threshold,len(valid),
+            len(valid)*100/number_possible_pairs if number_possible_pairs > 0 else 0,path_treatment,
+            t0,t1,causal_metric,causal_metric_IC,T_O,
+            T_not_O,same_O,int(np.count_nonzero(~valid)),type_distance
+        ])
+    return rules_
@@ -0,0 +1,220 @@
+"""This file contains modules to obtain candidate pairs with an approximate nearest neighbours index."""
+
+import numpy as np
+
+from distance_kernels import fill_distances,fill_euclidean_distances,get_distance_kernel,get_unit_embeddings
+from pairs_mining import get_embeddings_rows_cols
+
+
+# kernels depending only on the direction of the embeddings : the coarse quantizer is trained on the normalized embeddings
+ANGULAR_DISTANCES = ['cosine','normalized_euclidian']
+
+
+class IVFIndex:
+    """
+    Inverted file index over embeddings (numpy/scipy only).
+
+    The embeddings are partitioned into n_lists clusters by a k-means coarse quantizer.
+    A query only computes its exact distances to the embeddings of the n_probe clusters with the closest centroids,
+    so the number of distances computed is about n_probe/n_lists of the full matrix.
+    The exact distances are computed with the kernel type_distance (see distance_kernels), so the candidate graph holds the
+    same distances as the dense matrix of get_matrix_similarity_pairs. The clusters are euclidean (on the normalized embeddings
+    for cosine and normalized_euclidian) : for the other kernels (e.g. l1) they are only a heuristic partition,
+    and the recall should be checked with get_recall_of_candidate_graph.
+
+    Parameters :
+    embeddings : numpy array of shape (n,k)
+    n_lists : int (by default = sqrt(n))
+        Number of clusters of the coarse quantizer
+    n_train : int (by default = 256*n_lists)
+        Number of embeddings sampled to train the coarse quantizer
+    seed : int
+    type_distance : str (by default = 'euclidian')
+        Distance kernel, see distance_kernels.DISTANCE_KERNELS
+    """
+
+    def __init__(self,embeddings,n_lists=None,n_train=None,seed=0,type_distance='euclidian'):
+        get_distance_kernel(type_distance) # raises a ValueError for an unknown kernel
+        self.type_distance = type_distance
+        self.embeddings = np.ascontiguousarray(embeddings,dtype=np.float32)
+        quantizer_embeddings = self.get_quantizer_embeddings(self.embeddings)
+        n = len(self.embeddings)
+        if n_lists is None:
+            n_lists = int(np.sqrt(n))
+        self.n_lists = max(1,min(n_lists,n))
+        if n_train is None:
+            n_train = 256*self.n_lists
+
+        rng = np.random.default_rng(seed)
+        train = quantizer_embeddings
+        if n > n_train:
+            train = quantizer_embeddings[rng.choice(n,n_train,replace=False)]
+        if self.n_lists == 1:
+            self.centroids = train.mean(axis=0,keepdims=True)
+        else:
+            from scipy.cluster.vq import kmeans2
+
+            self.centroids,_ = kmeans2(train.astype(np.float64),self.n_lists,minit='++',seed=rng)
+        self.centroids = self.centroids.astype(np.float32)
+
+        # assignment of each embedding to its closest centroid
+        assignments = self.get_closest_lists(self.embeddings,1)[:,0]
+        self.list_order = np.argsort(assignments,kind='stable')
+        self.list_offsets = np.concatenate([[0],np.cumsum(np.bincount(assignments,minlength=self.n_lists))])
+
+    def get_quantizer_embeddings(self,embeddings):
+        """Returns the embeddings in the space of the coarse quantizer (normalized for the angular kernels)."""
+        if self.type_distance in ANGULAR_DISTANCES:
+            return get_unit_embeddings(embeddings)
+        return embeddings
+
+    def get_closest_lists(self,queries,n_probe,block_size=4096):
+        """Returns for each query the indexes of the n_probe closest centroids."""
+        queries = self.get_quantizer_embeddings(queries)
+        n_probe = min(n_probe,self.n_lists)
+        closest = np.empty((len(queries),n_probe),dtype=np.intp)
+        distances = np.empty((min(block_size,len(queries)),self.n_lists),dtype=np.float32)
+        for start in range(0,len(queries),block_size):
+            block = queries[start:start+block_size]
+            out = distances[:len(block)]
+            fill_euclidean_distances(block,self.centroids,out)
+            if n_probe < self.n_lists:
+                closest[start:start+block_size] = np.argpartition(out,n_probe-1,axis=1)[:,:n_probe]
+            else:
+                closest[start:start+block_size] = np.arange(self.n_lists)
+        return closest
+
+    def get_members(self,list_):
+        """Returns the indexes of the embeddings of a list."""
+        return self.list_order[self.list_offsets[list_]:self.list_offsets[list_+1]]
+
+    def search(self,queries,distance_threshold=np.inf,k=None,n_probe=8,exclude_self=False,block_size=1024):
+        """
+        Returns the candidate neighbours of the queries under the distance threshold (radius search), optionally limited to the top k.
+
+        Each probed list is processed with all the queries probing it, so the distances are computed by blocks.
+
+        Parameters :
+        queries : numpy array of shape (m,k)
+        distance_threshold : float
+        k : int (by default = None)
+            Maximum number of neighbours per query
+        n_probe : int
+            Number of lists visited per query
+        exclude_self : bool
+            True if the queries are the indexed embeddings (the query i is not its own neighbour)
+
+        Returns :
+        candidate_graph : scipy.sparse.csr_matrix of shape (m,n)
+            Distances of the candidate pairs, the missing entries are not candidates
+        """
+        queries = np.ascontiguousarray(queries,dtype=np.float32)
+        closest = self.get_closest_lists(queries,n_probe)
+        probe_lists = closest.ravel()
+        probe_queries = np.repeat(np.arange(len(queries)),closest.shape[1])
+        order = np.argsort(probe_lists,kind='stable')
+        probe_lists,probe_queries = probe_lists[order],probe_queries[order]
+        probe_offsets = np.searchsorted(probe_lists,np.arange(self.n_lists+1))
+
+        all_rows,all_cols,all_values = [],[],[]
+        for list_ in range(self.n_lists):
+            members = self.get_members(list_)
+            queries_list = probe_queries[probe_offsets[list_]:probe_offsets[list_+1]]
+            if len(members) == 0 or len(queries_list) == 0:
+                continue
+            for start in range(0,len(queries_list),block_size):
+                queries_block = queries_list[start:start+block_size]
+                distances = np.empty((len(queries_block),len(members)),dtype=np.float32)
+                fill_distances(queries[queries_block],self.embeddings[members],distances,self.type_distance)
+                if exclude_self:
+                    distances[queries_block[:,None] == members[None,:]] = np.inf
+                rows,cols = np.nonzero(distances < distance_threshold)
+                all_rows.append(queries_block[rows])
+                all_cols.append(members[cols])
+                all_values.append(distances[rows,cols])
+
+        rows = np.concatenate(all_rows) if all_rows else np.array([],dtype=np.intp)
+        cols = np.concatenate(all_cols) if all_cols else np.array([],dtype=np.intp)
+        values = np.concatenate(all_values) if all_values else np.array([],dtype=np.float32)
+
+        if k is not None and len(values) > 0:
+            # keeping the k closest neighbours of each query
+            order = np.lexsort((values,rows))
+            rows,cols,values = rows[order],cols[order],values[order]
+            first_of_query = np.searchsorted(rows,rows,side='left')
+            keep = np.arange(len(rows)) - first_of_query < k
+            rows,cols,values = rows[keep],cols[keep],values[keep]
+
+        from scipy.sparse import csr_matrix
+
+        # explicit zeros are kept by the constructor : a distance of 0 stays a candidate
+        return csr_matrix((values,(rows,cols)),shape=(len(queries),len(self.embeddings)))
+
+
+def get_candidate_graph(model,instances_rows,instances_cols=None,distance_threshold=np.inf,k=None,n_lists=None,n_probe=8,seed=0,n_sample_recall=0,type_distance='euclidian'):
+    """
+    Returns the sparse graph of the candidate pairs under the distance threshold, built with an IVF index.
+    It replaces the n×n (or t0×t1) distance matrix of get_matrix_similarity_pairs for large target classes :
+    the graph can be given directly to get_pairs_from_matrix_and_threshold (with its labels) or get_matching_from_matrix.
+
+    Parameters :
+    model : ampligraph EmbeddingModel
+    instances_rows : list of instances (instances_t1 in mode treatment_sort, all instances in mode mixed)
+    instances_cols : list of instances (instances_t0 in mode treatment_sort, None in mode mixed)
+    distance_threshold : float
+    k : int (by default = None)
+        Maximum number of candidates per row
+    n_lists, n_probe, seed : parameters of the IVFIndex
+    n_sample_recall : int (by default = 0)
+        If > 0, the recall of the graph against the exact distances is estimated on this number of rows and printed
+    type_distance : str (by default = 'euclidian')
+        Distance kernel, see distance_kernels.DISTANCE_KERNELS
+
+    Returns :
+    candidate_graph : scipy.sparse.csr_matrix
+    row_labels, col_labels : numpy arrays
+    """
+    embeddings_rows,embeddings_cols,row_labels,col_labels = get_embeddings_rows_cols(model,instances_rows,instances_cols)
+    squared = instances_cols is None
+    index = IVFIndex(embeddings_cols,n_lists=n_lists,seed=seed,type_distance=type_distance)
+    candidate_graph = index.search(embeddings_rows,distance_threshold=distance_threshold,k=k,n_probe=n_probe,exclude_self=squared)
+
+    if n_sample_recall > 0:
+        recall = get_recall_of_candidate_graph(candidate_graph,embeddings_rows,embeddings_cols,distance_threshold,k=k,n_sample=n_sample_recall,exclude_self=squared,seed=seed,type_distance=type_distance)
+        print('Recall of the candidate graph : ',round(recall,4))
+    return candidate_graph,row_labels,col_labels
+
+
+def get_recall_of_candidate_graph(candidate_graph,embeddings_rows,embeddings_cols,distance_threshold,k=None,n_sample=1000,exclude_self=False,seed=0,type_distance='euclidian'):
+    """
+    Returns the recall of the candidate graph against the exact distances.
+
+    The exact pairs under the threshold (limited to the k closest if k is given) are computed for a sample of rows only,
+    so the recall can be estimated without the full distance matrix.
+
+    Returns :
+    recall : float
+        Proportion of the exact pairs that are in the candidate graph (1.0 if there is no exact pair)
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = candidate_graph.shape[0]
+    sample_rows = np.sort(rng.choice(n_rows,min(n_sample,n_rows),replace=False))
+
+    exact = np.empty((len(sample_rows),len(embeddings_cols)),dtype=np.float32)
+    fill_distances(np.ascontiguousarray(embeddings_rows[sample_rows],dtype=np.float32),np.asarray(embeddings_cols,dtype=np.float32),exact,type_distance)
+    if exclude_self:
+        exact[np.arange(len(sample_rows)),sample_rows] = np.inf
+
+    candidate_graph = candidate_graph.tocsr()
+    number_exact,number_found = 0,0
+    for i,row in enumerate(sample_rows):
+        exact_cols = np.flatnonzero(exact[i] < distance_threshold)
+        if k is not None and len(exact_cols) > k:
+            exact_cols = exact_cols[np.argsort(exact[i,exact_cols],kind='stable')[:k]]
+        found_cols = candidate_graph.indices[candidate_graph.indptr[row]:candidate_graph.indptr[row+1]]
+        number_exact += len(exact_cols)
+        number_found += np.isin(exact_cols,found_cols).sum()
+
+    if number_exact == 0:
+        return 1.0
+    return number_found/number_exact
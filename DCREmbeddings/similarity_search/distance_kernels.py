@@ -0,0 +1,142 @@
+"""This file contains modules to compute the distances between embeddings with several distance kernels."""
+
+import numpy as np
+
+
+def fill_euclidean_distances(embeddings_rows,embeddings_cols,distance_matrix,block_size=1024):
+    """
+    Fills distance_matrix with the euclidean distances between the rows of embeddings_rows and embeddings_cols.
+    The computation is done per block of rows to bound the size of the temporary arrays.
+    """
+    squared_norms_cols = np.einsum('ij,ij->i',embeddings_cols,embeddings_cols)
+    for start in range(0,len(embeddings_rows),block_size):
+        block = embeddings_rows[start:start+block_size]
+        squared_norms_block = np.einsum('ij,ij->i',block,block)
+        out = distance_matrix[start:start+block_size]
+        if isinstance(out,np.memmap): # the block is written to disk once computed
+            out = np.asarray(out)
+        np.dot(block,embeddings_cols.T,out=out)
+        out *= -2
+        out += squared_norms_block[:,None]
+        out += squared_norms_cols[None,:]
+        np.maximum(out,0,out=out)
+        np.sqrt(out,out=out)
+    return distance_matrix
+
+
+def fill_cosine_distances(embeddings_rows,embeddings_cols,distance_matrix,block_size=1024):
+    """
+    Fills distance_matrix with the cosine distances (1 - cosine similarity) between the rows of embeddings_rows and embeddings_cols.
+    The embeddings are normalized once and the similarities are obtained per block of rows with a matrix product.
+    A null embedding is at distance 1 of all embeddings.
+    """
+    unit_cols = get_unit_embeddings(embeddings_cols)
+    for start in range(0,len(embeddings_rows),block_size):
+        block = get_unit_embeddings(embeddings_rows[start:start+block_size])
+        out = distance_matrix[start:start+block_size]
+        if isinstance(out,np.memmap):
+            out = np.asarray(out)
+        np.dot(block,unit_cols.T,out=out)
+        np.subtract(1,out,out=out)
+        np.clip(out,0,2,out=out)
+    return distance_matrix
+
+
+def fill_normalized_euclidean_distances(embeddings_rows,embeddings_cols,distance_matrix,block_size=1024):
+    """
+    Fills distance_matrix with the euclidean distances between the normalized embeddings (sqrt(2 - 2 cosine similarity)).
+    """
+    fill_cosine_distances(embeddings_rows,embeddings_cols,distance_matrix,block_size)
+    for start in range(0,len(distance_matrix),block_size):
+        out = distance_matrix[start:start+block_size]
+        if isinstance(out,np.memmap):
+            out = np.asarray(out)
+        out *= 2
+        np.sqrt(out,out=out)
+    return distance_matrix
+
+
+def fill_l1_distances(embeddings_rows,embeddings_cols,distance_matrix,block_size=1024):
+    """
+    Fills distance_matrix with the L1 (manhattan) distances between the rows of embeddings_rows and embeddings_cols.
+    There is no matrix product for this distance : the blocks of rows are computed with scipy cdist.
+    """
+    from scipy.spatial.distance import cdist
+
+    for start in range(0,len(embeddings_rows),block_size):
+        out = distance_matrix[start:start+block_size]
+        out[...] = cdist(embeddings_rows[start:start+block_size],embeddings_cols,metric='cityblock')
+    return distance_matrix
+
+
+def get_unit_embeddings(embeddings):
+    """Returns the embeddings divided by their norm (null embeddings are kept null)."""
+    norms = np.linalg.norm(embeddings,axis=1,keepdims=True)
+    norms[norms == 0] = 1
+    return (embeddings/norms).astype(embeddings.dtype,copy=False)
+
+
+def get_paired_euclidean_distances(embeddings_a,embeddings_b):
+    """Returns the euclidean distances between the rows of the same index."""
+    return np.linalg.norm(embeddings_a-embeddings_b,axis=1)
+
+
+def get_paired_cosine_distances(embeddings_a,embeddings_b):
+    """Returns the cosine distances between the rows of the same index."""
+    return np.clip(1-np.einsum('ij,ij->i',get_unit_embeddings(embeddings_a),get_unit_embeddings(embeddings_b)),0,2)
+
+
+def get_paired_normalized_euclidean_distances(embeddings_a,embeddings_b):
+    """Returns the euclidean distances of the normalized embeddings between the rows of the same index."""
+    return np.sqrt(2*get_paired_cosine_distances(embeddings_a,embeddings_b))
+
+
+def get_paired_l1_distances(embeddings_a,embeddings_b):
+    """Returns the L1 distances between the rows of the same index."""
+    return np.abs(embeddings_a-embeddings_b).sum(axis=1)
+
+
+# name -> (function filling a distance matrix, function computing the distances of paired rows)
+DISTANCE_KERNELS = {
+    'euclidian':(fill_euclidean_distances,get_paired_euclidean_distances),
+    'cosine':(fill_cosine_distances,get_paired_cosine_distances),
+    'normalized_euclidian':(fill_normalized_euclidean_distances,get_paired_normalized_euclidean_distances),
+    'l1':(fill_l1_distances,get_paired_l1_distances),
+}
+
+
+def register_distance_kernel(type_distance,fill_function,paired_function):
+    """
+    Adds a distance kernel to the registry.
+
+    Parameters :
+    type_distance : str
+    fill_function : function (embeddings_rows,embeddings_cols,distance_matrix,block_size) filling the float32 distance matrix in place
+    paired_function : function (embeddings_a,embeddings_b) returning the distances between the rows of the same index
+    """
+    DISTANCE_KERNELS[type_distance] = (fill_function,paired_function)
+
+
+def get_distance_kernel(type_distance):
+    """
+    Returns the functions (fill_function,paired_function) of a distance kernel.
+    """
+    if type_distance not in DISTANCE_KERNELS:
+        raise ValueError("This distance does not exist, please switch to "+", ".join(DISTANCE_KERNELS)+".")
+    return DISTANCE_KERNELS[type_distance]
+
+
+def fill_distances(embeddings_rows,embeddings_cols,distance_matrix,type_distance='euclidian',block_size=1024):
+    """
+    Fills distance_matrix (float32, possibly memory-mapped) with the distances of the kernel type_distance, per block of rows.
+    """
+    fill_function,_ = get_distance_kernel(type_distance)
+    return fill_function(embeddings_rows,embeddings_cols,distance_matrix,block_size)
+
+
+def get_paired_distances(embeddings_a,embeddings_b,type_distance='euclidian'):
+    """
+    Returns the distances of the kernel type_distance between the rows of the same index of embeddings_a and embeddings_b.
+    """
+    _,paired_function = get_distance_kernel(type_distance)
+    return paired_function(embeddings_a,embeddings_b)
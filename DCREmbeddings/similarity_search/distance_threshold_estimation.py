@@ -1,183 +1,519 @@
 """This file contains modules to estimate the distance threshold to mine similar pairs."""
 
-from ampligraph.discovery import find_nearest_neighbours
-import pandas as pd
 import numpy as np
 import random
-import itertools
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor,ThreadPoolExecutor,as_completed
 
-from scipy.spatial import distance
+from embedding_cache import get_distance_for_pair,get_distances_for_pairs
+from instrumentation import increment,stage,timed
+from knowledge_graph import get_knowledge_graph
+from prediction_cache import PredictionCache
+from property_catalog import get_property_catalog
 
 
-def draw_set_of_pairs(list_target_class_instances,n_sample=200):
+def draw_set_of_pairs(list_target_class_instances,n_sample=200,seed=None,treatment_values=None,allocation='proportional'):
     """
     Getting a set of randomly draw pairs of the target class. 
+
+    The pairs are drawn directly by their index among the n(n-1)/2 possible pairs, so the combinations are never listed.
+    With treatment_values, the pairs are stratified on the (unordered) treatment values of their instances.
     
     Parameters :
     list_target_class_instances : list 
     n_sample : int
+    seed : int (by default = None)
+        Seed of the draw, None to use the global random state
+    treatment_values : list (by default = None)
+        Treatment value of each instance of list_target_class_instances
+    allocation : str (by default = 'proportional')
+        Number of pairs drawn per stratum : 'proportional' to the number of pairs of the stratum or 'equal'
 
     Returns :
     list_pairs : list
         List of randomly selected pairs
     """
-    all_pairs = [pair for pair in itertools.combinations(list_target_class_instances,2)]
-    return random.sample(all_pairs,n_sample)
+    rng = random.Random(seed) if seed is not None else random
+    strata = get_pair_strata(list_target_class_instances,treatment_values)
+    sizes = [size_ for size_,_ in strata]
+    if n_sample > sum(sizes):
+        raise ValueError("Sample larger than the number of pairs.")
+
+    list_pairs = []
+    for (size_,decode_),n_stratum in zip(strata,get_allocation(sizes,n_sample,allocation)):
+        indexes_ = np.array(rng.sample(range(size_),n_stratum),dtype=np.int64)
+        rows,cols = decode_(indexes_)
+        list_pairs += [(list_target_class_instances[i],list_target_class_instances[j]) for i,j in zip(rows.tolist(),cols.tolist())]
+    return list_pairs
 
 
-def get_measures_for_pairs(sample_pairs,model,X,dic_functionality,type_end,PATH_TYPE,type_distance='euclidian'):
+def iter_pairs(list_target_class_instances,seed=None,treatment_values=None,allocation='proportional'):
     """
-    Returns the the list of measures (distance and similarity) for all pairs.
+    Iterator over randomly drawn distinct pairs of the target class, so more pairs can be drawn on demand.
+
+    The pairs are drawn by index (with rejection of the pairs already drawn) until all pairs are drawn.
+    With treatment_values, the stratum of each pair is drawn proportionally to its remaining pairs (allocation='proportional')
+    or the strata are visited in turn (allocation='equal').
     """
-    measures = []
-    for pair_ in sample_pairs:
-        dist_ = get_distance_for_pair(pair_,model)
-        sim_ = get_similarity_for_pair(pair_,model,X,dic_functionality,type_end,PATH_TYPE)
-        measures.append([dist_,sim_])
-    return measures
+    rng = random.Random(seed) if seed is not None else random
+    strata = get_pair_strata(list_target_class_instances,treatment_values)
+    drawn = [set() for _ in strata]
+    turn = 0
+    while True:
+        remaining = [size_-len(drawn_) for (size_,_),drawn_ in zip(strata,drawn)]
+        if sum(remaining) == 0:
+            return
+        if allocation == 'equal':
+            while remaining[turn % len(strata)] == 0:
+                turn += 1
+            s_ = turn % len(strata)
+            turn += 1
+        else:
+            s_ = rng.choices(range(len(strata)),weights=remaining)[0]
+
+        size_,decode_ = strata[s_]
+        index_ = rng.randrange(size_)
+        while index_ in drawn[s_]:
+            index_ = rng.randrange(size_)
+        drawn[s_].add(index_)
+        rows,cols = decode_(np.array([index_],dtype=np.int64))
+        yield (list_target_class_instances[int(rows[0])],list_target_class_instances[int(cols[0])])
+
+
+def get_pair_strata(list_target_class_instances,treatment_values=None):
+    """
+    Returns the strata of pairs as a list of (number of pairs, decoding function).
+    The decoding function maps an array of pair indexes of the stratum to the indexes (rows,cols) of the two instances.
+    Without treatment_values, there is a single stratum with all pairs of the target class.
+    """
+    if treatment_values is None:
+        return [get_stratum_within(np.arange(len(list_target_class_instances)))]
+
+    groups = {}
+    for i,value_ in enumerate(treatment_values):
+        groups.setdefault(value_,[]).append(i)
+    values_ = list(groups)
+    strata = []
+    for a,value_a in enumerate(values_):
+        strata.append(get_stratum_within(np.array(groups[value_a])))
+        for value_b in values_[a+1:]:
+            strata.append(get_stratum_between(np.array(groups[value_a]),np.array(groups[value_b])))
+    return strata
+
+
+def get_stratum_within(group_):
+    """
+    Stratum of the pairs of instances of a same group, indexed as itertools.combinations(group_,2).
+    """
+    n = len(group_)
+    def first_index(i_):
+        return i_*n-i_*(i_+1)//2
+
+    def decode_(indexes_):
+        # first instance i such that i*n-i*(i+1)/2 <= index, corrected for the float precision
+        i = np.floor(((2*n-1)-np.sqrt((2*n-1)**2-8*indexes_.astype(np.float64)))/2).astype(np.int64)
+        i = np.clip(i,0,max(n-2,0))
+        i = np.where(first_index(i) > indexes_,i-1,i)
+        i = np.where(first_index(i+1) <= indexes_,i+1,i)
+        j = indexes_-first_index(i)+i+1
+        return group_[i],group_[j]
+    return n*(n-1)//2,decode_
+
+
+def get_stratum_between(group_a,group_b):
+    """
+    Stratum of the pairs with one instance in group_a and the other in group_b, indexed as itertools.product(group_a,group_b).
+    """
+    def decode_(indexes_):
+        return group_a[indexes_//len(group_b)],group_b[indexes_ % len(group_b)]
+    return len(group_a)*len(group_b),decode_
+
 
+def get_allocation(sizes,n_sample,allocation='proportional'):
+    """
+    Returns the number of pairs to draw in each stratum given their sizes.
+    'proportional' uses the largest remainders, 'equal' splits the pairs equally between the strata (up to their sizes).
+    """
+    sizes = np.array(sizes,dtype=np.int64)
+    if n_sample == 0:
+        return [0]*len(sizes)
+    if allocation == 'equal':
+        allocated = np.zeros(len(sizes),dtype=np.int64)
+        while allocated.sum() < n_sample:
+            open_ = np.flatnonzero(allocated < sizes)
+            share_ = max(1,(n_sample-allocated.sum())//len(open_))
+            for s_ in open_:
+                add_ = min(share_,sizes[s_]-allocated[s_],n_sample-allocated.sum())
+                allocated[s_] += add_
+        return allocated.tolist()
+
+    quotas = n_sample*sizes/sizes.sum()
+    allocated = np.floor(quotas).astype(np.int64)
+    for s_ in np.argsort(-(quotas-allocated),kind='stable')[:n_sample-allocated.sum()]:
+        allocated[s_] += 1
+    return allocated.tolist()
 
-def get_distance_for_pair(pair_,model,type_distance='euclidian'):
+
+@timed('get_measures_for_pairs')
+def get_measures_for_pairs(sample_pairs,model,X,dic_functionality,type_end,PATH_TYPE,type_distance='euclidian',cache=None,cache_size=None,cache_eviction='lru',max_depth=3,n_jobs=1,chunk_size=None,backend='process',model_loader=None,verbose=False,catalog=None):
     """
-    Returns the distance between the embedding vectors of a pair.
+    Returns the the list of measures (distance and similarity) for all pairs.
+
+    The top ranked objects predicted by the model are memoized in a PredictionCache shared by all pairs.
+    An existing cache can be given (and inspected afterwards with cache.get_stats()), otherwise one is created
+    with cache_size entries at most (None for unbounded) and the cache_eviction policy ('lru' or 'fifo').
+    The similarities of the sub-pairs are also shared between the pairs, max_depth bounds the recursion of the similarity measure.
 
-    The type of the distance can be specified in : euclidian, TO_COMPLETE
+    With n_jobs > 1, the pairs are assessed by chunks of chunk_size pairs in parallel, and the measures are returned in the order of the pairs :
+    - backend='process' (default) : each worker process (spawned, not forked) builds its own KG and cache, and loads its model by calling model_loader
+      (a picklable function without argument, e.g. functools.partial(restore_model,model_path)). If model_loader is None, the model is pickled.
+      The given cache is not used by the workers. In a script, the call must be under if __name__ == '__main__'.
+    - backend='thread' : the workers share the model, the cache and the KG. The calls to the model are serialized by a lock,
+      so models that are not thread-safe can be used. As model.predict is the costly call and runs under the lock, the threads only
+      speed up the measures when the model releases the GIL outside of its predict calls : it is mostly useful to share the cache,
+      or for models that can not be pickled nor loaded by model_loader.
+    With verbose=True, the progress and the throughput (pairs/s) are printed.
+
+    The properties, their objects and the end nodes are read from a PropertyCatalog, built from X if catalog is None
+    (see get_property_catalog to build it once per dataset). If dic_functionality is None, it is inferred by the catalog.
     """
-    array_pair = np.array(pair_)
-    embedding_pair = model.get_embeddings(entities=np.array(array_pair))
-    if type_distance=='euclidian':
-        return distance.euclidean(embedding_pair[0],embedding_pair[1])
+    X = get_knowledge_graph(X)
+    if catalog is None:
+        catalog = get_property_catalog(X,PATH_TYPE,type_end)
+    if dic_functionality is None:
+        dic_functionality = catalog.get_dic_functionality()
+    if cache is None:
+        cache = PredictionCache(max_size=cache_size,eviction=cache_eviction)
+    increment('pairs_measured',len(sample_pairs))
+    if n_jobs is not None and n_jobs == 1:
+        measures = []
+        memo = {}
+        start_time = time.time()
+        distances = get_distances_for_pairs(sample_pairs,model,type_distance=type_distance)
+        for pair_,dist_ in zip(sample_pairs,distances.tolist()):
+            sim_ = get_similarity_for_pair(pair_,model,X,dic_functionality,type_end,PATH_TYPE,cache=cache,max_depth=max_depth,memo=memo,catalog=catalog)
+            measures.append([dist_,sim_])
+            if verbose:
+                print_progress(len(measures),len(sample_pairs),start_time)
+        return measures
+
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = multiprocessing.cpu_count()
+    if chunk_size is None: # a few chunks per worker to balance the load
+        chunk_size = max(1,math.ceil(len(sample_pairs)/(4*n_jobs)))
+    chunks = [sample_pairs[i:i+chunk_size] for i in range(0,len(sample_pairs),chunk_size)]
+    parameters_ = (dic_functionality,type_end,PATH_TYPE,type_distance,max_depth)
+
+    if backend == 'thread':
+        state_ = {'model':SerializedModel(model),'X':X,'catalog':catalog,'cache':cache,'memo':{},'parameters':parameters_}
+        executor = ThreadPoolExecutor(max_workers=n_jobs)
+        submit = lambda chunk_: executor.submit(get_measures_for_chunk,chunk_,state_)
+    elif backend == 'process':
+        initargs = (None if model_loader is not None else model,model_loader,X.X,catalog,cache_size,cache_eviction,parameters_)
+        executor = ProcessPoolExecutor(max_workers=n_jobs,mp_context=multiprocessing.get_context('spawn'),initializer=init_worker_measures,initargs=initargs)
+        submit = lambda chunk_: executor.submit(get_measures_for_chunk,chunk_)
     else:
+        print("This backend does not exist, please switch to thread or process.")
         return None
 
+    measures_per_chunk = [None]*len(chunks)
+    number_done = 0
+    start_time = time.time()
+    with executor:
+        futures = {submit(chunk_):i for i,chunk_ in enumerate(chunks)}
+        for future in as_completed(futures):
+            i = futures[future]
+            measures_per_chunk[i] = future.result()
+            number_done += len(chunks[i])
+            if verbose:
+                print_progress(number_done,len(sample_pairs),start_time)
+    return [measure for measures_chunk in measures_per_chunk for measure in measures_chunk]
+
+
+class SerializedModel:
+    """
+    Wrapper of a model serializing its calls with a lock, so a model that is not thread-safe can be shared by threads.
+    """
+
+    def __init__(self,model):
+        self.model = model
+        self.lock = threading.Lock()
+
+    def predict(self,*args,**kwargs):
+        with self.lock:
+            return self.model.predict(*args,**kwargs)
+
+    def get_embeddings(self,*args,**kwargs):
+        with self.lock:
+            return self.model.get_embeddings(*args,**kwargs)
+
+
+WORKER_STATE = {}
+
+
+def init_worker_measures(model,model_loader,X,catalog,cache_size,cache_eviction,parameters_):
+    """
+    Initializes a worker process of get_measures_for_pairs : loads the model and builds the KG and the cache of the worker (the catalog is shared).
+    """
+    if model_loader is not None:
+        model = model_loader()
+    WORKER_STATE['model'] = model
+    WORKER_STATE['X'] = get_knowledge_graph(X)
+    WORKER_STATE['catalog'] = catalog
+    WORKER_STATE['cache'] = PredictionCache(max_size=cache_size,eviction=cache_eviction)
+    WORKER_STATE['memo'] = {}
+    WORKER_STATE['parameters'] = parameters_
+
+
+def get_measures_for_chunk(chunk_,state_=None):
+    """
+    Returns the measures of a chunk of pairs, with the state of the worker (model, KG, cache, parameters).
+    """
+    if state_ is None:
+        state_ = WORKER_STATE
+    dic_functionality,type_end,PATH_TYPE,type_distance,max_depth = state_['parameters']
+    measures = []
+    distances = get_distances_for_pairs(chunk_,state_['model'],type_distance=type_distance)
+    for pair_,dist_ in zip(chunk_,distances.tolist()):
+        sim_ = get_similarity_for_pair(pair_,state_['model'],state_['X'],dic_functionality,type_end,PATH_TYPE,cache=state_['cache'],max_depth=max_depth,memo=state_['memo'],catalog=state_['catalog'])
+        measures.append([dist_,sim_])
+    return measures
+
 
-def get_similarity_for_pair(pair_,model,X,dic_functionality,type_end,PATH_TYPE,previous_node_weight=1):
+def print_progress(number_done,number_total,start_time):
+    """Prints the number of pairs assessed and the throughput."""
+    elapsed = time.time()-start_time
+    throughput = number_done/elapsed if elapsed > 0 else float('inf')
+    print('Pairs assessed : {}/{} - {:.1f} pairs/s'.format(number_done,number_total,throughput))
+
+
+def get_similarity_for_pair(pair_,model,X,dic_functionality,type_end,PATH_TYPE,previous_node_weight=1,cache=None,max_depth=3,memo=None,path_=None,catalog=None):
     """
     Returns the similarity between two instances of a pair using the predictions of the learned embedding model.
     This function is called recursively on all properties that need to be assessed.
+
+    For each property, the shared top objects count as similar. The objects that are not shared are aligned with a
+    maximum-weight bipartite assignment over the matrix of their sub-similarities, each sub-pair being assessed only once.
+    The recursion stops at max_depth (the objects are then only compared on their intersection),
+    and a sub-pair already assessed on the current path (cycle in the KG) scores 0.
     
     Parameters:
         pair_ : list
         model : ampligraph.model
         X : numpy array
         dic_functionalty : dictionnary
+        previous_node_weight : float
+            Weight of the pair in the similarity of its parent pair
+        cache : PredictionCache (by default = None)
+        max_depth : int (by default = 3)
+            Maximum number of recursive calls on a path
+        memo : dictionnary (by default = None)
+            Similarities of the sub-pairs already assessed, can be shared between calls
+        catalog : PropertyCatalog (by default = None)
+            Properties, objects and end nodes of X, built from X if None and kept for the next calls on the same X
+            (see get_property_catalog), dic_functionality can then be None to infer it
         
     Returns:
         similarity_global : float
     """
-    similarity_entities = 0
+    X = get_knowledge_graph(X)
+    if catalog is None:
+        catalog = get_property_catalog(X,PATH_TYPE,type_end)
+    if dic_functionality is None:
+        dic_functionality = catalog.get_dic_functionality()
+    if memo is None:
+        memo = {}
+    if path_ is None:
+        path_ = set()
+
     entity_0 = pair_[0]
     entity_1 = pair_[1]
+    key_ = (min(entity_0,entity_1),max(entity_0,entity_1),max_depth)
+    if key_ in memo:
+        return memo[key_]*previous_node_weight
     
     # we first need to now what properties to go through
-    properties_to_assess = get_properties_to_assess(pair_,X)
-    properties_to_assess = list(dic_functionality.keys())
-    
-    relative_weight = previous_node_weight/len(properties_to_assess)
+    properties_pair = set(get_properties_to_assess([entity_0],X,catalog=catalog)+get_properties_to_assess([entity_1],X,catalog=catalog))
+    properties_to_assess = [p_ for p_ in dic_functionality if p_ in properties_pair]
+    if len(properties_to_assess) == 0:
+        memo[key_] = 0
+        return 0
     
+    relative_weight = 1/len(properties_to_assess)
+    path_.add(key_[:2])
+
+    # (1) and (2) we obtain the top n triples for each instance on all properties with one call to the model
+    requests_ = [(entity_,p_,dic_functionality[p_]) for p_ in properties_to_assess for entity_ in [entity_0,entity_1]]
+    top_objects = get_n_objects_for_properties_entities(requests_,model,X,cache=cache,catalog=catalog)
+
     # we go through each property
-    for p_ in properties_to_assess:
-        # (1) we obtain the possible objects
-        objects_for_p = get_objects_of_property(p_,X)
-        
-        # (2) we obtain the top n triples for each instance on the property p_
-        top_triples_i0 = get_n_objects_for_property_entity(entity_0,p_,objects_for_p,model,dic_functionality[p_])
-        top_triples_i1 = get_n_objects_for_property_entity(entity_1,p_,objects_for_p,model,dic_functionality[p_])
-        
+    similarity_entities = 0
+    for i,p_ in enumerate(properties_to_assess):
+        top_triples_i0 = top_objects[2*i]
+        top_triples_i1 = top_objects[2*i+1]
+        if len(top_triples_i0) == 0:
+            continue
+
         # (3) we compare the top triples : 2 different cases depending on the triples type
-        if end_node(top_triples_i0[0],X,PATH_TYPE,type_end):
-            # studying literals or URIs without properties : we study the intersection set
-            intersection = list(set(top_triples_i0).intersection(top_triples_i1))
-            objects_common = len(intersection)/dic_functionality[p_] # score entre 0 et 1
-            similarity_property = objects_common*relative_weight # score entre 0 et poids du chemin
-            similarity_entities += similarity_property
-            
-        else:
-            # studying URIs : exploration stops if same URIs, or recursive call if different
-            intersection = list(set(top_triples_i0).intersection(top_triples_i1))
-            objects_common = len(intersection)/dic_functionality[p_]
-            similarity_property = objects_common/relative_weight
-            
-            # exploring the URIs not similar : we must go through all possible combinations (which are compared of pairs)
-            objects_i0 = [i for i in top_triples_i0 if i not in intersection]
-            objects_i1 = [i for i in top_triples_i1 if i not in intersection]
-            
-            set_of_combinaisons = [list(zip(each_p, objects_i1)) for each_p in itertools.permutations(objects_i0, len(objects_i1))]
-            scores_combinaisons = {}
-            
-            for combinaison in set_of_combinaisons:
-                score_pairs = 0
-                for pair_combi in combinaison:
-                    similarity_pair_combi = get_similarity_for_pair(pair_combi,model,X,dic_functionality,previous_node_weight=relative_weight)
-                    score_pairs += similarity_pair_combi
-                scores_combinaisons[combinaison] = score_pairs
-            
-            scores_combi = list(scores_combinaisons.values())
-            similarity_property = max(scores_combi)/relative_weight
-            similarity_entities += similarity_property
-            
-    return similarity_entities
+        intersection = set(top_triples_i0).intersection(top_triples_i1)
+        objects_common = len(intersection) # score entre 0 et la fonctionnalite
+
+        if not end_node(top_triples_i0[0],X,PATH_TYPE,type_end,catalog=catalog) and max_depth > 0:
+            # studying URIs : exploration stops if same URIs, or best alignment of the URIs that are different
+            objects_i0 = [o_ for o_ in top_triples_i0 if o_ not in intersection]
+            objects_i1 = [o_ for o_ in top_triples_i1 if o_ not in intersection]
+            if len(objects_i0) > 0 and len(objects_i1) > 0:
+                sub_similarities = np.zeros((len(objects_i0),len(objects_i1)))
+                for a,object_0 in enumerate(objects_i0):
+                    for b,object_1 in enumerate(objects_i1):
+                        if (min(object_0,object_1),max(object_0,object_1)) in path_: # cycle
+                            continue
+                        sub_similarities[a,b] = get_similarity_for_pair([object_0,object_1],model,X,dic_functionality,type_end,PATH_TYPE,cache=cache,max_depth=max_depth-1,memo=memo,path_=path_,catalog=catalog)
+                from scipy.optimize import linear_sum_assignment
+
+                rows,cols = linear_sum_assignment(sub_similarities,maximize=True)
+                objects_common += sub_similarities[rows,cols].sum()
 
+        similarity_property = objects_common/dic_functionality[p_]*relative_weight # score entre 0 et poids du chemin
+        similarity_entities += similarity_property
 
-def get_properties_to_assess(pair_,X):
+    path_.discard(key_[:2])
+    memo[key_] = float(similarity_entities)
+    return memo[key_]*previous_node_weight
+
+
+def get_properties_to_assess(pair_,X,catalog=None):
     """
-    Returns all properties for an instance of a pair.
+    Returns all properties for an instance of a pair (read from the catalog if given).
     
     TO UPDATE: 
         Current version: might not query all properties for an entity (only query the one it has in its description)
         Future version: define all properties in schema to get exhaustive properties to query 
     """
-    return list(np.unique([x[1] for x in X if x[0] == pair_[0]]))
+    if catalog is not None:
+        return list(catalog.get_properties(pair_[0]))
+    kg = get_knowledge_graph(X)
+    return list(np.unique(list(kg.description(pair_[0]))))
 
 
-def get_objects_of_property(property_,X):
+def get_objects_of_property(property_,X,cache=None,catalog=None):
     """
-    Returns possible objects for a property.
+    Returns possible objects for a property (read from the catalog if given).
     """
-    return list(np.unique([x[2] for x in X if x[1] == property_]))
+    if catalog is not None:
+        return catalog.get_objects(property_)
+    if cache is not None and property_ in cache.objects_of_property:
+        return cache.objects_of_property[property_]
+    kg = get_knowledge_graph(X)
+    objects_ = list(np.unique(kg.objects_of_predicate(property_)))
+    if cache is not None:
+        cache.objects_of_property[property_] = objects_
+    return objects_
 
 
-def get_n_objects_for_property_entity(entity_,property_,objects_,model,func_):
+def get_n_objects_for_property_entity(entity_,property_,objects_,model,func_,cache=None):
     """
     Obtain the list of the top ranked objects for an entity on the property p_ given the model.
+    With a PredictionCache, the result is memoized on (entity_,property_,func_) : objects_ must then be the possible objects of property_.
     """
-    triples_ent_ = generate_array_triples(entity_,property_,objects_)
-    scores_ = model.predict(triples_ent_)
-    df_ = create_df_values_scores(entity_,property_,objects_,scores_)
-    return list(df_['object'])[:func_]
+    if cache is not None:
+        top_objects = cache.get((entity_,property_,func_))
+        if top_objects is not None:
+            return top_objects
+    with stage('predict'):
+        scores_ = np.asarray(model.predict(generate_array_triples(entity_,property_,objects_)))
+    increment('predict_calls')
+    increment('triples_scored',len(objects_))
+    top_objects = [objects_[i] for i in get_top_n_indexes(scores_,func_)]
+    if cache is not None:
+        cache.put((entity_,property_,func_),top_objects)
+    return top_objects
 
 
-def generate_array_triples(entity_,property_,objects_):
+def get_n_objects_for_properties_entities(requests_,model,X,cache=None,catalog=None):
     """
-    Generates all possible triples in the appropriate format to assess their score afterwards.
+    Batched version of get_n_objects_for_property_entity.
+
+    The candidate triples of all the requests that are not in the cache are scored with a single call to model.predict,
+    and the top n objects of each request are selected with np.argpartition (no dataframe is built).
+
+    Parameters:
+        requests_ : list of (entity_,property_,func_)
+        model : ampligraph.model
+        X : numpy array (or KnowledgeGraph)
+        cache : PredictionCache (by default = None)
+        catalog : PropertyCatalog (by default = None)
+
+    Returns:
+        top_objects : list
+            List of the top ranked objects of each request, in the order of the requests
     """
-    return np.array([[entity_,property_,o] for o in objects_])
+    top_objects = [None]*len(requests_)
+    to_score = {}
+    for i,request_ in enumerate(requests_):
+        if cache is not None:
+            top_objects[i] = cache.get(tuple(request_))
+        if top_objects[i] is None:
+            to_score.setdefault(tuple(request_),[]).append(i)
+    if not to_score:
+        return top_objects
+
+    # one array with the triples of all requests
+    objects_per_request = [get_objects_of_property(property_,X,cache=cache,catalog=catalog) for _,property_,_ in to_score]
+    number_objects = [len(objects_) for objects_ in objects_per_request]
+    subjects_ = np.repeat([entity_ for entity_,_,_ in to_score],number_objects)
+    predicates_ = np.repeat([property_ for _,property_,_ in to_score],number_objects)
+    all_objects = np.concatenate([np.asarray(objects_,dtype=object) for objects_ in objects_per_request])
+    scores_ = np.array([])
+    if len(all_objects) > 0:
+        with stage('predict'):
+            scores_ = np.asarray(model.predict(np.column_stack([subjects_,predicates_,all_objects])))
+        increment('predict_calls')
+        increment('triples_scored',len(all_objects))
+
+    offsets = np.concatenate([[0],np.cumsum(number_objects)])
+    for j,(request_,indexes_) in enumerate(to_score.items()):
+        objects_ = objects_per_request[j]
+        result = [objects_[k] for k in get_top_n_indexes(scores_[offsets[j]:offsets[j+1]],request_[2])]
+        if cache is not None:
+            cache.put(request_,result)
+        for i in indexes_:
+            top_objects[i] = result
+    return top_objects
+
+
+def get_top_n_indexes(scores_,n):
+    """
+    Returns the indexes of the n highest scores, ranked by decreasing score.
+    """
+    if n < len(scores_):
+        top_ = np.argpartition(-scores_,n-1)[:n]
+    else:
+        top_ = np.arange(len(scores_))
+    return top_[np.argsort(-scores_[top_],kind='stable')]
 
 
-def create_df_values_scores(entity_,property_,objects_,scores_):
+def generate_array_triples(entity_,property_,objects_):
     """
-    Given the triples and the scores, returns the triples in a pandas.dataframe ranked on the score.
+    Generates all possible triples in the appropriate format to assess their score afterwards.
     """
-    df_ = pd.DataFrame()
-    for i in range(len(objects_)):
-        dic_add = {
-            'subject':entity_,
-            'predicate':property_,
-            'object':objects_[i],
-            'score':scores_[i]
-        }
-        df_ = df_.append(dic_add,ignore_index=True)
-    df_ = df_.sort_values(by=['score'],ascending=False)
-    return df_
+    return np.array([[entity_,property_,o] for o in objects_])
 
 
-def end_node(entity_,X,PATH_TYPE,type_end):
+def end_node(entity_,X,PATH_TYPE,type_end,catalog=None):
     """
     Returns True if the entity is an end node (literal or URI without further properties).
+    With a catalog, the end node bitmap of the catalog is read.
     """
-    if [x[2] for x in X if x[1] == PATH_TYPE][0] in type_end:
+    if catalog is not None:
+        return catalog.is_end_node(entity_)
+    kg = get_knowledge_graph(X)
+    if any(type_ in type_end for type_ in kg.objects(entity_,PATH_TYPE)):
         return True
-    elif len([x for x in X if x[0] == entity_]) > 0:
+    elif kg.has_subject(entity_):
         return False
     else:
         return True
@@ -199,24 +535,20 @@ def get_subset_points_for_threshold(measures,number_points=20,number_step=20):
         subset_points : list of 2-elements list
 
     """
-    # sorting the points on the intervals
-    updated_set_of_points = []
-    distances = [i[0] for i in measures]
-    step = (max(distances)-min(distances))/number_step
-    intervals = [[min(distances)+step*(i),min(distances)+step*(i+1)] for i in range(0,number_step)]
-    dic_intervals = {tuple(i):[]for i in intervals}
-    for point_ in measures:
-        p_distance = point_[0]
-        for interval_, list_points_interval in dic_intervals.items():
-            if p_distance >= interval_[0] and p_distance <= interval_[1]:
-                list_points_interval.append(point_)
+    # sorting the points on the intervals : each point belongs to one interval (the last one is closed)
+    distances = np.array([i[0] for i in measures],dtype=float)
+    edges = np.linspace(distances.min(),distances.max(),number_step+1)
+    intervals_points = np.digitize(distances,edges[1:-1])
+    order = np.argsort(intervals_points,kind='stable')
+    bounds = np.searchsorted(intervals_points[order],np.arange(number_step+1))
     
     # sampling the points per interval
     subset_points = []
-    for interval, set_points in dic_intervals.items():
+    for interval in range(number_step):
+        set_points = [measures[i] for i in order[bounds[interval]:bounds[interval+1]]]
         if len(set_points) <= number_points:
             subset_points += set_points
         else:
             subset_points += random.sample(set_points,number_points)
             
-    return subset_points
\ No newline at end of file
+    return subset_points
@@ -0,0 +1,136 @@
+"""This file contains modules to cache the embeddings of the entities and compute the distances of pairs in batch."""
+
+import numpy as np
+
+from distance_kernels import get_paired_distances
+from instrumentation import increment,stage,timed
+
+
+class EmbeddingCache:
+    """
+    Matrix entity -> embedding vector, materialized with one call to model.get_embeddings per batch of new entities.
+
+    The cache can be used in place of the model wherever only get_embeddings is called (distances, distance matrices),
+    and the other calls (e.g. predict) are forwarded to the model.
+
+    Parameters :
+    model : ampligraph EmbeddingModel
+    entities : list of entities (by default = None)
+        Entities to materialize at creation, e.g. all the instances of the target class and the synthetic instances
+    """
+
+    def __init__(self,model,entities=None):
+        self.model = model
+        self.index = {}
+        self.embeddings = None
+        self.size = 0
+        if entities is not None:
+            self.add_entities(entities)
+
+    def __getattr__(self,name):
+        if name == 'model': # not set yet (unpickling)
+            raise AttributeError(name)
+        return getattr(self.model,name)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self,entity_):
+        return entity_ in self.index
+
+    def add_entities(self,entities):
+        """Materializes the embeddings of the entities that are not in the cache (one call to the model)."""
+        new_entities = [e_ for e_ in dict.fromkeys(np.asarray(entities).tolist()) if e_ not in self.index]
+        if len(new_entities) == 0:
+            return
+        with stage('embeddings'):
+            new_embeddings = np.asarray(self.model.get_embeddings(entities=np.array(new_entities)))
+        increment('embeddings_materialized',len(new_entities))
+        if self.embeddings is None:
+            self.embeddings = np.empty((max(len(new_entities),1024),new_embeddings.shape[1]),dtype=new_embeddings.dtype)
+        elif self.size+len(new_entities) > len(self.embeddings): # doubling the capacity
+            capacity = max(2*len(self.embeddings),self.size+len(new_entities))
+            embeddings = np.empty((capacity,self.embeddings.shape[1]),dtype=self.embeddings.dtype)
+            embeddings[:self.size] = self.embeddings[:self.size]
+            self.embeddings = embeddings
+        self.embeddings[self.size:self.size+len(new_entities)] = new_embeddings
+        for e_ in new_entities:
+            self.index[e_] = self.size
+            self.size += 1
+
+    def get_indexes(self,entities):
+        """Returns the rows of the entities in the matrix of embeddings, materializing the missing ones."""
+        entities = np.asarray(entities).tolist()
+        self.add_entities(entities)
+        return np.array([self.index[e_] for e_ in entities],dtype=np.intp)
+
+    def get_embeddings(self,entities,embedding_type='entity'):
+        """Returns the embeddings of the entities (same call as model.get_embeddings)."""
+        if embedding_type != 'entity':
+            return self.model.get_embeddings(entities,embedding_type=embedding_type)
+        indexes = self.get_indexes(entities) # materializes the missing embeddings before self.embeddings is read
+        return self.embeddings[indexes]
+
+
+def get_embedding_cache(model,entities=None):
+    """
+    Returns model as an EmbeddingCache (an existing EmbeddingCache is returned as is), with the embeddings of the entities materialized.
+    """
+    if not isinstance(model,EmbeddingCache):
+        model = EmbeddingCache(model)
+    if entities is not None:
+        model.add_entities(entities)
+    return model
+
+
+@timed('pair_distances')
+def get_distances_for_pairs(pairs_,model,type_distance='euclidian'):
+    """
+    Returns the distances between the embedding vectors of the pairs, in a numpy array.
+
+    The embeddings of the entities of all pairs are obtained at once (from an EmbeddingCache if model is one, otherwise with
+    one call to model.get_embeddings), and the distances are computed in one vectorized step.
+
+    The type of the distance is a kernel of distance_kernels.DISTANCE_KERNELS : euclidian, cosine, normalized_euclidian, l1
+    """
+    pairs_ = np.asarray(pairs_).reshape(-1,2)
+    if len(pairs_) == 0:
+        return np.array([])
+    entities,indexes = np.unique(pairs_,return_inverse=True)
+    indexes = indexes.reshape(-1,2)
+    embeddings = np.asarray(model.get_embeddings(entities=entities),dtype=np.float64)
+    return get_paired_distances(embeddings[indexes[:,0]],embeddings[indexes[:,1]],type_distance)
+
+
+def get_distance_for_pair(pair_,model,type_distance='euclidian'):
+    """
+    Returns the distance between the embedding vectors of a pair.
+
+    The type of the distance is a kernel of distance_kernels.DISTANCE_KERNELS : euclidian, cosine, normalized_euclidian, l1
+    """
+    return float(get_distances_for_pairs([pair_],model,type_distance=type_distance)[0])
+
+
+def get_distance_per_degree(dic_truncated_pairs,model,type_distance='euclidian'):
+    """
+    Returns the dictionnary degree -> distances of the truncated pairs (dic_distance_per_degree),
+    with the distances of the pairs of all degrees computed in one batch.
+
+    Parameters :
+    dic_truncated_pairs : dictionnary tuple of the modified properties -> list of pairs [original instance, synthetic instance]
+    model : ampligraph EmbeddingModel (or EmbeddingCache)
+
+    Returns :
+    dic_distance_per_degree : dictionnary number of differences -> list of distances
+    """
+    keys_ = list(dic_truncated_pairs)
+    all_pairs = [pair_ for key_ in keys_ for pair_ in dic_truncated_pairs[key_]]
+    distances = get_distances_for_pairs(all_pairs,model,type_distance=type_distance)
+
+    dic_distance_per_degree = {i:[] for i in range(0,max([len(key_) for key_ in keys_],default=-1)+1)}
+    start = 0
+    for key_ in keys_:
+        number_pairs = len(dic_truncated_pairs[key_])
+        dic_distance_per_degree[len(key_)] += distances[start:start+number_pairs].tolist()
+        start += number_pairs
+    return dic_distance_per_degree
@@ -0,0 +1,161 @@
+"""This file contains modules to record the time spent in the stages of the mining pipeline and its counters."""
+
+import functools
+import json
+import threading
+import time
+
+
+# collectors receiving the measures, the innermost last (the measures are only recorded while a collector is active)
+ACTIVE_COLLECTORS = []
+
+
+class Collector:
+    """
+    Collector of the measures of the mining pipeline, used as a context manager :
+
+        with Collector() as collector:
+            df_rules = get_rules(...)
+        collector.save('profile.json')
+
+    While the collector is active, the instrumented functions record :
+    - timers : the number of calls and the total and maximum time (seconds) of each stage (e.g. distance_matrix, matching, predict)
+    - counters : e.g. predict_calls, triples_scored, pairs_matched, prediction_cache_hits, dropped_pairs
+    - maxima : e.g. matrix_cells, matrix_bytes (largest distance matrix)
+    The stages can be nested (e.g. predict inside get_measures_for_pairs), so their times overlap.
+    Nested collectors all receive the measures. The threads of the process are recorded, the worker processes are not
+    (only the time of their stages in the calling process is).
+    When no collector is active, the instrumented functions only test if ACTIVE_COLLECTORS is empty.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.maxima = {}
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.wall_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        ACTIVE_COLLECTORS.append(self)
+        return self
+
+    def __exit__(self,*args):
+        ACTIVE_COLLECTORS.remove(self)
+        self.wall_time = time.perf_counter()-self.start_time
+
+    def add_time(self,name,seconds):
+        with self.lock:
+            timer = self.timers.setdefault(name,{'calls':0,'total':0.,'max':0.})
+            timer['calls'] += 1
+            timer['total'] += seconds
+            timer['max'] = max(timer['max'],seconds)
+
+    def increment(self,name,value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name,0)+value
+
+    def update_max(self,name,value):
+        with self.lock:
+            self.maxima[name] = max(self.maxima.get(name,value),value)
+
+    def get_report(self):
+        """Returns the measures in a dictionnary (timers sorted by decreasing total time)."""
+        with self.lock:
+            return {
+                'wall_time':self.wall_time if self.wall_time is not None or self.start_time is None else time.perf_counter()-self.start_time,
+                'timers':{name:dict(timer) for name,timer in sorted(self.timers.items(),key=lambda item:-item[1]['total'])},
+                'counters':dict(self.counters),
+                'maxima':dict(self.maxima)
+            }
+
+    def to_json(self,indent=2):
+        """Returns the report in JSON."""
+        return json.dumps(self.get_report(),indent=indent)
+
+    def save(self,path):
+        """Saves the report in a JSON file."""
+        with open(path,'w') as f:
+            f.write(self.to_json())
+
+
+class Stage:
+    """Context manager adding its duration to the timer name of the active collectors."""
+
+    __slots__ = ('name','start')
+
+    def __init__(self,name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*args):
+        seconds = time.perf_counter()-self.start
+        for collector in ACTIVE_COLLECTORS:
+            collector.add_time(self.name,seconds)
+
+
+class NullStage:
+    """Context manager doing nothing, returned by stage when no collector is active."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+def stage(name):
+    """
+    Returns a context manager timing a stage of the pipeline :
+
+        with stage('distance_matrix'):
+            ...
+    """
+    if not ACTIVE_COLLECTORS:
+        return NULL_STAGE
+    return Stage(name)
+
+
+def timed(name):
+    """
+    Decorator timing all the calls of a function as the stage name (the function is called directly when no collector is active).
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            if not ACTIVE_COLLECTORS:
+                return function(*args,**kwargs)
+            with Stage(name):
+                return function(*args,**kwargs)
+        return wrapper
+    return decorator
+
+
+def increment(name,value=1):
+    """Adds value to the counter name of the active collectors."""
+    if not ACTIVE_COLLECTORS:
+        return
+    for collector in ACTIVE_COLLECTORS:
+        collector.increment(name,value)
+
+
+def update_max(name,value):
+    """Updates the maximum name of the active collectors with value."""
+    if not ACTIVE_COLLECTORS:
+        return
+    for collector in ACTIVE_COLLECTORS:
+        collector.update_max(name,value)
+
+
+def is_collecting():
+    """Returns True if a collector is active (to skip the computation of costly measures otherwise)."""
+    return len(ACTIVE_COLLECTORS) > 0
@@ -0,0 +1,365 @@
+"""This file contains modules to load a knowledge graph from a CSV or N-Triples file into integer triples, with a binary cache on disk."""
+
+import csv
+import gc
+import gzip
+import itertools
+import json
+import os
+import re
+
+import numpy as np
+
+from instrumentation import increment,stage
+
+
+# version of the files written by EncodedKG.save (a cache of another version is rebuilt)
+CACHE_VERSION = 1
+
+# term of a N-Triples line : <uri> | _:blank_node | "literal"(@lang | ^^<datatype>)
+NT_TERM = r'(?:<([^>]*)>|_:(\S+)|"((?:[^"\\]|\\.)*)"(?:@[A-Za-z0-9-]+|\^\^<[^>]*>)?)'
+NT_LINE = re.compile(r'^\s*'+NT_TERM+r'\s+'+NT_TERM+r'\s+'+NT_TERM+r'\s*\.\s*$')
+NT_ESCAPE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+NT_ESCAPED_CHARACTERS = {'t':'\t','b':'\b','n':'\n','r':'\r','f':'\f','"':'"',"'":"'",'\\':'\\'}
+
+
+class EncodedKG:
+    """
+    Knowledge graph stored as integer triples : each subject, predicate and object is replaced by its index in a vocabulary
+    shared by the three columns (an entity has the same id as subject and as object).
+
+    The vocabulary is stored as the UTF-8 bytes of the strings concatenated (vocabulary_bytes) and the offsets of the strings
+    (string i = vocabulary_bytes[offsets[i]:offsets[i+1]]), so that the three arrays can be memory-mapped from disk.
+    The strings are only decoded when they are needed (get_vocabulary), each distinct string once : the decoded triples
+    share the same string objects.
+    An EncodedKG can be used wherever X is expected (numpy array of triples with the URIs) : np.asarray, iteration, len and
+    indexing return the decoded triples.
+
+    Parameters :
+    triples : numpy array of int32 of shape (n,3)
+    vocabulary_bytes : numpy array of uint8
+    offsets : numpy array of int64 of shape (size of the vocabulary+1,)
+    """
+
+    def __init__(self,triples,vocabulary_bytes,offsets):
+        self.triples = triples
+        self.vocabulary_bytes = vocabulary_bytes
+        self.offsets = offsets
+        self.vocabulary = None
+        self.ids = None
+        self.decoded_triples = None
+
+    def __len__(self):
+        return len(self.triples)
+
+    def __iter__(self):
+        return iter(self.X)
+
+    def __getitem__(self,key):
+        return self.X[key]
+
+    def __array__(self,dtype=None,copy=None):
+        if dtype is None:
+            return self.X
+        return self.X.astype(dtype)
+
+    @property
+    def vocabulary_size(self):
+        return len(self.offsets)-1
+
+    @property
+    def X(self):
+        """Numpy array of the triples with the strings (object array of shape (n,3)), decoded on first use and kept."""
+        if self.decoded_triples is None:
+            self.decoded_triples = self.get_vocabulary()[self.triples]
+        return self.decoded_triples
+
+    def get_vocabulary(self):
+        """Returns the object array of the strings of the vocabulary (decoded on first use and kept)."""
+        if self.vocabulary is None:
+            with stage('kg_vocabulary'):
+                bytes_ = self.vocabulary_bytes.tobytes()
+                offsets_ = self.offsets.tolist()
+                vocabulary = np.empty(self.vocabulary_size,dtype=object)
+                vocabulary[:] = [bytes_[start_:end_].decode('utf-8') for start_,end_ in zip(offsets_[:-1],offsets_[1:])]
+                self.vocabulary = vocabulary
+        return self.vocabulary
+
+    def get_string(self,id_):
+        """Returns the string of an id, without decoding the vocabulary."""
+        if self.vocabulary is not None:
+            return self.vocabulary[id_]
+        return self.vocabulary_bytes[self.offsets[id_]:self.offsets[id_+1]].tobytes().decode('utf-8')
+
+    def decode(self,ids):
+        """
+        Returns the strings of ids (int or numpy array of ids of any shape).
+        A few ids are decoded one by one, more ids decode the whole vocabulary once.
+        """
+        if np.ndim(ids) == 0:
+            return self.get_string(int(ids))
+        ids = np.asarray(ids)
+        if self.vocabulary is None and ids.size < 1024:
+            decoded = np.empty(ids.shape,dtype=object)
+            decoded.ravel()[:] = [self.get_string(id_) for id_ in ids.ravel().tolist()]
+            return decoded
+        return self.get_vocabulary()[ids]
+
+    def encode(self,strings):
+        """
+        Returns the ids of strings (str or list of str).
+        Raises a ValueError if a string is not in the vocabulary.
+        """
+        if self.ids is None:
+            self.ids = {string_:id_ for id_,string_ in enumerate(self.get_vocabulary().tolist())}
+        if isinstance(strings,str):
+            return self.encode([strings])[0]
+        unknown = [string_ for string_ in strings if string_ not in self.ids]
+        if len(unknown) > 0:
+            raise ValueError('Unknown string(s) : '+', '.join(unknown[:10]))
+        return np.array([self.ids[string_] for string_ in strings],dtype=np.int32)
+
+    def get_entities(self):
+        """Returns the (unique) subjects and objects of the triples, in the order of the vocabulary."""
+        return self.decode(np.unique(self.triples[:,[0,2]]))
+
+    def get_relations(self):
+        """Returns the (unique) predicates of the triples, in the order of the vocabulary."""
+        return self.decode(np.unique(self.triples[:,1]))
+
+    def save(self,path,metadata=None):
+        """
+        Saves the triples and the vocabulary in the directory path (triples.npy, vocabulary.npy, offsets.npy, metadata.json).
+        metadata.json is written last, so that an interrupted save is not taken for a valid cache.
+        """
+        os.makedirs(path,exist_ok=True)
+        if os.path.exists(os.path.join(path,'metadata.json')):
+            os.remove(os.path.join(path,'metadata.json'))
+        np.save(os.path.join(path,'triples.npy'),np.asarray(self.triples,dtype=np.int32))
+        np.save(os.path.join(path,'vocabulary.npy'),np.asarray(self.vocabulary_bytes,dtype=np.uint8))
+        np.save(os.path.join(path,'offsets.npy'),np.asarray(self.offsets,dtype=np.int64))
+        metadata = dict(metadata or {},version=CACHE_VERSION,number_triples=len(self),vocabulary_size=self.vocabulary_size)
+        with open(os.path.join(path,'metadata.json'),'w') as f:
+            json.dump(metadata,f,indent=2)
+
+
+def get_encoded_kg(X):
+    """Returns the EncodedKG of a numpy array of triples X (or of any iterable of triples)."""
+    if isinstance(X,EncodedKG):
+        return X
+    if isinstance(X,np.ndarray):
+        X = X.tolist()
+    return encode_chunks([X])
+
+
+def encode_chunks(chunks):
+    """
+    Returns the EncodedKG of the chunks of triples (lists of triples of strings), the strings are interned chunk by chunk.
+    """
+    ids = {}
+    encoded_chunks = []
+    for chunk_ in chunks:
+        if len(chunk_) == 0:
+            continue
+        strings = list(itertools.chain.from_iterable(chunk_))
+        # new strings of the chunk, in the order of their first occurrence
+        ids.update(zip(itertools.filterfalse(ids.__contains__,dict.fromkeys(strings)),itertools.count(len(ids))))
+        if len(ids) > np.iinfo(np.int32).max:
+            raise ValueError('The vocabulary has too many strings for int32 ids : '+str(len(ids)))
+        encoded_chunks.append(np.fromiter(map(ids.__getitem__,strings),dtype=np.int32,count=len(strings)).reshape(-1,3))
+        increment('triples_loaded',len(chunk_))
+    triples = np.concatenate(encoded_chunks) if len(encoded_chunks) > 0 else np.empty((0,3),dtype=np.int32)
+    encoded_strings = [string_.encode('utf-8') for string_ in ids]
+    offsets = np.zeros(len(encoded_strings)+1,dtype=np.int64)
+    np.cumsum([len(bytes_) for bytes_ in encoded_strings],out=offsets[1:])
+    vocabulary_bytes = np.frombuffer(b''.join(encoded_strings),dtype=np.uint8)
+    encoded_kg = EncodedKG(triples,vocabulary_bytes,offsets)
+    # the strings are already in memory : they are kept as the decoded vocabulary
+    encoded_kg.vocabulary = np.empty(len(ids),dtype=object)
+    encoded_kg.vocabulary[:] = list(ids)
+    encoded_kg.ids = ids
+    return encoded_kg
+
+
+def open_text(path):
+    """Opens a text file (UTF-8), compressed with gzip if its name ends with .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path,'rt',encoding='utf-8',newline='')
+    return open(path,'r',encoding='utf-8',newline='')
+
+
+def get_format(path):
+    """Returns the format of a file from its extension : 'nt' (.nt, .nt.gz) or 'csv' (any other extension)."""
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'nt' if name.endswith('.nt') else 'csv'
+
+
+def read_csv_chunks(path,sep=',',chunk_size=100000):
+    """
+    Yields the triples of a CSV file without header (subject, predicate, object), by chunks of chunk_size triples.
+    The empty lines are skipped. Raises a ValueError if a line does not have 3 fields.
+    """
+    with open_text(path) as f:
+        reader = csv.reader(f,delimiter=sep)
+        while True:
+            chunk_ = list(itertools.islice(reader,chunk_size))
+            if len(chunk_) == 0:
+                return
+            if sum(map(len,chunk_)) != 3*len(chunk_):
+                chunk_ = [row_ for row_ in chunk_ if len(row_) > 0]
+                for row_ in chunk_:
+                    if len(row_) != 3:
+                        raise ValueError('A line of {} has {} fields instead of 3 : {}'.format(path,len(row_),sep.join(row_)))
+            yield chunk_
+
+
+def unescape_literal(literal_):
+    """Returns the value of a N-Triples literal (escape sequences \\t, \\n, \\", \\uXXXX ... replaced)."""
+    if '\\' not in literal_:
+        return literal_
+    def replace(match_):
+        if match_.group(3) is not None:
+            return NT_ESCAPED_CHARACTERS.get(match_.group(3),match_.group(0))
+        return chr(int(match_.group(1) or match_.group(2),16))
+    return NT_ESCAPE.sub(replace,literal_)
+
+
+def parse_nt_term(uri_,blank_node_,literal_):
+    """Returns the string of a N-Triples term : the URI, the label of the blank node or the value of the literal."""
+    if uri_ is not None:
+        return uri_
+    if blank_node_ is not None:
+        return blank_node_
+    return unescape_literal(literal_)
+
+
+def read_nt_chunks(path,chunk_size=100000):
+    """
+    Yields the triples of a N-Triples file, by chunks of chunk_size triples.
+    The URIs are given without <>, the blank nodes without _: and the literals by their value (without datatype or language),
+    as in datasets/dbpedia_extract.csv. The empty lines and the comments are skipped.
+    Raises a ValueError if a line is not a triple.
+    """
+    with open_text(path) as f:
+        chunk_ = []
+        for line_number,line_ in enumerate(f,1):
+            match_ = NT_LINE.match(line_)
+            if match_ is None:
+                if line_.strip() == '' or line_.lstrip().startswith('#'):
+                    continue
+                raise ValueError('Line {} of {} is not a N-Triples triple : {}'.format(line_number,path,line_.strip()))
+            groups = match_.groups()
+            chunk_.append((parse_nt_term(*groups[0:3]),parse_nt_term(*groups[3:6]),parse_nt_term(*groups[6:9])))
+            if len(chunk_) == chunk_size:
+                yield chunk_
+                chunk_ = []
+        if len(chunk_) > 0:
+            yield chunk_
+
+
+def drop_duplicate_triples(encoded_kg):
+    """Returns the EncodedKG without its duplicate triples (the first occurrence of each triple is kept, in order)."""
+    if len(encoded_kg) == 0:
+        return encoded_kg
+    _,first_indexes = np.unique(encoded_kg.triples,axis=0,return_index=True)
+    if len(first_indexes) == len(encoded_kg):
+        return encoded_kg
+    deduplicated = EncodedKG(encoded_kg.triples[np.sort(first_indexes)],encoded_kg.vocabulary_bytes,encoded_kg.offsets)
+    deduplicated.vocabulary,deduplicated.ids = encoded_kg.vocabulary,encoded_kg.ids
+    return deduplicated
+
+
+def load_encoded_kg(path,mmap_mode='r'):
+    """
+    Loads an EncodedKG saved with EncodedKG.save.
+
+    Parameters :
+    path : str
+        Directory of the .npy files
+    mmap_mode : str (by default = 'r')
+        'r' to memory-map the arrays instead of loading them in memory (None to load them)
+    """
+    return EncodedKG(
+        np.load(os.path.join(path,'triples.npy'),mmap_mode=mmap_mode),
+        np.load(os.path.join(path,'vocabulary.npy'),mmap_mode=mmap_mode),
+        np.load(os.path.join(path,'offsets.npy'),mmap_mode=mmap_mode)
+    )
+
+
+def get_cache_metadata(path,format_,sep,drop_duplicates):
+    """Returns the description of the source file and of the loading options, stored with the cache to check that it is up to date."""
+    status = os.stat(path)
+    return {
+        'source':os.path.abspath(path),
+        'source_size':status.st_size,
+        'source_mtime_ns':status.st_mtime_ns,
+        'format':format_,
+        'sep':sep if format_ == 'csv' else None,
+        'drop_duplicates':drop_duplicates
+    }
+
+
+def is_valid_cache(cache_path,metadata):
+    """Returns True if cache_path holds a complete cache of the same version built from the same source file with the same options."""
+    try:
+        with open(os.path.join(cache_path,'metadata.json')) as f:
+            cached_metadata = json.load(f)
+    except (OSError,ValueError):
+        return False
+    if cached_metadata.get('version') != CACHE_VERSION:
+        return False
+    return all(cached_metadata.get(key_) == value_ for key_,value_ in metadata.items() if key_ != 'source')
+
+
+def load_kg(path,cache_path=None,format=None,sep=',',chunk_size=100000,drop_duplicates=False,mmap_mode='r'):
+    """
+    Loads the triples of a CSV or N-Triples file as an EncodedKG, streaming the file by chunks.
+
+    If cache_path is given, the EncodedKG is saved there after the first load, and the next loads memory-map it
+    instead of parsing the file again (the cache is rebuilt when the file, its format or the options change).
+    The EncodedKG can be given to the functions expecting X, and get_knowledge_graph(encoded_kg) builds the
+    KnowledgeGraph (the decoded triples share one string object per distinct URI).
+
+    Parameters :
+    path : str
+        CSV file without header (subject, predicate, object) or N-Triples file, can be compressed with gzip (.gz)
+    cache_path : str (by default = None, no cache)
+        Directory of the cache
+    format : str (by default = None, from the extension of path : 'nt' for .nt, else 'csv')
+        'csv' or 'nt'
+    sep : str (by default = ',')
+        Separator of the CSV file
+    chunk_size : int (by default = 100000)
+        Number of triples parsed at once
+    drop_duplicates : bool (by default = False)
+        Drops the duplicate triples (as ampligraph.datasets.load_from_csv)
+    mmap_mode : str (by default = 'r')
+        mmap_mode of the arrays of the cache (None to load them in memory)
+
+    Returns :
+    encoded_kg : EncodedKG
+    """
+    format_ = get_format(path) if format is None else format
+    if format_ not in ['csv','nt']:
+        raise ValueError('This format does not exist, please switch to csv or nt.')
+    metadata = None
+    if cache_path is not None:
+        metadata = get_cache_metadata(path,format_,sep,drop_duplicates)
+        if is_valid_cache(cache_path,metadata):
+            with stage('load_kg_cache'):
+                return load_encoded_kg(cache_path,mmap_mode=mmap_mode)
+    with stage('load_kg'):
+        chunks = read_csv_chunks(path,sep=sep,chunk_size=chunk_size) if format_ == 'csv' else read_nt_chunks(path,chunk_size=chunk_size)
+        # the rows parsed are millions of small lists without cycles : the garbage collector is paused while they are encoded
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            encoded_kg = encode_chunks(chunks)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if drop_duplicates:
+            encoded_kg = drop_duplicate_triples(encoded_kg)
+    if cache_path is not None:
+        encoded_kg.save(cache_path,metadata=metadata)
+    return encoded_kg
@@ -0,0 +1,115 @@
+"""This file contains modules to index the triples of a knowledge graph."""
+
+import numpy as np
+
+from instrumentation import stage
+
+
+class KnowledgeGraph:
+    """
+    In-memory triple store built once from the numpy array of triples X.
+
+    Three hash indexes are built so that the lookups made by the mining functions do not scan X :
+    - spo : subject -> predicate -> objects
+    - pos : predicate -> object -> subjects
+    - osp : object -> subject -> predicates
+    The values are stored in the order of the triples in X.
+    A KnowledgeGraph can be used wherever X is expected (iteration, len, indexing on the triples).
+
+    Parameters :
+    X : numpy array of triples (or KnowledgeGraph)
+    """
+
+    def __init__(self,X):
+        if isinstance(X,KnowledgeGraph):
+            X = X.X
+        self.X = np.asarray(X)
+        self.spo = {}
+        self.pos = {}
+        self.osp = {}
+        self.ps = {}
+        self.pos_sets = {}
+        for s_,p_,o_ in self.X.tolist():
+            self.spo.setdefault(s_,{}).setdefault(p_,[]).append(o_)
+            self.pos.setdefault(p_,{}).setdefault(o_,[]).append(s_)
+            self.osp.setdefault(o_,{}).setdefault(s_,[]).append(p_)
+            self.ps.setdefault(p_,{})[s_] = None
+
+    def __len__(self):
+        return len(self.X)
+
+    def __iter__(self):
+        return iter(self.X)
+
+    def __getitem__(self,key):
+        return self.X[key]
+
+    def objects(self,subject_,predicate_):
+        """Returns the objects of the triples (subject_, predicate_, ?)."""
+        return self.spo.get(subject_,{}).get(predicate_,[])
+
+    def description(self,subject_):
+        """Returns the dictionnary predicate -> objects of the triples where subject_ is the subject."""
+        return self.spo.get(subject_,{})
+
+    def subjects(self,predicate_,object_=None):
+        """
+        Returns the subjects of the triples (?, predicate_, object_).
+        If object_ is None, returns all (unique) subjects having the predicate.
+        """
+        if object_ is None:
+            return list(self.ps.get(predicate_,{}))
+        return self.pos.get(predicate_,{}).get(object_,[])
+
+    def subjects_set(self,predicate_,object_):
+        """
+        Returns the set of the subjects of the triples (?, predicate_, object_) (inverted index (predicate, object) -> subjects).
+        The sets are built on first use and kept.
+        """
+        key_ = (predicate_,object_)
+        if key_ not in self.pos_sets:
+            self.pos_sets[key_] = frozenset(self.subjects(predicate_,object_))
+        return self.pos_sets[key_]
+
+    def objects_of_predicate(self,predicate_):
+        """Returns all (unique) objects of the predicate."""
+        return list(self.pos.get(predicate_,{}))
+
+    def reverse_edges(self,object_,predicate_=None):
+        """
+        Returns the subjects pointing to object_ (through predicate_ if given).
+        If predicate_ is None, returns a dictionnary subject -> predicates.
+        """
+        if predicate_ is None:
+            return self.osp.get(object_,{})
+        return self.subjects(predicate_,object_)
+
+    def has_subject(self,entity_):
+        """Returns True if the entity is the subject of at least one triple."""
+        return entity_ in self.spo
+
+
+# last KnowledgeGraph built by get_knowledge_graph, with the X it was built from
+LAST_KNOWLEDGE_GRAPH = {'X':None,'length':None,'kg':None}
+
+
+def get_knowledge_graph(X):
+    """
+    Returns X as a KnowledgeGraph.
+    The indexes are only built if X is a numpy array of triples, an existing KnowledgeGraph is returned as is.
+    The last KnowledgeGraph built is kept : the helpers called on the same X (e.g. once per instance) build the indexes once.
+    X should not be modified in place between the calls, or the KnowledgeGraph should be built again with KnowledgeGraph(X).
+    """
+    if isinstance(X,KnowledgeGraph):
+        return X
+    if LAST_KNOWLEDGE_GRAPH['X'] is X and LAST_KNOWLEDGE_GRAPH['length'] == len(X):
+        return LAST_KNOWLEDGE_GRAPH['kg']
+    with stage('knowledge_graph'):
+        kg = KnowledgeGraph(X)
+    LAST_KNOWLEDGE_GRAPH.update(X=X,length=len(X),kg=kg)
+    return kg
+
+
+def clear_knowledge_graph_cache():
+    """Releases the last KnowledgeGraph built by get_knowledge_graph."""
+    LAST_KNOWLEDGE_GRAPH.update(X=None,length=None,kg=None)
@@ -0,0 +1,272 @@
+"""This file contains modules to use knowledge graph embeddings stored as numpy arrays in place of an ampligraph model."""
+
+import json
+import os
+
+import numpy as np
+
+from distance_kernels import fill_distances
+
+
+def get_transe_scores(embeddings_s,embeddings_p,embeddings_o,norm=1):
+    """Returns the TransE scores of the triples : -||s + p - o||."""
+    return -np.linalg.norm(embeddings_s+embeddings_p-embeddings_o,ord=norm,axis=1)
+
+
+def get_distmult_scores(embeddings_s,embeddings_p,embeddings_o,norm=1):
+    """Returns the DistMult scores of the triples : sum(s * p * o)."""
+    return np.einsum('ij,ij,ij->i',embeddings_s,embeddings_p,embeddings_o)
+
+
+def get_complex_scores(embeddings_s,embeddings_p,embeddings_o,norm=1):
+    """
+    Returns the ComplEx scores of the triples : Re(sum(s * p * conj(o))).
+    As in ampligraph, an embedding is the concatenation of the real part and the imaginary part.
+    """
+    k = embeddings_s.shape[1]//2
+    s_re,s_im = embeddings_s[:,:k],embeddings_s[:,k:]
+    p_re,p_im = embeddings_p[:,:k],embeddings_p[:,k:]
+    o_re,o_im = embeddings_o[:,:k],embeddings_o[:,k:]
+    return np.einsum('ij,ij->i',p_re,s_re*o_re+s_im*o_im)+np.einsum('ij,ij->i',p_im,s_re*o_im-s_im*o_re)
+
+
+def get_hole_scores(embeddings_s,embeddings_p,embeddings_o,norm=1):
+    """
+    Returns the HolE scores of the triples, computed as ampligraph with the ComplEx equivalence : 2/k ComplEx,
+    k being the size of the complex embeddings (half of the width of the concatenated real and imaginary parts).
+    """
+    k = embeddings_s.shape[1]//2
+    return (2/k)*get_complex_scores(embeddings_s,embeddings_p,embeddings_o)
+
+
+# name of the ampligraph model -> scoring function (embeddings_s,embeddings_p,embeddings_o,norm)
+SCORING_FUNCTIONS = {
+    'TransE':get_transe_scores,
+    'DistMult':get_distmult_scores,
+    'ComplEx':get_complex_scores,
+    'HolE':get_hole_scores,
+}
+
+
+class NumpyEmbeddingModel:
+    """
+    Knowledge graph embedding model backed by numpy matrices of embeddings and a scoring function.
+
+    It has the calls of an ampligraph EmbeddingModel used by the similarity search and the rule mining
+    (get_embeddings, predict, ent_to_idx, rel_to_idx) and find_nearest_neighbours,
+    without TensorFlow : it can serve embeddings trained elsewhere (see get_numpy_model and load_numpy_model).
+    The model is read-only and can be shared by threads and processes.
+
+    Parameters :
+    entities : list of entities, in the order of the rows of entity_embeddings
+    relations : list of relations, in the order of the rows of relation_embeddings
+    entity_embeddings : numpy array (number of entities, k)
+    relation_embeddings : numpy array (number of relations, k)
+    scoring_type : str (by default = 'TransE')
+        Scoring function of SCORING_FUNCTIONS
+    norm : int (by default = 1)
+        Norm of the TransE scoring function
+    batch_size : int (by default = 100000)
+        Number of triples scored at once by predict
+    """
+
+    def __init__(self,entities,relations,entity_embeddings,relation_embeddings,scoring_type='TransE',norm=1,batch_size=100000):
+        if scoring_type not in SCORING_FUNCTIONS:
+            raise ValueError("This scoring type does not exist, please switch to "+", ".join(SCORING_FUNCTIONS)+".")
+        if len(entities) != len(entity_embeddings) or len(relations) != len(relation_embeddings):
+            raise ValueError("The number of labels and the number of embeddings are different.")
+        self.ent_to_idx = {e_:i for i,e_ in enumerate(np.asarray(entities).tolist())}
+        self.rel_to_idx = {r_:i for i,r_ in enumerate(np.asarray(relations).tolist())}
+        self.entity_embeddings = entity_embeddings
+        self.relation_embeddings = relation_embeddings
+        self.scoring_type = scoring_type
+        self.norm = norm
+        self.batch_size = batch_size
+        self.is_fitted = True
+
+    @property
+    def k(self):
+        return self.entity_embeddings.shape[1]
+
+    def get_indexes(self,labels,embedding_type='entity'):
+        """Returns the rows of the labels in the matrix of embeddings of embedding_type ('entity' or 'relation')."""
+        if embedding_type not in ['entity','relation']:
+            raise ValueError("This embedding type does not exist, please switch to entity or relation.")
+        label_to_idx = self.ent_to_idx if embedding_type == 'entity' else self.rel_to_idx
+        labels = np.asarray(labels).reshape(-1).tolist()
+        indexes = [label_to_idx.get(label_,-1) for label_ in labels]
+        indexes = np.array(indexes,dtype=np.intp)
+        if np.any(indexes < 0):
+            unknown_ = [labels[i] for i in np.flatnonzero(indexes < 0)[:5]]
+            raise ValueError("Unknown "+embedding_type+"(s) : "+", ".join(map(str,unknown_)))
+        return indexes
+
+    def get_embeddings(self,entities,embedding_type='entity'):
+        """Returns the embeddings of the entities (or relations with embedding_type='relation'), as model.get_embeddings."""
+        embeddings = self.entity_embeddings if embedding_type == 'entity' else self.relation_embeddings
+        return np.asarray(embeddings[self.get_indexes(entities,embedding_type)])
+
+    def predict(self,X,from_idx=False):
+        """
+        Returns the scores of the triples of X (numpy array (n,3)), as model.predict.
+        The triples are scored per batch of batch_size triples, with vectorized numpy operations.
+
+        Parameters :
+        X : numpy array of triples
+        from_idx : bool (by default = False)
+            True if X contains the indexes of the entities and relations instead of the labels
+        """
+        X = np.asarray(X).reshape(-1,3)
+        scoring_function = SCORING_FUNCTIONS[self.scoring_type]
+        scores_ = np.empty(len(X),dtype=np.float64)
+        for start in range(0,len(X),self.batch_size):
+            batch = X[start:start+self.batch_size]
+            if from_idx:
+                idx_s,idx_p,idx_o = (batch[:,i].astype(np.intp) for i in range(3))
+            else:
+                idx_s = self.get_indexes(batch[:,0])
+                idx_p = self.get_indexes(batch[:,1],embedding_type='relation')
+                idx_o = self.get_indexes(batch[:,2])
+            scores_[start:start+len(batch)] = scoring_function(
+                np.asarray(self.entity_embeddings[idx_s],dtype=np.float64),
+                np.asarray(self.relation_embeddings[idx_p],dtype=np.float64),
+                np.asarray(self.entity_embeddings[idx_o],dtype=np.float64),
+                self.norm
+            )
+        return scores_
+
+    def find_nearest_neighbours(self,entities,n_neighbors=10,entities_subset=None,type_distance='euclidian',block_size=1024):
+        """
+        Returns the nearest neighbours of the entities in the embedding space, as ampligraph.discovery.find_nearest_neighbours
+        (an entity is its own nearest neighbour when it is in the candidates).
+
+        Parameters :
+        entities : list of entities
+        n_neighbors : int (by default = 10)
+        entities_subset : list of entities (by default = None, all the entities)
+            Candidate neighbours
+        type_distance : str (by default = 'euclidian')
+            Distance kernel (see distance_kernels.DISTANCE_KERNELS)
+        block_size : int (by default = 1024)
+            Number of entities whose distances to the candidates are computed at once
+
+        Returns :
+        neighbors : numpy array (number of entities, n_neighbors) of entities
+        distances : numpy array (number of entities, n_neighbors)
+        """
+        if entities_subset is None:
+            candidates = np.array(list(self.ent_to_idx),dtype=object)
+            embeddings_candidates = self.entity_embeddings
+        else:
+            candidates = np.asarray(entities_subset,dtype=object).reshape(-1)
+            embeddings_candidates = self.get_embeddings(candidates)
+        return get_nearest_neighbours(self.get_embeddings(entities),embeddings_candidates,candidates,n_neighbors,type_distance,block_size)
+
+    def save(self,path):
+        """
+        Saves the model in the directory path : entities.npy, relations.npy, entity_embeddings.npy, relation_embeddings.npy
+        and parameters.json (scoring type and norm).
+        """
+        os.makedirs(path,exist_ok=True)
+        np.save(os.path.join(path,'entities.npy'),np.array(list(self.ent_to_idx),dtype=str))
+        np.save(os.path.join(path,'relations.npy'),np.array(list(self.rel_to_idx),dtype=str))
+        np.save(os.path.join(path,'entity_embeddings.npy'),np.asarray(self.entity_embeddings))
+        np.save(os.path.join(path,'relation_embeddings.npy'),np.asarray(self.relation_embeddings))
+        with open(os.path.join(path,'parameters.json'),'w') as f:
+            json.dump({'scoring_type':self.scoring_type,'norm':self.norm},f)
+
+
+def load_numpy_model(path,scoring_type=None,norm=None,mmap_mode=None):
+    """
+    Loads a NumpyEmbeddingModel saved with NumpyEmbeddingModel.save (or the same .npy files written by another tool).
+
+    Parameters :
+    path : str
+        Directory of the .npy files
+    scoring_type : str (by default = None, the scoring type of parameters.json, else 'TransE')
+    norm : int (by default = None, the norm of parameters.json, else 1)
+    mmap_mode : str (by default = None)
+        'r' to memory-map the matrices of embeddings instead of loading them in memory
+    """
+    parameters_ = {}
+    if os.path.exists(os.path.join(path,'parameters.json')):
+        with open(os.path.join(path,'parameters.json')) as f:
+            parameters_ = json.load(f)
+    if scoring_type is None:
+        scoring_type = parameters_.get('scoring_type','TransE')
+    if norm is None:
+        norm = parameters_.get('norm',1)
+    return NumpyEmbeddingModel(
+        np.load(os.path.join(path,'entities.npy')),
+        np.load(os.path.join(path,'relations.npy')),
+        np.load(os.path.join(path,'entity_embeddings.npy'),mmap_mode=mmap_mode),
+        np.load(os.path.join(path,'relation_embeddings.npy'),mmap_mode=mmap_mode),
+        scoring_type=scoring_type,
+        norm=norm
+    )
+
+
+def get_numpy_model(model,path=None):
+    """
+    Returns the NumpyEmbeddingModel of a fitted ampligraph model (TransE, DistMult, ComplEx or HolE), saved to path if given.
+    An existing NumpyEmbeddingModel is returned as is.
+    """
+    if not isinstance(model,NumpyEmbeddingModel):
+        scoring_type = type(model).__name__
+        if scoring_type not in SCORING_FUNCTIONS:
+            raise ValueError("This model is not supported, please switch to "+", ".join(SCORING_FUNCTIONS)+".")
+        entities = sorted(model.ent_to_idx,key=model.ent_to_idx.get)
+        relations = sorted(model.rel_to_idx,key=model.rel_to_idx.get)
+        model = NumpyEmbeddingModel(
+            entities,
+            relations,
+            np.asarray(model.get_embeddings(np.array(entities),embedding_type='entity')),
+            np.asarray(model.get_embeddings(np.array(relations),embedding_type='relation')),
+            scoring_type=scoring_type,
+            norm=getattr(model,'embedding_model_params',{}).get('norm',1)
+        )
+    if path is not None:
+        model.save(path)
+    return model
+
+
+def get_nearest_neighbours(embeddings_entities,embeddings_candidates,candidates,n_neighbors=10,type_distance='euclidian',block_size=1024):
+    """
+    Returns the n_neighbors nearest candidates of each embedding of embeddings_entities (neighbors, distances).
+    The distances are computed per block of entities with the distance kernel, and only the n_neighbors smallest are sorted.
+    """
+    embeddings_entities = np.asarray(embeddings_entities,dtype=np.float32)
+    embeddings_candidates = np.asarray(embeddings_candidates,dtype=np.float32)
+    n_neighbors = min(n_neighbors,len(candidates))
+    neighbors = np.empty((len(embeddings_entities),n_neighbors),dtype=object)
+    distances = np.empty((len(embeddings_entities),n_neighbors),dtype=np.float32)
+    distance_block = np.empty((min(block_size,len(embeddings_entities)),len(candidates)),dtype=np.float32)
+    for start in range(0,len(embeddings_entities),block_size):
+        out = distance_block[:len(embeddings_entities[start:start+block_size])]
+        fill_distances(embeddings_entities[start:start+block_size],embeddings_candidates,out,type_distance)
+        if n_neighbors < len(candidates):
+            nearest = np.argpartition(out,n_neighbors-1,axis=1)[:,:n_neighbors]
+        else:
+            nearest = np.tile(np.arange(len(candidates)),(len(out),1))
+        nearest_distances = np.take_along_axis(out,nearest,axis=1)
+        order = np.argsort(nearest_distances,axis=1,kind='stable')
+        neighbors[start:start+len(out)] = candidates[np.take_along_axis(nearest,order,axis=1)]
+        distances[start:start+len(out)] = np.take_along_axis(nearest_distances,order,axis=1)
+    return neighbors,distances
+
+
+def find_nearest_neighbours(model,entities,n_neighbors=10,entities_subset=None,type_distance='euclidian'):
+    """
+    Returns the nearest neighbours of the entities with the embeddings of model (NumpyEmbeddingModel, EmbeddingCache or ampligraph model),
+    as ampligraph.discovery.find_nearest_neighbours but without TensorFlow (an entity is its own nearest neighbour when it is a candidate).
+
+    Returns :
+    neighbors : numpy array (number of entities, n_neighbors) of entities
+    distances : numpy array (number of entities, n_neighbors)
+    """
+    if isinstance(model,NumpyEmbeddingModel):
+        return model.find_nearest_neighbours(entities,n_neighbors=n_neighbors,entities_subset=entities_subset,type_distance=type_distance)
+    if entities_subset is None:
+        entities_subset = sorted(model.ent_to_idx,key=model.ent_to_idx.get)
+    candidates = np.asarray(entities_subset,dtype=object).reshape(-1)
+    return get_nearest_neighbours(model.get_embeddings(np.asarray(entities)),model.get_embeddings(candidates),candidates,n_neighbors,type_distance)
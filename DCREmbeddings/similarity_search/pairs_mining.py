@@ -1,15 +1,21 @@
 """This file contains modules to draw pairs of similar instances."""
 
-from ampligraph.discovery import find_nearest_neighbours
-import pandas as pd
+import hashlib
 import numpy as np
-import copy
-from scipy.spatial import distance
+import math
+import mmap
+import os
+import sys
 
+from distance_kernels import fill_distances,fill_euclidean_distances
+from embedding_cache import get_distance_for_pair,get_distances_for_pairs,get_distance_per_degree
+from instrumentation import increment,stage,timed,update_max
 
-def get_matrix_similarity_pairs(model,instances_tc,mode='mixed',instances_t0='instances_t0',instances_t1='instances_t1'):
+
+@timed('get_matrix_similarity_pairs')
+def get_matrix_similarity_pairs(model,instances_tc,mode='mixed',instances_t0='instances_t0',instances_t1='instances_t1',block_size=1024,memmap_path=None,type_distance='euclidian'):
     """
-    Getting the euclidean distance between pairs of studied instances of a target class.
+    Getting the distance (euclidean by default) between pairs of studied instances of a target class.
     The instances of a pair can differ on the treatment (mode=treatment_sort), or created independently of their treatment values. (mode=mixed)
     
     Parameters :
@@ -18,103 +24,193 @@ def get_matrix_similarity_pairs(model,instances_tc,mode='mixed',instances_t0='in
     mode : str
     instances_t0 : list of instances
     instances_t1 : list of instances
+    block_size : int
+        Number of rows of the matrix computed at once
+    memmap_path : str (by default = None)
+        If given, the matrix is written to (or reloaded from) this .npy file, see get_distance_matrix
+    type_distance : str (by default = 'euclidian')
+        Distance kernel, see distance_kernels.DISTANCE_KERNELS
 
     Returns :
     df : pandas dataframe
-        With euclidean distance between all pairs of instances
+        With distance between all pairs of instances (float32, inf on the diagonal in mixed mode)
     df_to_numpy : numpy array
-        array version of the df
+        array version of the df (the df is a view on this array)
     """
     if mode == 'mixed':
-        df = pd.DataFrame(columns=instances_tc,index=instances_tc)
-        for t_ in instances_tc:
-            neighbors, dist = find_nearest_neighbours(model,
-                                                entities=[t_],
-                                                n_neighbors=len(instances_tc)-1,
-                                                entities_subset=instances_tc)
-            for i in range(len(neighbors[0])):
-                df.loc[neighbors[0][i],t_] = round(dist[0][i],3)
-
-        df = df.fillna(100)
-        df_to_numpy = df.to_numpy()
-        np.fill_diagonal(df_to_numpy, 100)
-        return df,df_to_numpy
-    
+        distance_matrix,row_labels,col_labels = get_distance_matrix(model,instances_tc,block_size=block_size,memmap_path=memmap_path,type_distance=type_distance)
     elif mode == 'treatment_sort':
-        df_ = pd.DataFrame(columns=instances_t0,index=instances_t1)
-        for t_ in instances_t0:
-            neighbors, dist = find_nearest_neighbours(model,
-                                                entities=[t_],
-                                                n_neighbors=len(instances_t1)-1,
-                                                entities_subset=instances_t1)
-            for i in range(len(neighbors[0])):
-                df_.loc[neighbors[0][i],t_] = round(dist[0][i],3)
+        distance_matrix,row_labels,col_labels = get_distance_matrix(model,instances_t1,instances_t0,block_size=block_size,memmap_path=memmap_path,type_distance=type_distance)
+    else:
+        print("This mode does not exist, please switch to mixed or treatment_sort.")
+        return None
+
+    import pandas as pd
+
+    df = pd.DataFrame(distance_matrix,index=row_labels,columns=col_labels,copy=False)
+    return df,distance_matrix
+
+
+def get_distance_matrix(model,instances_rows,instances_cols=None,block_size=1024,memmap_path=None,type_distance='euclidian'):
+    """
+    Returns the distance matrix between the embeddings of two lists of instances.
+
+    All the embeddings are obtained with a single call to model.get_embeddings.
+    The distances are then computed per block of rows into a contiguous float32 array, with the kernel type_distance
+    (for the euclidean distance, the Gram-matrix trick ||a-b||² = ||a||² + ||b||² - 2a.b).
+    If instances_cols is None, the matrix is squared on instances_rows and its diagonal is set to inf.
+
+    With memmap_path, the matrix is written block by block to a memory-mapped .npy file (out-of-core) and its labels to
+    a _labels.npz file next to it, with the kernel and a fingerprint of the embeddings (see get_embeddings_fingerprint).
+    If these files already exist for the same instances, kernel and embeddings, the matrix is reloaded without being recomputed :
+    a matrix stored with another model (e.g. retrained), or without fingerprint, is computed again.
+
+    Parameters :
+    model : ampligraph EmbeddingModel
+    instances_rows : list of instances
+    instances_cols : list of instances (by default = None)
+    block_size : int
+        Number of rows of the matrix computed at once
+    memmap_path : str (by default = None)
+        Path of the .npy file of the matrix
+    type_distance : str (by default = 'euclidian')
+        Distance kernel, see distance_kernels.DISTANCE_KERNELS
+
+    Returns :
+    distance_matrix : numpy array of shape (len(instances_rows),len(instances_cols))
+    row_labels : numpy array
+        Instance of each row
+    col_labels : numpy array
+        Instance of each column
+    """
+    squared = instances_cols is None
+    with stage('embeddings'):
+        embeddings_rows,embeddings_cols,row_labels,col_labels = get_embeddings_rows_cols(model,instances_rows,instances_cols)
+    fingerprint = None
+    if memmap_path is not None:
+        fingerprint = get_embeddings_fingerprint(embeddings_rows,embeddings_cols)
+        if os.path.exists(memmap_path):
+            distance_matrix,stored_row_labels,stored_col_labels = load_distance_matrix(memmap_path)
+            stored_distance,stored_fingerprint = get_stored_metadata(memmap_path)
+            if np.array_equal(stored_row_labels,row_labels) and np.array_equal(stored_col_labels,col_labels) and stored_distance == type_distance and stored_fingerprint == fingerprint:
+                return distance_matrix,stored_row_labels,stored_col_labels
+            print('The instances, the distance or the embeddings of the stored matrix are different, the matrix is computed again.')
+            del distance_matrix
+
+    shape = (len(row_labels),len(col_labels))
+    update_max('matrix_cells',shape[0]*shape[1])
+    update_max('matrix_bytes',4*shape[0]*shape[1])
+    if memmap_path is None:
+        distance_matrix = np.empty(shape,dtype=np.float32)
+    else:
+        distance_matrix = np.lib.format.open_memmap(memmap_path,mode='w+',dtype=np.float32,shape=shape)
+    with stage('distance_matrix'):
+        fill_distances(embeddings_rows,embeddings_cols,distance_matrix,type_distance,block_size)
+    if squared:
+        np.fill_diagonal(distance_matrix,np.inf)
+
+    if memmap_path is not None:
+        distance_matrix.flush()
+        np.savez(get_labels_path(memmap_path),row_labels=row_labels,col_labels=col_labels,type_distance=type_distance,fingerprint=fingerprint)
+        del distance_matrix
+        return load_distance_matrix(memmap_path)
+    return distance_matrix,row_labels,col_labels
 
-        df_ = df_.fillna(200)
-        df_to_numpy = df_.to_numpy()
-        return df_,df_to_numpy
+
+def load_distance_matrix(memmap_path,mode='r'):
+    """
+    Returns a distance matrix stored by get_distance_matrix as a read-only memory-mapped array, with its labels.
+    """
+    distance_matrix = np.load(memmap_path,mmap_mode=mode)
+    labels = np.load(get_labels_path(memmap_path))
+    return distance_matrix,labels['row_labels'],labels['col_labels']
+
+
+def get_stored_metadata(memmap_path):
+    """
+    Returns the kernel ('euclidian' for the matrices stored without it) and the fingerprint of the embeddings
+    (None for the matrices stored without it) of a memory-mapped distance matrix.
+    """
+    labels = np.load(get_labels_path(memmap_path))
+    type_distance = str(labels['type_distance']) if 'type_distance' in labels.files else 'euclidian'
+    fingerprint = str(labels['fingerprint']) if 'fingerprint' in labels.files else None
+    return type_distance,fingerprint
 
 
-def get_pairs_from_matrix_and_threshold(df,distance_threshold,strategy='greedy',mode='mixed'):
+def get_embeddings_fingerprint(embeddings_rows,embeddings_cols):
+    """
+    Returns a hash of the float32 embeddings of the rows and columns of a distance matrix.
+    It is stored with a memory-mapped matrix so that the matrix of another model is not reused.
+    """
+    hash_ = hashlib.blake2b(digest_size=16)
+    for embeddings in [embeddings_rows,embeddings_cols]:
+        hash_.update(str(embeddings.shape).encode())
+        hash_.update(np.ascontiguousarray(embeddings,dtype=np.float32).tobytes())
+    return hash_.hexdigest()
+
+
+def get_labels_path(memmap_path):
+    """Returns the path of the file storing the labels of a memory-mapped distance matrix."""
+    return os.path.splitext(memmap_path)[0]+'_labels.npz'
+
+
+def get_embeddings_rows_cols(model,instances_rows,instances_cols=None):
+    """
+    Returns the float32 embeddings of the instances of the rows and columns with a single call to model.get_embeddings.
+    If instances_cols is None, the columns are the rows.
+
+    Returns :
+    embeddings_rows, embeddings_cols, row_labels, col_labels : numpy arrays
+    """
+    row_labels = np.asarray(instances_rows)
+    if instances_cols is None:
+        embeddings_rows = np.asarray(model.get_embeddings(entities=row_labels),dtype=np.float32)
+        return embeddings_rows,embeddings_rows,row_labels,row_labels
+
+    col_labels = np.asarray(instances_cols)
+    all_labels = np.concatenate([row_labels,col_labels])
+    embeddings = np.asarray(model.get_embeddings(entities=all_labels),dtype=np.float32)
+    return embeddings[:len(row_labels)],embeddings[len(row_labels):],row_labels,col_labels
+
+
+@timed('get_pairs_from_matrix_and_threshold')
+def get_pairs_from_matrix_and_threshold(df,distance_threshold,strategy='greedy',mode='mixed',row_labels=None,col_labels=None,max_candidates=None):
     """
     Returns the similar pairs of a target class given a threshold.
     
     Parameters :
-    df : pandas dataframe
+    df : pandas dataframe (or numpy array with row_labels and col_labels)
         With euclidean distance between all pairs of instances 
     distance_threshold : float
         Threshold on the distance for selecting similar instances
     strategy : string (by default = 'greedy')
         Strategy to obtain the pairs. Can be greedy or optimal
+    row_labels, col_labels : numpy arrays (by default = None)
+        Instances of the rows and columns when df is a numpy array
+    max_candidates : int (by default = None)
+        Maximum number of candidate pairs held in memory, see get_matching_from_matrix
 
     Returns :
     pairs_similar_instances : list
         All pairs of similar instances 
     """
-    df__ = copy.deepcopy(df)
-    df_to_numpy = df__.to_numpy()
-    min_value = df_to_numpy.min()
-    pairs_similar_instances = []
-    
-    if strategy == 'greedy':
-        if min_value >= distance_threshold:
-            return pairs_similar_instances
-        else:
-            while min_value < distance_threshold:
-                # get position
-                position = np.where(df_to_numpy==min_value)
-
-                # add to set of pairs
-                first_instance = list(df.columns)[position[1][0]]
-                second_instance = list(df.index)[position[0][0]]
-                pairs_similar_instances.append([first_instance,second_instance])
-
-                # replace value
-                if mode=='mixed': # squared matrix - we update 2 values
-                    df_to_numpy[position[0][0]] = [100]
-                    df_to_numpy[:,position[1][0]] = [100]
-                elif mode == 'treatment_sort': # only one value to update
-                    df_to_numpy[position[0][0]] = [100]
-
-                #update min
-                min_value = df_to_numpy.min()
-
-            return pairs_similar_instances            
-
-    elif strategy == 'optimal':
-        return pairs_similar_instances
-
-    else:
+    if strategy not in ['greedy','optimal']:
         print("This stratedy does not exist, please switch to greedy or optimal.")
         return None
 
+    distance_matrix,row_labels,col_labels = get_matrix_and_labels(df,row_labels,col_labels)
+    mode = get_matching_mode(mode,distance_matrix.shape,row_labels,col_labels)
+    rows,cols = get_matching_from_matrix(distance_matrix,distance_threshold,strategy=strategy,mode=mode,max_candidates=max_candidates)
+    return get_pairs_from_indexes(rows,cols,row_labels,col_labels)
 
-def get_pairs_from_matrix_and_proportion(df,number_total_instances,proportion=0.05,mode='mixed'):
+
+@timed('get_pairs_from_matrix_and_proportion')
+def get_pairs_from_matrix_and_proportion(df,number_total_instances,proportion=0.05,mode='mixed',row_labels=None,col_labels=None,max_candidates=None):
     """
     Returns the closer pairs of a target class given a proportion of pairs to create.
     
     Parameters :
-    df : pandas dataframe
+    df : pandas dataframe (or numpy array with row_labels and col_labels)
         With euclidean distance between all pairs of instances 
     proportion : float
         Proportion of pairs to create
@@ -123,11 +219,10 @@ def get_pairs_from_matrix_and_proportion(df,number_total_instances,proportion=0.
     pairs_closer_instances : list
         The closer pairs of instances given the proportion
     """
-    df__ = copy.deepcopy(df)
-    df_to_numpy = df__.to_numpy()
-    pairs_closer_instances = []
+    distance_matrix,row_labels,col_labels = get_matrix_and_labels(df,row_labels,col_labels)
+    mode = get_matching_mode(mode,distance_matrix.shape,row_labels,col_labels)
     
-    number_possible_pairs = min(df.shape[0],df.shape[1])
+    number_possible_pairs = min(distance_matrix.shape[0],distance_matrix.shape[1])
     number_pairs_total = number_total_instances*(number_total_instances-1)/2
     number_to_reach = number_pairs_total*proportion
     
@@ -136,45 +231,379 @@ def get_pairs_from_matrix_and_proportion(df,number_total_instances,proportion=0.
         
     print('Number of pairs to build : ',number_to_reach)
 
-    while len(pairs_closer_instances) < number_to_reach:
-        # get position
-        min_value = df_to_numpy.min()
-        max_value = df_to_numpy.max()
-        position = np.where(df_to_numpy==min_value)
+    rows,cols = get_matching_from_matrix(distance_matrix,np.inf,mode=mode,max_pairs=math.ceil(number_to_reach),max_candidates=max_candidates)
+    return get_pairs_from_indexes(rows,cols,row_labels,col_labels)
 
-        # add to set of pairs
-        first_instance = list(df.columns)[position[1][0]]
-        second_instance = list(df.index)[position[0][0]]
-        pairs_closer_instances.append([first_instance,second_instance])
 
-        # replace value
-        if mode=='mixed': # squared matrix - we update 2 values
-            df_to_numpy[position[0][0]] = [max_value]
-            df_to_numpy[:,position[1][0]] = [max_value]
-        elif mode == 'treatment_sort': # only one value to update
-            df_to_numpy[position[0][0]] = [max_value]
-            
-    return pairs_closer_instances
+def get_matrix_and_labels(df,row_labels=None,col_labels=None):
+    """
+    Returns the distance matrix as a numpy array (or a sparse candidate graph in COO format) with the instances of its rows and columns.
+    """
+    pd = sys.modules.get('pandas') # a dataframe can only exist if pandas is already imported
+    if pd is not None and isinstance(df,pd.DataFrame):
+        return df.to_numpy(),np.asarray(df.index),np.asarray(df.columns)
+    if is_sparse(df): # candidate graph of an approximate nearest neighbours index
+        return df.tocoo(),np.asarray(row_labels),np.asarray(col_labels)
+    return df,np.asarray(row_labels),np.asarray(col_labels)
 
 
-def get_distance_for_degree(dic_distance_per_d,degree):
-    if degree in list(dic_distance_per_d.keys()):
-        all_values_degree = dic_distance_per_d[degree]
-        return np.mean(all_values_degree)
+def get_matching_mode(mode,shape,row_labels=None,col_labels=None):
+    """
+    Returns the mode of the matching of a matrix.
+    The mixed mode needs a squared matrix with the same instances as rows and columns. Otherwise (e.g. a treatment_sort matrix
+    matched with the default mode), the rows and the columns are masked separately, as in treatment_sort.
+    """
+    if mode != 'mixed':
+        return mode
+    if shape[0] != shape[1]:
+        return 'treatment_sort'
+    if row_labels is not None and col_labels is not None and not np.array_equal(np.asarray(row_labels),np.asarray(col_labels)):
+        return 'treatment_sort'
+    return mode
+
+
+def is_memory_mapped(matrix):
+    """
+    Returns True if the matrix is a view of a memory-mapped file, e.g. the array of a dataframe built on the np.memmap
+    returned by get_distance_matrix (df.to_numpy() is then a plain ndarray whose base is the np.memmap).
+    """
+    while matrix is not None:
+        if isinstance(matrix,(np.memmap,mmap.mmap)):
+            return True
+        matrix = getattr(matrix,'base',None)
+    return False
+
+
+def is_sparse(matrix):
+    """
+    Returns True if the matrix is a scipy sparse matrix.
+    scipy.sparse is not imported here : a sparse matrix can only exist if it is already imported.
+    """
+    sparse = sys.modules.get('scipy.sparse')
+    return sparse is not None and sparse.issparse(matrix)
+
+
+def get_pairs_from_indexes(rows,cols,row_labels,col_labels):
+    """
+    Returns the pairs [column instance, row instance] of the matched indexes.
+    """
+    increment('pairs_matched',len(rows))
+    row_labels,col_labels = np.asarray(row_labels).tolist(),np.asarray(col_labels).tolist()
+    return [[col_labels[c],row_labels[r]] for r,c in zip(rows.tolist(),cols.tolist())]
+
+
+@timed('matching')
+def get_matching_from_matrix(distance_matrix,distance_threshold,strategy='greedy',mode='mixed',max_pairs=None,max_candidates=None,block_size=1024):
+    """
+    Returns the one-to-one matching of the rows and columns of a distance matrix under a distance threshold.
+
+    With the greedy strategy, the candidate edges are sorted once and the closest available pair is selected at each step.
+    With the optimal strategy, the matching is a minimum-cost bipartite assignment maximizing the number of pairs under the threshold.
+    In mixed mode, the matrix is squared and symmetric : an instance is used at most once, either as a row or as a column
+    (a matrix that is not squared is matched as in treatment_sort, see get_matching_mode).
+
+    Parameters :
+    distance_matrix : numpy array or scipy sparse matrix
+        The sparse matrix is a candidate graph where the missing entries are pairs that are not candidates
+    distance_threshold : float
+    strategy : string (by default = 'greedy')
+    mode : string (by default = 'mixed')
+    max_pairs : int (by default = None)
+        Maximum number of pairs to build (greedy strategy)
+    max_candidates : int (by default = None)
+        Maximum number of candidate edges held in memory (greedy strategy on a dense matrix).
+        The matrix is then streamed by blocks of rows. This is the default for the memory-mapped matrices
+        (also when they are given through the dataframe of get_matrix_similarity_pairs), with at most the edges of one block of rows.
+    block_size : int
+        Number of rows read at once when the matrix is streamed
+
+    Returns :
+    rows, cols : numpy arrays
+        Row and column indexes of the matched pairs, in the order they were selected
+    """
+    mode = get_matching_mode(mode,distance_matrix.shape)
+    if strategy == 'greedy':
+        if not is_sparse(distance_matrix) and max_candidates is None and is_memory_mapped(distance_matrix):
+            max_candidates = block_size*distance_matrix.shape[1]
+        if not is_sparse(distance_matrix) and max_candidates is not None:
+            return get_greedy_matching_by_block(distance_matrix,distance_threshold,mode=mode,max_pairs=max_pairs,max_candidates=max_candidates,block_size=block_size)
+        values,rows,cols = get_candidate_edges(distance_matrix,distance_threshold,mode)
+        return get_greedy_matching(rows,cols,distance_matrix.shape,mode=mode,max_pairs=max_pairs)
+    elif strategy == 'optimal':
+        return get_optimal_matching(distance_matrix,distance_threshold,mode=mode)
+
+
+def get_candidate_edges(distance_matrix,distance_threshold,mode='mixed'):
+    """
+    Returns the edges of the matrix under the distance threshold sorted by distance.
+    Ties are kept in the row-major order of the matrix. In mixed mode, only the upper triangle is kept.
+
+    Returns :
+    values, rows, cols : numpy arrays
+    """
+    mode = get_matching_mode(mode,distance_matrix.shape)
+    if is_sparse(distance_matrix):
+        return get_candidate_edges_sparse(distance_matrix,distance_threshold,mode)
+
+    under_threshold = distance_matrix < distance_threshold
+    if mode == 'mixed':
+        under_threshold = np.triu(under_threshold,k=1)
+    rows,cols = np.nonzero(under_threshold)
+    values = distance_matrix[rows,cols]
+    order = np.argsort(values,kind='stable')
+    return values[order],rows[order],cols[order]
+
+
+def get_candidate_edges_sparse(candidate_graph,distance_threshold,mode='mixed'):
+    """
+    Returns the edges of a sparse candidate graph under the distance threshold sorted by distance.
+    In mixed mode, the edges (i,j) and (j,i) are merged into the edge (min(i,j),max(i,j)).
+
+    Returns :
+    values, rows, cols : numpy arrays
+    """
+    candidate_graph = candidate_graph.tocoo()
+    values,rows,cols = candidate_graph.data,candidate_graph.row.astype(np.intp),candidate_graph.col.astype(np.intp)
+    under_threshold = values < distance_threshold
+    values,rows,cols = values[under_threshold],rows[under_threshold],cols[under_threshold]
+    if mode == 'mixed':
+        rows,cols = np.minimum(rows,cols),np.maximum(rows,cols)
+        not_self = rows != cols
+        values,rows,cols = values[not_self],rows[not_self],cols[not_self]
+    order = np.lexsort((cols,rows,values))
+    values,rows,cols = values[order],rows[order],cols[order]
+    if mode == 'mixed': # keeping the first (closest) occurrence of each edge
+        _,first_index = np.unique(rows.astype(np.int64)*candidate_graph.shape[1]+cols,return_index=True)
+        first_index.sort()
+        values,rows,cols = values[first_index],rows[first_index],cols[first_index]
+    return values,rows,cols
+
+
+def get_greedy_matching(rows,cols,shape,mode='mixed',max_pairs=None,row_used=None,col_used=None):
+    """
+    Greedy one-to-one matching over edges already sorted by distance.
+    Each edge is kept if its row and its column are not already matched (masks on the rows and the columns).
+    The masks (bytearrays) can be given to continue a matching, they are updated in place.
+
+    Returns :
+    rows, cols : numpy arrays
+        Row and column indexes of the matched pairs
+    """
+    mode = get_matching_mode(mode,shape)
+    if mode == 'mixed': # squared matrix - rows and columns are the same instances
+        if row_used is None:
+            row_used = bytearray(shape[0])
+        col_used = row_used
+        number_possible_pairs = (shape[0]-sum(row_used))//2
     else:
-        print('Degree can not be found')
-        return None
+        if row_used is None:
+            row_used = bytearray(shape[0])
+        if col_used is None:
+            col_used = bytearray(shape[1])
+        number_possible_pairs = min(shape[0]-sum(row_used),shape[1]-sum(col_used))
+    if max_pairs is not None:
+        number_possible_pairs = min(number_possible_pairs,max_pairs)
+
+    matched = []
+    if number_possible_pairs <= 0:
+        return np.array(matched,dtype=np.intp),np.array(matched,dtype=np.intp)
+    for k,(r,c) in enumerate(zip(rows.tolist(),cols.tolist())):
+        if row_used[r] or col_used[c]:
+            continue
+        row_used[r] = 1
+        col_used[c] = 1
+        matched.append(k)
+        if len(matched) == number_possible_pairs:
+            break
+    matched = np.array(matched,dtype=np.intp)
+    return rows[matched],cols[matched]
+
+
+@timed('matching_by_block')
+def get_greedy_matching_by_block(distance_matrix,distance_threshold,mode='mixed',max_pairs=None,max_candidates=None,block_size=1024):
+    """
+    Greedy one-to-one matching streamed over the blocks of rows of a dense (or memory-mapped) matrix with a bounded memory.
+
+    The interval [0,distance_threshold) is split into bands holding at most max_candidates edges each (from a histogram of the distances).
+    The bands are matched in increasing order : the edges of a band are collected block by block, sorted, and matched greedily
+    with the masks of the previous bands. As all the edges of a band are closer than the edges of the next bands,
+    the result is the same as the greedy matching over all the sorted edges.
+
+    Returns :
+    rows, cols : numpy arrays
+        Row and column indexes of the matched pairs
+    """
+    bands = get_distance_bands(distance_matrix,distance_threshold,mode,max_candidates,block_size)
+    row_used = bytearray(distance_matrix.shape[0])
+    col_used = row_used if mode == 'mixed' else bytearray(distance_matrix.shape[1])
+    matched_rows,matched_cols = [],[]
+    for low,high in bands:
+        all_values,all_rows,all_cols = [],[],[]
+        row_free = np.frombuffer(bytes(row_used),dtype=np.uint8) == 0
+        col_free = np.frombuffer(bytes(col_used),dtype=np.uint8) == 0
+        for start,block in iter_blocks_under_threshold(distance_matrix,high,mode,block_size):
+            in_band = (block >= low) & np.isfinite(block)
+            in_band &= row_free[start:start+len(block),None]
+            in_band &= col_free[None,:]
+            rows,cols = np.nonzero(in_band)
+            all_values.append(block[rows,cols])
+            all_rows.append(rows+start)
+            all_cols.append(cols)
+        if not all_values:
+            continue
+        values,rows,cols = np.concatenate(all_values),np.concatenate(all_rows),np.concatenate(all_cols)
+        del all_values,all_rows,all_cols
+        order = np.argsort(values,kind='stable')
+        remaining_pairs = None if max_pairs is None else max_pairs-sum(len(r) for r in matched_rows)
+        rows,cols = get_greedy_matching(rows[order],cols[order],distance_matrix.shape,mode=mode,max_pairs=remaining_pairs,row_used=row_used,col_used=col_used)
+        matched_rows.append(rows)
+        matched_cols.append(cols)
+        if max_pairs is not None and sum(len(r) for r in matched_rows) >= max_pairs:
+            break
+
+    if not matched_rows:
+        return np.array([],dtype=np.intp),np.array([],dtype=np.intp)
+    return np.concatenate(matched_rows),np.concatenate(matched_cols)
 
 
-def get_distance_for_pair(pair_,model,type_distance='euclidian'):
+def iter_blocks_under_threshold(distance_matrix,distance_threshold,mode='mixed',block_size=1024):
     """
-    Returns the distance between the embedding vectors of a pair.
+    Iterates over the blocks of rows of the matrix, the entries over the threshold (or under the diagonal in mixed mode) being set to inf.
 
-    The type of the distance can be specified in : euclidian, TO_COMPLETE
+    Yields :
+    start : int
+        Index of the first row of the block
+    block : numpy array
     """
-    array_pair = np.array(pair_)
-    embedding_pair = model.get_embeddings(entities=np.array(array_pair))
-    if type_distance=='euclidian':
-        return distance.euclidean(embedding_pair[0],embedding_pair[1])
+    for start in range(0,distance_matrix.shape[0],block_size):
+        block = np.array(distance_matrix[start:start+block_size])
+        block[~(block < distance_threshold)] = np.inf
+        if mode == 'mixed':
+            block[~np.triu(np.ones(block.shape,dtype=bool),k=start+1)] = np.inf
+        yield start,block
+
+
+def get_distance_bands(distance_matrix,distance_threshold,mode='mixed',max_candidates=None,block_size=1024,number_bins=4096):
+    """
+    Returns the bands [low,high) of distances holding at most max_candidates edges of the matrix under the threshold.
+    A band can hold more edges if they all fall in the same bin of the histogram.
+    """
+    if max_candidates is None:
+        return [(-np.inf,distance_threshold)]
+
+    upper = distance_threshold
+    if not np.isfinite(upper): # the histogram needs the largest finite distance
+        upper = 0.
+        for start,block in iter_blocks_under_threshold(distance_matrix,np.inf,mode,block_size):
+            finite = block[np.isfinite(block)]
+            if len(finite) > 0:
+                upper = max(upper,float(finite.max()))
+        upper = np.nextafter(np.float32(upper),np.float32(np.inf))
+
+    bin_edges = np.linspace(0,upper,number_bins+1)
+    counts = np.zeros(number_bins,dtype=np.int64)
+    for start,block in iter_blocks_under_threshold(distance_matrix,distance_threshold,mode,block_size):
+        counts += np.histogram(block[np.isfinite(block)],bins=bin_edges)[0]
+
+    bands = []
+    low,number_in_band = -np.inf,0
+    for i in range(number_bins):
+        if number_in_band > 0 and number_in_band+counts[i] > max_candidates:
+            bands.append((low,bin_edges[i]))
+            low,number_in_band = bin_edges[i],0
+        number_in_band += counts[i]
+    bands.append((low,distance_threshold))
+    return bands
+
+
+def get_optimal_matching(distance_matrix,distance_threshold,mode='mixed'):
+    """
+    Minimum-cost bipartite assignment under the distance threshold.
+
+    The edges over the threshold receive a penalty larger than any sum of valid distances,
+    so the assignment first maximizes the number of pairs under the threshold and then minimizes their total distance.
+    A sparse candidate graph is matched without being expanded into a dense matrix, see get_optimal_matching_sparse.
+    In mixed mode, the assignment over the symmetric matrix can contain cycles (i->j->k->i) :
+    its edges are then selected greedily so that each instance appears in one pair only.
+
+    Returns :
+    rows, cols : numpy arrays
+        Row and column indexes of the matched pairs
+    """
+    if is_sparse(distance_matrix):
+        rows,cols = get_optimal_matching_sparse(distance_matrix,distance_threshold,mode=mode)
     else:
-        return None
\ No newline at end of file
+        # the problem is restricted to the instances having at least one candidate
+        valid = distance_matrix < distance_threshold
+        if mode == 'mixed':
+            np.fill_diagonal(valid,False)
+        rows_kept = np.flatnonzero(valid.any(axis=1))
+        cols_kept = np.flatnonzero(valid.any(axis=0))
+        if len(rows_kept) == 0:
+            return np.array([],dtype=np.intp),np.array([],dtype=np.intp)
+        sub_matrix = distance_matrix[np.ix_(rows_kept,cols_kept)].astype(np.float64)
+        sub_valid = valid[np.ix_(rows_kept,cols_kept)]
+
+        penalty = (min(sub_matrix.shape)+1)*(sub_matrix[sub_valid].max()+1)
+        cost = np.where(sub_valid,sub_matrix,penalty)
+        from scipy.optimize import linear_sum_assignment
+
+        rows,cols = linear_sum_assignment(cost)
+        keep = sub_valid[rows,cols]
+        order = np.argsort(sub_matrix[rows[keep],cols[keep]],kind='stable')
+        rows,cols = rows_kept[rows[keep][order]],cols_kept[cols[keep][order]]
+    if mode == 'mixed':
+        return get_greedy_matching(rows,cols,distance_matrix.shape,mode=mode)
+    return rows,cols
+
+
+def get_optimal_matching_sparse(candidate_graph,distance_threshold,mode='mixed'):
+    """
+    Minimum-cost assignment of a sparse candidate graph maximizing the number of pairs under the threshold.
+
+    scipy min_weight_full_bipartite_matching needs a matching covering all the rows : the graph is augmented with
+    a dummy column per row and a dummy row per column (at the penalty distance), and with the transposed candidate edges
+    between the dummy rows and the dummy columns (at distance 0). A pair (i,j) of candidates then costs its distance
+    and an unmatched row or column the penalty, so the memory stays linear in the number of candidate edges.
+
+    Returns :
+    rows, cols : numpy arrays
+        Row and column indexes of the matched pairs, sorted by distance
+    """
+    values,rows,cols = get_candidate_edges_sparse(candidate_graph,distance_threshold,mode)
+    if mode == 'mixed':
+        values,rows,cols = np.concatenate([values,values]),np.concatenate([rows,cols]),np.concatenate([cols,rows])
+    if len(values) == 0:
+        return np.array([],dtype=np.intp),np.array([],dtype=np.intp)
+    # the problem is restricted to the instances having at least one candidate
+    rows_kept,rows_sub = np.unique(rows,return_inverse=True)
+    cols_kept,cols_sub = np.unique(cols,return_inverse=True)
+    n_rows,n_cols = len(rows_kept),len(cols_kept)
+
+    values = values.astype(np.float64)
+    penalty = (min(n_rows,n_cols)+1)*(values.max()+1)
+    dummy_cols,dummy_rows = n_cols+np.arange(n_rows),n_rows+np.arange(n_cols)
+    augmented_rows = np.concatenate([rows_sub,np.arange(n_rows),dummy_rows,n_rows+cols_sub])
+    augmented_cols = np.concatenate([cols_sub,dummy_cols,np.arange(n_cols),n_cols+rows_sub])
+    # all the costs are shifted by 1 : every full matching has n_rows+n_cols edges, and no cost is an (ignored) zero
+    augmented_costs = 1+np.concatenate([values,np.full(n_rows+n_cols,penalty),np.zeros(len(values))])
+
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+    augmented_graph = csr_matrix((augmented_costs,(augmented_rows,augmented_cols)),shape=(n_rows+n_cols,n_cols+n_rows))
+    matched_rows,matched_cols = min_weight_full_bipartite_matching(augmented_graph)
+    keep = (matched_rows < n_rows) & (matched_cols < n_cols)
+    matched_rows,matched_cols = matched_rows[keep],matched_cols[keep]
+    distances = np.asarray(augmented_graph[matched_rows,matched_cols]).ravel()-1
+    order = np.argsort(distances,kind='stable')
+    return rows_kept[matched_rows[order]],cols_kept[matched_cols[order]]
+
+
+def get_distance_for_degree(dic_distance_per_d,degree):
+    if degree in list(dic_distance_per_d.keys()):
+        all_values_degree = dic_distance_per_d[degree]
+        return np.mean(all_values_degree)
+    else:
+        print('Degree can not be found')
+        return None
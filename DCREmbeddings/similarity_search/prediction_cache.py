@@ -0,0 +1,91 @@
+"""This file contains modules to cache the predictions of the embedding model during the threshold estimation."""
+
+import threading
+from collections import OrderedDict
+
+from instrumentation import increment
+
+
+class PredictionCache:
+    """
+    In-process cache of the top ranked objects predicted by the model, keyed by (entity, property, n).
+
+    The cache is shared by all the calls made inside get_measures_for_pairs, so the model only scores
+    the triples of an (entity, property) once, across the pairs and the recursion levels of the similarity measure.
+    The possible objects of each property are also kept (objects_of_property), as they do not depend on the entity.
+    The cache can be shared by threads.
+
+    Parameters :
+    max_size : int (by default = None)
+        Maximum number of entries, None for an unbounded cache
+    eviction : str (by default = 'lru')
+        Entry removed when the cache is full : 'lru' (least recently used) or 'fifo' (oldest inserted)
+    """
+
+    def __init__(self,max_size=None,eviction='lru'):
+        if eviction not in ['lru','fifo']:
+            raise ValueError("This eviction does not exist, please switch to lru or fifo.")
+        self.max_size = max_size
+        self.eviction = eviction
+        self.entries = OrderedDict()
+        self.objects_of_property = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self,key):
+        return key in self.entries
+
+    def get(self,key,default=None):
+        """Returns the cached value of the key (or default), and updates the hit/miss counters."""
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                increment('prediction_cache_hits')
+                if self.eviction == 'lru':
+                    self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+            increment('prediction_cache_misses')
+            return default
+
+    def put(self,key,value):
+        """Adds a value to the cache, removing entries if the cache is full."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.entries[key] = value
+            if self.max_size is not None:
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+
+    def clear(self):
+        """Removes all entries and resets the counters."""
+        self.entries.clear()
+        self.objects_of_property.clear()
+        self.hits,self.misses,self.evictions = 0,0,0
+
+    def get_stats(self):
+        """Returns the counters of the cache in a dictionnary."""
+        number_calls = self.hits+self.misses
+        return {
+            'size':len(self.entries),
+            'hits':self.hits,
+            'misses':self.misses,
+            'evictions':self.evictions,
+            'hit_rate':self.hits/number_calls if number_calls > 0 else 0.
+        }
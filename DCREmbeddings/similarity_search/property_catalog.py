@@ -0,0 +1,150 @@
+"""This file contains modules to precompute the properties of a knowledge graph used by the similarity measure."""
+
+import hashlib
+import math
+import os
+import pickle
+
+import numpy as np
+
+from instrumentation import stage
+from knowledge_graph import get_knowledge_graph
+
+
+class PropertyCatalog:
+    """
+    Catalog of the properties of a knowledge graph, built in one pass over the triples.
+
+    For each property, it stores :
+    - objects : the possible objects (numpy array, sorted as np.unique)
+    - max_out_degree, mean_out_degree : the observed functionality, i.e. the number of objects of a subject on the property
+    For each entity (subject or object of a triple), it stores :
+    - properties : the properties of its description (sorted)
+    - end_nodes : a bitmap, True if the entity is an end node (a type in type_end, or no description)
+    The catalog replaces the scans of X made by get_objects_of_property, get_properties_to_assess and end_node,
+    and can infer dic_functionality. It can be saved with save and loaded with load_property_catalog, to be built once per dataset.
+    The fingerprint of X, PATH_TYPE and type_end (see get_catalog_fingerprint) is stored so that a saved catalog of another KG is not reused.
+
+    Parameters :
+    X : numpy array of triples (or KnowledgeGraph)
+    PATH_TYPE : str
+    type_end : list of types
+    """
+
+    def __init__(self,X,PATH_TYPE,type_end):
+        kg = get_knowledge_graph(X)
+        self.PATH_TYPE = PATH_TYPE
+        self.type_end = list(type_end)
+        self.fingerprint = get_catalog_fingerprint(kg,PATH_TYPE,type_end)
+        type_end = set(type_end)
+
+        self.objects = {p_:np.array(sorted(objects_),dtype=object) for p_,objects_ in kg.pos.items()}
+        self.max_out_degree = {}
+        self.mean_out_degree = {}
+        number_subjects = {}
+        self.properties = {}
+        for s_,description_ in kg.spo.items():
+            self.properties[s_] = tuple(sorted(description_))
+            for p_,objects_ in description_.items():
+                self.max_out_degree[p_] = max(self.max_out_degree.get(p_,0),len(objects_))
+                self.mean_out_degree[p_] = self.mean_out_degree.get(p_,0)+len(objects_)
+                number_subjects[p_] = number_subjects.get(p_,0)+1
+        for p_ in self.mean_out_degree:
+            self.mean_out_degree[p_] /= number_subjects[p_]
+
+        # end nodes : entities typed in type_end, or without description (literals)
+        self.entities = np.array(list(dict.fromkeys(list(kg.spo)+list(kg.osp))),dtype=object)
+        self.entity_index = {e_:i for i,e_ in enumerate(self.entities)}
+        self.end_nodes = np.ones(len(self.entities),dtype=bool)
+        for s_,description_ in kg.spo.items():
+            self.end_nodes[self.entity_index[s_]] = any(type_ in type_end for type_ in description_.get(PATH_TYPE,[]))
+
+    def get_objects(self,property_):
+        """Returns the possible objects of the property."""
+        return self.objects.get(property_,np.array([],dtype=object))
+
+    def get_properties(self,entity_):
+        """Returns the properties of the description of the entity."""
+        return self.properties.get(entity_,())
+
+    def is_end_node(self,entity_):
+        """Returns True if the entity is an end node (an unknown entity is an end node)."""
+        index_ = self.entity_index.get(entity_)
+        return index_ is None or bool(self.end_nodes[index_])
+
+    def get_dic_functionality(self,properties=None,statistic='max'):
+        """
+        Returns the functionality of the properties inferred from the KG, in the format of dic_functionality.
+
+        Parameters :
+        properties : list of properties (by default = None, all properties)
+        statistic : str (by default = 'max')
+            'max' for the maximum out-degree, 'mean' for the mean out-degree (rounded up)
+        """
+        if statistic not in ['max','mean']:
+            raise ValueError("This statistic does not exist, please switch to max or mean.")
+        if properties is None:
+            properties = list(self.max_out_degree)
+        if statistic == 'max':
+            return {p_:self.max_out_degree[p_] for p_ in properties if p_ in self.max_out_degree}
+        return {p_:math.ceil(self.mean_out_degree[p_]) for p_ in properties if p_ in self.mean_out_degree}
+
+    def save(self,path):
+        """Saves the catalog with pickle."""
+        with open(path,'wb') as f:
+            pickle.dump(self,f,protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_property_catalog(path):
+    """Loads a catalog saved with PropertyCatalog.save."""
+    with open(path,'rb') as f:
+        return pickle.load(f)
+
+
+def get_catalog_fingerprint(X,PATH_TYPE,type_end,chunk_size=100000):
+    """
+    Returns a hash of the triples of X, PATH_TYPE and type_end.
+    It is stored in the catalog so that a catalog saved for another KG (or another PATH_TYPE or type_end) is not reused.
+    """
+    triples = get_knowledge_graph(X).X
+    hash_ = hashlib.blake2b(digest_size=16)
+    hash_.update(repr((str(PATH_TYPE),sorted(map(str,type_end)),triples.shape)).encode())
+    for start_ in range(0,len(triples),chunk_size):
+        hash_.update('\n'.join('\t'.join(map(str,triple_)) for triple_ in triples[start_:start_+chunk_size].tolist()).encode())
+    return hash_.hexdigest()
+
+
+LAST_PROPERTY_CATALOG = {'X':None,'length':None,'PATH_TYPE':None,'type_end':None,'catalog':None}
+
+
+def get_property_catalog(X,PATH_TYPE,type_end,path=None):
+    """
+    Returns the PropertyCatalog of X.
+    If path is given, the catalog is loaded from path if it exists and was built for the same X, PATH_TYPE and type_end
+    (same fingerprint), otherwise it is built and saved to path.
+    An existing PropertyCatalog given as X is returned as is.
+    The last catalog returned is kept : the calls on the same X (e.g. get_similarity_for_pair without catalog) build it once.
+    X should not be modified in place between the calls, or clear_property_catalog_cache should be called.
+    """
+    if isinstance(X,PropertyCatalog):
+        return X
+    if LAST_PROPERTY_CATALOG['X'] is X and LAST_PROPERTY_CATALOG['length'] == len(X) and LAST_PROPERTY_CATALOG['PATH_TYPE'] == PATH_TYPE and LAST_PROPERTY_CATALOG['type_end'] == list(type_end):
+        return LAST_PROPERTY_CATALOG['catalog']
+    catalog = None
+    if path is not None and os.path.exists(path):
+        catalog = load_property_catalog(path)
+        if getattr(catalog,'fingerprint',None) != get_catalog_fingerprint(X,PATH_TYPE,type_end):
+            print('The catalog of '+str(path)+' was built for another KG, PATH_TYPE or type_end, the catalog is built again.')
+            catalog = None
+    if catalog is None:
+        with stage('property_catalog'):
+            catalog = PropertyCatalog(X,PATH_TYPE,type_end)
+        if path is not None:
+            catalog.save(path)
+    LAST_PROPERTY_CATALOG.update(X=X,length=len(X),PATH_TYPE=PATH_TYPE,type_end=list(type_end),catalog=catalog)
+    return catalog
+
+
+def clear_property_catalog_cache():
+    """Releases the last PropertyCatalog returned by get_property_catalog."""
+    LAST_PROPERTY_CATALOG.update(X=None,length=None,PATH_TYPE=None,type_end=None,catalog=None)
@@ -1,6 +1,5 @@
 """This file contains modules to compute the similarity threshold with a model."""
 
-import matplotlib.pyplot as plt
 import numpy as np
 
 
@@ -16,6 +15,8 @@ def plot_distribution_measures(measures,KGE_model_name):
     Returns:
         Plots the distribution.
     """
+    import matplotlib.pyplot as plt
+
     list_distance = [measure[0] for measure in measures]
     list_similarity = [measure[1] for measure in measures]
 
@@ -33,13 +34,11 @@ def fit_model_on_measures(measures,model_degree):
     """
     Returns a fitted model on the measures and its r-squared score.
     """
-    x = [measure[0] for measure in measures]
-    y = [measure[1] for measure in measures]
+    x = np.array([measure[0] for measure in measures],dtype=float)
+    y = np.array([measure[1] for measure in measures],dtype=float)
     model = np.poly1d(np.polyfit(x, y, model_degree))
 
-    coeffs = np.polyfit(x, y, model_degree)
-    p = np.poly1d(coeffs)
-    yhat = p(x)
+    yhat = model(x)
     ybar = np.sum(y)/len(y)
     ssreg = np.sum((yhat-ybar)**2)
     sstot = np.sum((y - ybar)**2)
@@ -60,6 +59,8 @@ def plot_distribution_and_model(measures,fitted_model):
     Returns:
         Plots the distribution and the model.
     """
+    import matplotlib.pyplot as plt
+
     list_distance = [measure[0] for measure in measures]
     list_similarity = [measure[1] for measure in measures]
     
@@ -78,17 +79,126 @@ def plot_distribution_and_model(measures,fitted_model):
     plt.title(title_)
 
 
-def get_distance_threshold(fitted_model,SIMILARITY_THRESHOLD):
+def get_distance_threshold(fitted_model,SIMILARITY_THRESHOLD,distance_range=None):
     """
     Returns the distance threshold for matching similar instances given a similarity threshold.
     Assumption : the fitted_model is descreasing with the distance ()
+    With distance_range, the roots within the measured distances are preferred (see select_threshold_root),
+    as in get_distance_threshold_with_confidence.
     
     Parameters:
         fitted_model : numpy.poly1d
         SIMILARITY_THRESHOLD : float
+        distance_range : tuple (min distance, max distance) of the measures (by default = None)
         
     Returns:
         Distance threshold (float)
     """
     x0 = (fitted_model - SIMILARITY_THRESHOLD).roots
-    return x0.min().astype(float)
+    return select_threshold_root(x0[None,:],distance_range)[0]
+
+
+def select_threshold_root(roots,distance_range=None):
+    """
+    Returns the smallest real root of each row of roots (nan if a row has no real root).
+    If distance_range is given, the roots within the range are preferred.
+
+    Parameters:
+        roots : numpy array of shape (n,degree), complex or real
+        distance_range : tuple (min distance, max distance) (by default = None)
+
+    Returns:
+        numpy array of shape (n,)
+    """
+    roots = np.asarray(roots)
+    real = np.isclose(np.imag(roots),0,atol=1e-9)
+    values = np.where(real,np.real(roots),np.inf)
+    smallest = values.min(axis=1,initial=np.inf)
+    if distance_range is not None:
+        in_range = (values >= distance_range[0]) & (values <= distance_range[1])
+        smallest_in_range = np.where(in_range,values,np.inf).min(axis=1,initial=np.inf)
+        smallest = np.where(np.isfinite(smallest_in_range),smallest_in_range,smallest)
+    return np.where(np.isfinite(smallest),smallest,np.nan)
+
+
+def get_polynomial_roots(coeffs,SIMILARITY_THRESHOLD):
+    """
+    Returns the roots of the polynomials coeffs - SIMILARITY_THRESHOLD, computed at once as the eigenvalues of their companion matrices.
+
+    Parameters:
+        coeffs : numpy array of shape (n,degree+1), highest power first (as np.polyfit)
+        SIMILARITY_THRESHOLD : float
+
+    Returns:
+        numpy array of shape (n,degree), nan for the polynomials with a null leading coefficient
+    """
+    coeffs = np.array(coeffs,dtype=float)
+    coeffs[:,-1] -= SIMILARITY_THRESHOLD
+    n,degree = coeffs.shape[0],coeffs.shape[1]-1
+    roots = np.full((n,degree),np.nan,dtype=complex)
+    valid = coeffs[:,0] != 0
+    companion = np.zeros((valid.sum(),degree,degree))
+    companion[:,0,:] = -coeffs[valid,1:]/coeffs[valid,:1]
+    companion[:,np.arange(1,degree),np.arange(degree-1)] = 1
+    roots[valid] = np.linalg.eigvals(companion)
+    return roots
+
+
+def get_distance_threshold_with_confidence(measures,model_degree,SIMILARITY_THRESHOLD,n_bootstrap=2000,confidence=0.95,seed=None):
+    """
+    Returns the distance threshold and its bootstrap confidence interval.
+
+    The measures are resampled n_bootstrap times and the polynomial model is fitted on all the resamples in one batched least-squares solve
+    (the resamples are given as counts of each measure, which weight the normal equations).
+    The threshold of each resample is the smallest real root within the measured distances (see select_threshold_root).
+    A wide interval means that more pairs should be sampled before mining with the threshold.
+
+    Parameters:
+        measures : list of 2-elements lists [distance,similarity]
+        model_degree : int
+        SIMILARITY_THRESHOLD : float
+        n_bootstrap : int (by default = 2000)
+        confidence : float (by default = 0.95)
+        seed : int (by default = None)
+
+    Returns:
+        distance_threshold : float
+        confidence_interval : list [lower bound, upper bound]
+        proportion_without_threshold : float
+            Proportion of the resamples whose model never reaches the similarity threshold
+    """
+    x = np.array([measure[0] for measure in measures],dtype=float)
+    y = np.array([measure[1] for measure in measures],dtype=float)
+    n = len(x)
+    distance_range = (x.min(),x.max())
+
+    # scaling the distances on [-1,1] for the conditioning of the normal equations
+    center,scale = (x.max()+x.min())/2,(x.max()-x.min())/2
+    if scale == 0:
+        scale = 1.
+    vander = np.vander((x-center)/scale,model_degree+1)
+
+    # resamples as counts of each measure
+    rng = np.random.default_rng(seed)
+    draws = rng.integers(0,n,size=(n_bootstrap,n)) + n*np.arange(n_bootstrap)[:,None]
+    counts = np.bincount(draws.ravel(),minlength=n_bootstrap*n).reshape(n_bootstrap,n).astype(float)
+    counts = np.vstack([np.ones(n),counts])
+
+    # batched weighted least squares : (V^T W V) c = V^T W y
+    gram = np.einsum('bn,ni,nj->bij',counts,vander,vander)
+    moments = np.einsum('bn,ni,n->bi',counts,vander,y)
+    coeffs_scaled = np.einsum('bij,bj->bi',np.linalg.pinv(gram),moments)
+
+    # roots of the scaled polynomials, mapped back to the distances
+    roots = get_polynomial_roots(coeffs_scaled,SIMILARITY_THRESHOLD)*scale + center
+    thresholds = select_threshold_root(roots,distance_range)
+
+    distance_threshold = float(thresholds[0])
+    bootstrap_thresholds = thresholds[1:]
+    found = np.isfinite(bootstrap_thresholds)
+    alpha = (1-confidence)/2
+    if found.any():
+        confidence_interval = list(np.quantile(bootstrap_thresholds[found],[alpha,1-alpha]))
+    else:
+        confidence_interval = [np.nan,np.nan]
+    return distance_threshold,[float(i) for i in confidence_interval],float(1-found.mean())
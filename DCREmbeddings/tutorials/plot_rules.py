@@ -1,5 +1,7 @@
 def get_plots_from_df_degree(df_rules):
     """Given a dataframe with metric values, return plot with error bars"""
+    import matplotlib.pyplot as plt
+
     number_pairs = []
     error_list_low = []
     error_list_high= []
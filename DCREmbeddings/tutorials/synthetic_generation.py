@@ -1,6 +1,15 @@
 import uuid
 import random
-import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# the folder similarity_search/ should be in sys.path (set by the caller, as in Tutorial1)
+from instrumentation import increment,stage,timed
+from knowledge_graph import get_knowledge_graph
+
+TYPE_PROPERTY = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
 
 
 def get_description_for_generation(X,instance_writer):
@@ -11,6 +20,8 @@ def get_description_for_generation(X,instance_writer):
         X : KG (numpy array)
         instance_writer : URI of a writer instance
     """
+    X = get_knowledge_graph(X)
+
     # description of the writer
     dic_writer = get_description(X,instance_writer)
     
@@ -32,37 +43,37 @@ def get_description_for_generation(X,instance_writer):
 
 def get_description(X,instance):
     """Return description in dictionnary where a given instance is the subject"""
-    dic_description = {}
-    for triple in get_triples_where_instance_subject(X,instance):
-        if triple[1] in list(dic_description.keys()):
-            dic_description[triple[1]] = dic_description[triple[1]] + [triple[2]]
-        else:
-            dic_description[triple[1]] = [triple[2]]
-    return dic_description
+    kg = get_knowledge_graph(X)
+    return {p_:list(objects_) for p_,objects_ in kg.description(instance).items()}
 
 
 def get_triples_where_instance_subject(X,instance):
     """Return triples where instance is the subject"""
-    return [x for x in X if x[0]==instance]
+    kg = get_knowledge_graph(X)
+    return [[instance,p_,o_] for p_,objects_ in kg.description(instance).items() for o_ in objects_]
 
 
 def get_university_from_writer(X,instance_writer):
     """Return university URI where a writer studied"""
-    return [x[0] for x in X if x[1]=='http://dbpedia.org/ontology/hasForStudent' and x[2]==instance_writer][0]
+    kg = get_knowledge_graph(X)
+    return kg.reverse_edges(instance_writer,'http://dbpedia.org/ontology/hasForStudent')[0]
 
 
 def get_country_from_university(X,uni_instance):
     """Return country URI where a university is located"""
-    return [x[0] for x in X if x[1]=='http://dbpedia.org/ontology/isCountryOf' and x[2]==uni_instance][0]
+    kg = get_knowledge_graph(X)
+    return kg.reverse_edges(uni_instance,'http://dbpedia.org/ontology/isCountryOf')[0]
 
 
-def get_paths_to_change(X,instance_writer,dic_writer,dic_of_books,uni,dic_uni,country,dic_country,number_differences,blocked_p=[]):
+def get_paths_to_change(X,instance_writer,dic_writer,dic_of_books,uni,dic_uni,country,dic_country,number_differences,blocked_p=[],rng=None):
     """
     Given a number of differences, return dictionnary where keys are the URI to be modified and values the properties where they are to be modified.
     Parameters:
         number_differences : int
         blocked_p : list of properties that can not be modified
+        rng : random.Random (by default = None, the random module is used)
     """
+    rng = random if rng is None else rng
     p_writer = [[instance_writer,i] for i in list(dic_writer.keys())]
     p_book = []
     for book,dic_book in dic_of_books.items():
@@ -73,7 +84,7 @@ def get_paths_to_change(X,instance_writer,dic_writer,dic_of_books,uni,dic_uni,co
     properties_to_draw_from = p_writer + p_book + p_uni + p_country
     properties_to_draw_from = [p_ for p_ in properties_to_draw_from if p_[1] not in blocked_p]
     properties_to_draw_from.remove([uni,'http://dbpedia.org/ontology/hasForStudent'])
-    draw_properties = random.sample(properties_to_draw_from,number_differences)
+    draw_properties = rng.sample(properties_to_draw_from,number_differences)
     
     dic_paths_to_change = {p_[0]:[] for p_ in draw_properties}
     for p_ in draw_properties:
@@ -84,6 +95,7 @@ def get_paths_to_change(X,instance_writer,dic_writer,dic_of_books,uni,dic_uni,co
 
 def get_dic_with_type_and_nodes_modified(X,dic_paths_to_change):
     """Return type of the nodes modified"""
+    X = get_knowledge_graph(X)
     dic_types_modified = {}
     for node, paths_to_change in dic_paths_to_change.items():
         type_node = get_type(X,node)
@@ -94,34 +106,44 @@ def get_dic_with_type_and_nodes_modified(X,dic_paths_to_change):
     return dic_types_modified
 
 
-def draw_objects_from_p(X,instance_modified,p_,objects_to_avoid,number_draw):
-    """Given a property, return list of objects in its range that are randomly selected and not already expressed"""
-    type_instance_modified = get_type(X,instance_modified)
-    instances_with_type = get_instances_for_type(X,type_instance_modified)
-    objects_ = [x[2] for x in X if x[1]==p_ and x[2] not in objects_to_avoid and x[0] in instances_with_type]
-    return random.sample(objects_,number_draw)
+def draw_objects_from_p(X,instance_modified,p_,objects_to_avoid,number_draw,rng=None,pools=None):
+    """
+    Given a property, return list of objects in its range that are randomly selected and not already expressed
+    With pools (CandidatePools), the objects are drawn from the precomputed pool of the type and the property.
+    """
+    rng = random if rng is None else rng
+    kg = get_knowledge_graph(X)
+    type_instance_modified = get_type(kg,instance_modified)
+    if pools is not None:
+        return pools.sample(type_instance_modified,p_,objects_to_avoid,number_draw,rng=rng)
+    instances_with_type = get_instances_for_type(kg,type_instance_modified)
+    objects_to_avoid = set(objects_to_avoid)
+    objects_ = [o_ for s_ in dict.fromkeys(instances_with_type) for o_ in kg.objects(s_,p_) if o_ not in objects_to_avoid]
+    return rng.sample(objects_,number_draw)
 
 
-def get_new_triples_for_given_instance(X,former_instance,former_dic,dic_paths_to_change):
+def get_new_triples_for_given_instance(X,former_instance,former_dic,dic_paths_to_change,rng=None,pools=None):
     """
     Return new triples for an instance to be modified given the dictionnary indicating which properties to modify
     The instance in this function should be countries, universities or books
     New triples from the target class writer are created in another function
     """
+    rng = random if rng is None else rng
+    X = get_knowledge_graph(X)
     triples_to_add = []
     # creating new instance
     properties_to_change = dic_paths_to_change[former_instance]
     p_count = {p:properties_to_change.count(p) for p in properties_to_change}
-    new_dic = copy.deepcopy(former_dic)
+    new_dic = {p_:list(objects_) for p_,objects_ in former_dic.items()}
 
     # obtaining the new values
     for p_to_change,number_changed in p_count.items():
         former_objects = new_dic[p_to_change]
-        new_objects = random.sample(former_objects,len(former_objects)-number_changed)
-        new_dic[p_to_change] = new_objects + draw_objects_from_p(X,former_instance,p_to_change,former_objects,number_changed)
+        new_objects = rng.sample(former_objects,len(former_objects)-number_changed)
+        new_dic[p_to_change] = new_objects + draw_objects_from_p(X,former_instance,p_to_change,former_objects,number_changed,rng=rng,pools=pools)
 
     # adding the new triples
-    new_URI = uuid.uuid4().urn.split('uuid:')[1]
+    new_URI = get_new_URI(rng)
     for p_,list_value in new_dic.items():
         for v_ in list_value:
             triples_to_add.append([new_URI,p_,v_])
@@ -131,7 +153,8 @@ def get_new_triples_for_given_instance(X,former_instance,former_dic,dic_paths_to
 
 def get_type(X,instance):
     """Return type of an instance"""
-    types_ = [x[2] for x in X if x[0]==instance and x[1]=='http://www.w3.org/1999/02/22-rdf-syntax-ns#type']
+    kg = get_knowledge_graph(X)
+    types_ = kg.objects(instance,'http://www.w3.org/1999/02/22-rdf-syntax-ns#type')
     for t_ in types_:
         if 'dbpedia' in t_:
             return t_
@@ -139,7 +162,15 @@ def get_type(X,instance):
     
 def get_instances_for_type(X,type_):
     """Return list of instances of a given type"""
-    return [x[0] for x in X if x[1]=='http://www.w3.org/1999/02/22-rdf-syntax-ns#type' and x[2]==type_]
+    kg = get_knowledge_graph(X)
+    return list(kg.subjects('http://www.w3.org/1999/02/22-rdf-syntax-ns#type',type_))
+
+
+def get_new_URI(rng=None):
+    """Return a new URI (uuid4), drawn from rng if given so that it is deterministic"""
+    if rng is None or rng is random:
+        return str(uuid.uuid4())
+    return str(uuid.UUID(int=rng.getrandbits(128),version=4))
 
 
 def get_if_instance_exist(X,node,dic_paths_to_change):
@@ -147,47 +178,65 @@ def get_if_instance_exist(X,node,dic_paths_to_change):
     Given an instance to be modified and its associated dictionnary with the modification to make,
     verifies if another instance verifying the modification already exists in the KG
     Return the instance if it exists    
+
+    The candidates are obtained with the inverted index (property, value) -> subjects of the KG :
+    the sets of the shared values are intersected from the smallest one, the sets of the modified values are removed,
+    and the search stops as soon as there is no candidate left.
     """
+    X = get_knowledge_graph(X)
     type_node = get_type(X,node)
-    description_node = get_description(X,node)
-    
-    valid_instances = [instance for instance in get_instances_for_type(X,type_node) if instance != node]
-    p_to_share = [p_ for p_ in list(description_node.keys()) if p_ not in dic_paths_to_change[node]]
+    description_node = X.description(node)
     p_differ = dic_paths_to_change[node]
-    
-    for p_ in p_to_share:
-        if type(description_node[p_])==list:
-            for value in description_node[p_]:
-                instances_with_p = [x[0] for x in X if x[1]==p_ and x[2]==value]
-                valid_instances = [i for i in valid_instances if i in instances_with_p]
-        else:
-            instances_with_p = [x[0] for x in X if x[1]==p_ and x[2]==description_node[p_]]
-            valid_instances = [i for i in valid_instances if i in instances_with_p]
-        
+
+    sets_to_share = [X.subjects_set('http://www.w3.org/1999/02/22-rdf-syntax-ns#type',type_node)]
+    sets_to_share += [X.subjects_set(p_,value) for p_,values_ in description_node.items() if p_ not in p_differ for value in values_]
+    sets_to_differ = [X.subjects_set(p_,value) for p_ in dict.fromkeys(p_differ) for value in description_node.get(p_,[])]
+
+    # most selective sets first
+    sets_to_share.sort(key=len)
+    sets_to_differ.sort(key=len,reverse=True)
+    valid_instances = set(sets_to_share[0])
+    valid_instances.discard(node)
+    for set_ in sets_to_share[1:]:
         if len(valid_instances)==0:
             return 0
-        
-    for p_ in p_differ:
-        if type(description_node[p_])==list:
-            for value in description_node[p_]:
-                instances_with_p = [x[0] for x in X if x[1]==p_ and x[2]==value]
-                valid_instances = [i for i in valid_instances if i not in instances_with_p]
-        else:
-            instances_with_p = [x[0] for x in X if x[1]==p_ and x[2]==description_node[p_]]
-            valid_instances = [i for i in valid_instances if i not in instances_with_p]
-        
+        valid_instances &= set_
+    for set_ in sets_to_differ:
         if len(valid_instances)==0:
             return 0
-    
-    return valid_instances
+        valid_instances -= set_
+    if len(valid_instances)==0:
+        return 0
 
+    # instances in the order of the KG
+    return [instance for instance in dict.fromkeys(get_instances_for_type(X,type_node)) if instance in valid_instances]
 
-def get_triples_to_add(X,instance_writer,dic_paths_to_change,dic_writer,dic_of_books,uni,dic_uni,country,dic_country):
+
+def get_if_instances_exist(X,requests_):
+    """
+    Batch form of get_if_instance_exist : return the result of each request (node, dic_paths_to_change)
+    The KG indexes are built once, and the requests with the same node and modified properties are resolved once.
+    """
+    X = get_knowledge_graph(X)
+    results = {}
+    list_results = []
+    for node,dic_paths_to_change in requests_:
+        key_ = (node,tuple(sorted(dic_paths_to_change[node])))
+        if key_ not in results:
+            results[key_] = get_if_instance_exist(X,node,dic_paths_to_change)
+        list_results.append(results[key_])
+    return list_results
+
+
+def get_triples_to_add(X,instance_writer,dic_paths_to_change,dic_writer,dic_of_books,uni,dic_uni,country,dic_country,rng=None,pools=None):
     """
     Return new URI and triples for an instance of a target class
+    With a random.Random as rng, the drawings and the new URIs are deterministic.
     """
+    rng = random if rng is None else rng
+    X = get_knowledge_graph(X)
     triples_to_add = []
-    new_writer_URI = uuid.uuid4().urn.split('uuid:')[1]
+    new_writer_URI = get_new_URI(rng)
     
     # sorting the nodes to modify in order of interest
     dic_types_modified = get_dic_with_type_and_nodes_modified(X,dic_paths_to_change)
@@ -197,12 +246,12 @@ def get_triples_to_add(X,instance_writer,dic_paths_to_change,dic_writer,dic_of_b
         uni = dic_types_modified['http://dbpedia.org/ontology/University'][0]
         valid_instances = get_if_instance_exist(X,uni,dic_paths_to_change)
         if valid_instances: # we try to find if there is an existing node with these differences
-            instance_selected = random.sample(valid_instances,1)
+            instance_selected = rng.sample(valid_instances,1)[0]
             # the instance exists : only need to create new predicate
             triples_to_add.append([instance_selected,'http://dbpedia.org/ontology/hasForStudent',new_writer_URI])
             
         else:
-            new_uni_URI,triples_to_add_university = get_new_triples_for_given_instance(X,uni,dic_uni,dic_paths_to_change)
+            new_uni_URI,triples_to_add_university = get_new_triples_for_given_instance(X,uni,dic_uni,dic_paths_to_change,rng=rng,pools=pools)
             triples_to_add.append([new_uni_URI,'http://dbpedia.org/ontology/hasForStudent',new_writer_URI])
             triples_to_add = triples_to_add + triples_to_add_university
             uni = new_uni_URI
@@ -215,7 +264,7 @@ def get_triples_to_add(X,instance_writer,dic_paths_to_change,dic_writer,dic_of_b
         # we add the university to another country
         countries = get_instances_for_type(X,'http://dbpedia.org/ontology/Country')
         countries_to_draw_from = [c for c in countries if c != country]
-        country_selected = random.sample(countries_to_draw_from,1)[0]
+        country_selected = rng.sample(countries_to_draw_from,1)[0]
         triples_to_add.append([country_selected,'http://dbpedia.org/ontology/isCountryOf',uni])
     else:
         triples_to_add.append([country,'http://dbpedia.org/ontology/isCountryOf',uni])
@@ -225,12 +274,12 @@ def get_triples_to_add(X,instance_writer,dic_paths_to_change,dic_writer,dic_of_b
         for book in dic_types_modified['http://dbpedia.org/ontology/Book']:
             valid_instances = get_if_instance_exist(X,book,dic_paths_to_change)
             if valid_instances:
-                instance_selected = random.sample(valid_instances,1)
+                instance_selected = rng.sample(valid_instances,1)[0]
                 # the instance exists : only need to create new predicate
-                triples_to_add.append([new_URI,'http://dbpedia.org/ontology/author',instance_selected])
+                triples_to_add.append([new_writer_URI,'http://dbpedia.org/ontology/author',instance_selected])
             else:
                 dic_book = dic_of_books[book]
-                new_book_URI, triples_to_add_book = get_new_triples_for_given_instance(X,book,dic_book,dic_paths_to_change)
+                new_book_URI, triples_to_add_book = get_new_triples_for_given_instance(X,book,dic_book,dic_paths_to_change,rng=rng,pools=pools)
                 triples_to_add.append([new_writer_URI,'http://dbpedia.org/ontology/author',new_book_URI])
                 triples_to_add = triples_to_add + triples_to_add_book
                         
@@ -239,21 +288,20 @@ def get_triples_to_add(X,instance_writer,dic_paths_to_change,dic_writer,dic_of_b
         # creating new instance
         properties_to_change = dic_paths_to_change[instance_writer]
         p_count = {p:properties_to_change.count(p) for p in properties_to_change}
-        new_writer_dic = copy.deepcopy(dic_writer)
+        new_writer_dic = {p_:list(objects_) for p_,objects_ in dic_writer.items()}
 
         # obtaining the new values
         for p_to_change,number_changed in p_count.items():
             former_objects = new_writer_dic[p_to_change]
-            new_objects = random.sample(former_objects,len(former_objects)-number_changed)
-            new_writer_dic[p_to_change] = new_objects + draw_objects_from_p(X,instance_writer,p_to_change,former_objects,number_changed)
+            new_objects = rng.sample(former_objects,len(former_objects)-number_changed)
+            new_writer_dic[p_to_change] = new_objects + draw_objects_from_p(X,instance_writer,p_to_change,former_objects,number_changed,rng=rng,pools=pools)
 
         # adding the new triples
         for p_,list_value in new_writer_dic.items():
             if p_ == 'http://dbpedia.org/ontology/author': # one must be careful about 
                 for book in list_value:
-                    if 'http://dbpedia.org/ontology/Book' in dic_types_modified.keys():
-                        if book not in dic_types_modified['http://dbpedia.org/ontology/Book']:
-                            triples_to_add.append([new_writer_URI,p_,book])
+                    if book not in dic_types_modified.get('http://dbpedia.org/ontology/Book',[]):
+                        triples_to_add.append([new_writer_URI,p_,book])
             else:
                 for v_ in list_value:
                     triples_to_add.append([new_writer_URI,p_,v_])
@@ -262,11 +310,220 @@ def get_triples_to_add(X,instance_writer,dic_paths_to_change,dic_writer,dic_of_b
         for p_,list_value in dic_writer.items():
             if p_ == 'http://dbpedia.org/ontology/author': # only add books that are not modified - the modified are already added
                 for book in list_value:
-                    if 'http://dbpedia.org/ontology/Book' in dic_types_modified.keys():
-                        if book not in dic_types_modified['http://dbpedia.org/ontology/Book']:
-                            triples_to_add.append([new_writer_URI,p_,book])
+                    if book not in dic_types_modified.get('http://dbpedia.org/ontology/Book',[]):
+                        triples_to_add.append([new_writer_URI,p_,book])
             else:
                 for v_ in list_value:
                     triples_to_add.append([new_writer_URI,p_,v_])
                     
     return new_writer_URI, triples_to_add
+
+
+####### BULK GENERATION
+
+class CandidatePools:
+    """
+    Pools of the objects that can be drawn for a property of an instance, per (type, property).
+
+    The pool of (type, property) holds the objects of the property on all instances of the type, as an array of counts
+    (an object expressed by several instances is drawn with a higher probability, as in draw_objects_from_p).
+    The pools are built once from the KG and updated incrementally with add_triples.
+
+    Parameters:
+        X : KG (numpy array or KnowledgeGraph)
+    """
+
+    def __init__(self,X):
+        kg = get_knowledge_graph(X)
+        self.types_of_instance = {}
+        self.pending = {}
+        self.pools = {}
+        for type_ in kg.objects_of_predicate(TYPE_PROPERTY):
+            for s_ in dict.fromkeys(kg.subjects(TYPE_PROPERTY,type_)):
+                self.types_of_instance.setdefault(s_,[]).append(type_)
+                for p_,objects_ in kg.description(s_).items():
+                    for o_ in objects_:
+                        self.add_object(type_,p_,o_)
+
+    def add_object(self,type_,property_,object_,count=1):
+        """Adds count occurrences of an object to the pool of (type_, property_)"""
+        pool_ = self.pools.get((type_,property_))
+        if pool_ is None:
+            pool_ = {'objects':[],'index':{},'counts':np.zeros(8,dtype=np.int64)}
+            self.pools[(type_,property_)] = pool_
+        i = pool_['index'].get(object_)
+        if i is None:
+            i = len(pool_['objects'])
+            if i == len(pool_['counts']): # doubling the capacity of the counts
+                pool_['counts'] = np.concatenate([pool_['counts'],np.zeros(i,dtype=np.int64)])
+            pool_['objects'].append(object_)
+            pool_['index'][object_] = i
+        pool_['counts'][i] += count
+
+    def add_triples(self,triples):
+        """
+        Adds new triples (e.g. the generated triples) to the pools.
+        The triples of a subject without a type are kept until its type is added.
+        """
+        triples = [list(t_) for t_ in triples]
+        for s_,p_,o_ in triples:
+            if p_ == TYPE_PROPERTY and o_ not in self.types_of_instance.get(s_,[]):
+                self.types_of_instance.setdefault(s_,[]).append(o_)
+                for p_pending,o_pending in self.pending.pop(s_,[]):
+                    self.add_object(o_,p_pending,o_pending)
+        for s_,p_,o_ in triples:
+            types_ = self.types_of_instance.get(s_)
+            if types_ is None:
+                self.pending.setdefault(s_,[]).append((p_,o_))
+                continue
+            for type_ in types_:
+                self.add_object(type_,p_,o_)
+
+    def get_range(self,type_,property_):
+        """Returns the objects of the pool of (type_, property_) and their counts"""
+        pool_ = self.pools.get((type_,property_))
+        if pool_ is None:
+            return [],np.zeros(0,dtype=np.int64)
+        return pool_['objects'],pool_['counts'][:len(pool_['objects'])]
+
+    def sample(self,type_,property_,objects_to_avoid,number_draw,rng=None):
+        """
+        Returns number_draw objects drawn without replacement from the pool of (type_, property_), weighted by their counts.
+        The objects of objects_to_avoid are not drawn. Raises ValueError if the pool is too small (as random.sample).
+        """
+        rng = random if rng is None else rng
+        objects_,counts = self.get_range(type_,property_)
+        counts = counts.copy()
+        pool_ = self.pools.get((type_,property_),{'index':{}})
+        for o_ in objects_to_avoid:
+            i = pool_['index'].get(o_)
+            if i is not None:
+                counts[i] = 0
+        if number_draw < 0 or number_draw > counts.sum():
+            raise ValueError("Sample larger than population or is negative")
+        drawn = []
+        for _ in range(number_draw):
+            cumulative = np.cumsum(counts)
+            i = int(np.searchsorted(cumulative,rng.random()*cumulative[-1],side='right'))
+            drawn.append(objects_[i])
+            counts[i] -= 1
+        return drawn
+
+
+def get_generation_pools(X):
+    """Return the CandidatePools used to draw new objects, computed once for the whole KG"""
+    return CandidatePools(X)
+
+
+def get_synthetic_instance(X,instance_writer,number_differences,blocked_p=[],rng=None,pools=None):
+    """
+    Return URI of a synthetic writer created from instance_writer with number_differences differences, its triples and the modified paths
+    """
+    X = get_knowledge_graph(X)
+    # obtain RDF description from instance
+    dic_writer, dic_of_books, uni, dic_uni, country, dic_country = get_description_for_generation(X,instance_writer)
+
+    # apply number of differences
+    dic_paths_to_change = get_paths_to_change(X,instance_writer,dic_writer,dic_of_books,uni,dic_uni,country,dic_country,number_differences,blocked_p,rng=rng)
+
+    # obtain new triples to add to the KG
+    new_writer_URI, triples_to_add = get_triples_to_add(X,instance_writer,dic_paths_to_change,dic_writer,dic_of_books,uni,dic_uni,country,dic_country,rng=rng,pools=pools)
+
+    return new_writer_URI, triples_to_add, dic_paths_to_change
+
+
+@timed('get_synthetic_instances')
+def get_synthetic_instances(X,seed_instances,degree_schedule,blocked_p=[],seed=0,n_jobs=1,return_failures=False):
+    """
+    Return synthetic instances created in bulk from seed instances of the target class.
+
+    The KG indexes and the pools of objects are built once (see get_generation_pools), and the new triples are returned in one array.
+    Each synthetic instance has its own random generator seeded by (seed, index of the instance),
+    so the result only depends on seed, whatever the number of processes.
+
+    Parameters:
+        X : KG (numpy array or KnowledgeGraph)
+        seed_instances : list of writers from which the synthetic instances are created (used in turn)
+        degree_schedule : dictionnary number of differences -> number of synthetic instances to create
+        blocked_p : list of properties that can not be modified
+        seed : int
+        n_jobs : int (by default = 1)
+            Number of processes, None or -1 for all the CPUs
+        return_failures : bool (by default = False)
+            A synthetic instance can not be created if its seed instance does not have enough paths (or objects) to apply the differences.
+            If False, a ValueError listing the failed seed instances is raised. If True, they are skipped and returned.
+
+    Returns:
+        triples_to_add : numpy array of shape (n,3)
+        dic_truncated_pairs : dictionnary tuple of the modified properties -> list of pairs [original writer, synthetic writer]
+        list_synthetic_instances : list of the synthetic writers
+        failed_jobs : list of [seed instance, number of differences, error message] (only if return_failures)
+    """
+    jobs = []
+    for number_differences,number_instances in sorted(degree_schedule.items()):
+        for k in range(number_instances):
+            jobs.append((len(jobs),seed_instances[k%len(seed_instances)],number_differences))
+
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs == 1:
+        kg = get_knowledge_graph(X)
+        with stage('generation_pools'):
+            pools = get_generation_pools(kg)
+        state_ = {'X':kg,'pools':pools,'blocked_p':blocked_p,'seed':seed}
+        results = [get_synthetic_instance_for_job(job_,state_) for job_ in jobs]
+    else:
+        X = X.X if hasattr(X,'X') else X
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=n_jobs,mp_context=context,initializer=init_worker_generation,initargs=(X,blocked_p,seed)) as executor:
+            results = list(executor.map(get_synthetic_instance_for_job,jobs,chunksize=max(1,len(jobs)//(4*n_jobs))))
+
+    failed_jobs = [failure_ for _,failure_ in results if failure_ is not None]
+    results = [result_ for result_,_ in results if result_ is not None]
+    increment('synthetic_instances',len(results))
+    if len(failed_jobs) > 0 and not return_failures:
+        raise ValueError('{} synthetic instance(s) could not be created (seed instance, number of differences, error) : {}'.format(
+            len(failed_jobs),', '.join(str(tuple(failure_)) for failure_ in failed_jobs[:10])+(' ...' if len(failed_jobs) > 10 else '')))
+
+    # one preallocated array for the new triples
+    triples_to_add = np.empty((sum(len(result_[2]) for result_ in results),3),dtype=object)
+    dic_truncated_pairs = {}
+    list_synthetic_instances = []
+    start = 0
+    for instance_writer,new_writer_URI,triples_,paths_ in results:
+        triples_to_add[start:start+len(triples_)] = triples_
+        start += len(triples_)
+        dic_truncated_pairs.setdefault(paths_,[]).append([instance_writer,new_writer_URI])
+        list_synthetic_instances.append(new_writer_URI)
+    if return_failures:
+        return triples_to_add, dic_truncated_pairs, list_synthetic_instances, failed_jobs
+    return triples_to_add, dic_truncated_pairs, list_synthetic_instances
+
+
+WORKER_STATE = {}
+
+
+def init_worker_generation(X,blocked_p,seed):
+    """Initializes a worker process of get_synthetic_instances : builds the KG indexes and the pools of the worker"""
+    WORKER_STATE['X'] = get_knowledge_graph(X)
+    WORKER_STATE['pools'] = get_generation_pools(WORKER_STATE['X'])
+    WORKER_STATE['blocked_p'] = blocked_p
+    WORKER_STATE['seed'] = seed
+
+
+def get_synthetic_instance_for_job(job_,state_=None):
+    """
+    Return the result of a job (index, writer, number of differences) and its failure :
+    ((original writer, synthetic writer, triples, tuple of the modified properties), None) if the synthetic instance is created,
+    (None, [writer, number of differences, error message]) if the writer does not have enough paths (or objects) to apply the differences
+    """
+    if state_ is None:
+        state_ = WORKER_STATE
+    index_,instance_writer,number_differences = job_
+    rng = random.Random('{}-{}'.format(state_['seed'],index_))
+    try:
+        new_writer_URI,triples_,dic_paths_to_change = get_synthetic_instance(state_['X'],instance_writer,number_differences,state_['blocked_p'],rng=rng,pools=state_['pools'])
+    except ValueError as error:
+        return None,[instance_writer,number_differences,str(error)]
+    paths_ = tuple(sorted(p_ for properties_ in dic_paths_to_change.values() for p_ in properties_))
+    return (instance_writer,new_writer_URI,triples_,paths_),None